@@ -1,38 +1,59 @@
-import os
-from flask import Flask, request, abort, jsonify
+from flask import Flask, Response, request, abort, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
 
-from models import setup_db, Question, Category
-
-QUESTIONS_PER_PAGE = 10
-
-# Helper Functions
-###########################
-
-# Pagination
-def paginate(request, selection):
-    page = request.args.get('page', 1, type=int)    # 1 is the default if not given
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-
-    # It's more efficient to do the slicing on selection rather than further post-processing
-    # by slicing the questions list next (as given in class example code)
-    questions = [ question.format() for question in selection[start:end] ]
-    return questions
+from models import db, setup_db, Question, QuestionCount
+from bulk import import_questions, export_questions, MissingColumns, MAX_DELETE_IDS
+from catalogue import setup_catalogue, current_catalogue
+from category_cache import category_cache
+from compression import setup_compression
+from config import load_config
+from db_pool import pool_stats
+from db_replicas import use_replica
+from metrics import setup_metrics
+from pagination import paginate, paginate_ids, MAX_ID
+from rate_limit import setup_rate_limit
+from quiz import question_pool, parse_difficulty, parse_level, parse_previous_questions, parse_seed, ROUND_SIZE
+from response_cache import make_response_cache
+from search import search_questions
+from serialization import jsonify, setup_json, listing_options, compact_listing
+from sessions import make_session_store
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    # Settings come from TRIVIA_* environment variables, overridden by test_config
+    app.config.update(load_config(test_config))
+    setup_db(app, app.config['DATABASE_PATH'])
+    setup_json(app)
 
     # Sets up CORS to allow '*' for origins on all API routes and resources.
     # I changed the frontend routes to include /api/ in the path to make this
     # a little more secure by being less permissive than the broadest strokes (CORS(app))
     CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+    # Per-endpoint latency and query stats at /metrics, if METRICS_ENABLED is on
+    setup_metrics(app, db)
+
+    # Per-client rate limits and per-worker concurrency caps on searches and quiz turns,
+    # if RATE_LIMIT_ENABLED is on.  Before the other hooks, so a request turned away
+    # doesn't cost anything more.
+    setup_rate_limit(app)
+
+    # Where server-side quiz sessions live (in memory unless configured otherwise)
+    session_store = make_session_store(app.config)
+
+    # Cached question listings, shared by every worker with RESPONSE_CACHE=file:///<dir>
+    response_cache = make_response_cache(app.config)
+    app.extensions['response_cache'] = response_cache
+
+    # gzip (or brotli) for the clients that take it, see compression.py
+    setup_compression(app)
+
+    # Every question's id, category and difficulty in memory, if CATALOGUE_ENABLED is on
+    setup_catalogue(app)
+
 
     # Set Access-Control-Allow headers after each request
     # (after_request decorator runs after the route handler for a request, but 
@@ -69,6 +90,17 @@ def create_app(test_config=None):
             "message": "Unprocessable Entity"
         })
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        # Unlike the others, this one keeps its status code (and Retry-After header), so
+        # clients and proxies know to back off
+        retry_after = getattr(error, 'retry_after', None)
+        return jsonify({
+            "success": False,
+            "error": 429,
+            "message": "Too Many Requests"
+        }), 429, {'Retry-After': str(retry_after)} if retry_after is not None else {}
+
     @app.errorhandler(500)
     def server_error(error):
         return jsonify({
@@ -78,65 +110,153 @@ def create_app(test_config=None):
         })
 
 
+    @app.route('/api/status/pool')
+    def get_pool_status():
+        '''How busy this worker's database connection pool is, and how long requests have
+        waited for a connection, for sizing workers against Postgres' connection limit'''
+        replicas = app.extensions.get('db_replicas')
+        return jsonify({
+            'success': True,
+            'pool': pool_stats(db.get_engine(app)),
+            'replicas': replicas.status() if replicas is not None else [],
+            'settings': {key: app.config[key] for key in ('DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_TIMEOUT')}
+        })
+
+
+    @app.route('/api/status/rate_limit')
+    def get_rate_limit_status():
+        '''How many searches and quiz turns this worker has served and turned away (for being
+        over a client's rate, or too busy), and the budgets it's enforcing'''
+        limiter = app.extensions.get('rate_limiter')
+        return jsonify({
+            'success': True,
+            'enabled': limiter is not None,
+            'groups': limiter.status() if limiter is not None else {}
+        })
+
+
     @app.route('/api/categories')
     def get_categories():
         try:
-            # Simple request, should return with no issues, but catch failure case
-            categories = Category.query.all()
-            cat_dict = {cat.id:cat.type for cat in categories}
-        
-            return jsonify({
+            # Simple request, should return with no issues, but catch failure case.
+            # Served from the category cache, so this usually doesn't touch the database.
+            cat_dict = category_cache.all()
+            version = category_cache.version
+            body = {
                 "success": True,
-                "categories": cat_dict
-            })
+                "categories": cat_dict,
+                "categories_version": version
+            }
+
+            # ?with_counts=1 adds how many questions are in each category, from the counters
+            with_counts = request.args.get('with_counts', 0, type=int)
+            if with_counts:
+                catalogue = current_catalogue()
+                counts = catalogue.counts() if catalogue is not None else QuestionCount.all()
+                body["question_counts"] = {cat_id: counts.get(cat_id, 0) for cat_id in cat_dict}
+                body["total_questions"] = catalogue.count() if catalogue is not None else QuestionCount.get()
+
+            response = jsonify(body)
         except:
             abort(500)  # Internal server error if can't do this
 
+        if with_counts:
+            # Counts change with every new question, so don't let these be cached
+            return response
+
+        # Let clients (and proxies) revalidate with If-None-Match and get a 304 back
+        # when the categories haven't changed since they last asked
+        response.set_etag(category_cache.etag())
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
 
     @app.route('/api/questions')
+    @response_cache.cached
     def get_questions():
-        questions = Question.query.all()
-        total_questions = len(questions)
+        try:
+            # ?fields=id,question and ?with_categories=0 trim the response for clients
+            # that don't need all of it
+            fields, with_categories = listing_options(request.args)
+        except ValueError:
+            abort(400)
 
-        # q_list = [q.format() for q in questions]  # Unpaginated
-        q_list = paginate(request, questions)
+        # LIMIT/OFFSET (or ?after_id= keyset) happens in the database now, so only the 10
+        # rows on the page ever get loaded, and the total comes from the question counters.
+        # With a catalogue, the page's ids and the total come from memory instead.
+        catalogue = current_catalogue()
+        if catalogue is not None:
+            q_list, total_questions = paginate_ids(request, catalogue.ids())
+        else:
+            q_list, total_questions = paginate(request, Question.query, Question.id, QuestionCount.get())
         
-        categories = Category.query.all()
-        cat_dict = {cat.id:cat.type for cat in categories}
+        cat_dict = category_cache.all()
         
         if len(q_list) == 0:
             # Requested a page past what exists
             abort(404)
 
-        return jsonify({
+        return jsonify(compact_listing({
             'success': True,
             'questions': q_list,
             'total_questions': total_questions,
             'categories': cat_dict,
+            'categories_version': category_cache.version,
             'current_category': None
-        })
+        }, fields, with_categories))
 
 
     @app.route('/api/questions/<int:q_id>', methods=['DELETE'])
     def delete_question(q_id):
-        question = Question.query.get(q_id)
+        # Deletes in one statement (DELETE ... RETURNING on Postgres) rather than loading the
+        # question first, and tells us if it existed
+        try:
+            deleted = Question.delete_ids([q_id])
+        except:
+            db.session.rollback()
+            abort(422)  # Understood the request and it was formatted properly, but was unable to process request
 
-        if not question:
+        if not deleted:
             # Question id doesn't exist
             abort(404)
-        else:
-            # Exists, try to delete it
-            try:
-                question.delete()   # Has own method
 
-                return jsonify({
-                    'success': True,
-                    'deleted': q_id
-                })
-            except:
-                abort(422)  # Understood the request and it was formatted properly, but was unable to process request
-                
-    
+        return jsonify({
+            'success': True,
+            'deleted': q_id
+        })
+
+
+    @app.route('/api/questions', methods=['DELETE'])
+    def delete_questions():
+        '''Deletes a list of questions in one transaction, e.g. {"ids": [4, 5, 1000]}.  Each
+        id gets its own result, with a 404 error for the ones that don't exist.'''
+        try:
+            ids = request.json['ids']
+        except:
+            abort(400)
+        # Only real ids, nothing int() would turn into one (4.9 or true would delete 4 or 1)
+        if not isinstance(ids, list) or not all(isinstance(q_id, int) and not isinstance(q_id, bool) for q_id in ids):
+            abort(400)
+        ids = list(dict.fromkeys(ids))     # In the order given, without repeats
+
+        if len(ids) == 0 or len(ids) > MAX_DELETE_IDS:
+            abort(400)
+
+        try:
+            deleted = {row.id for row in Question.delete_ids(ids)}
+        except:
+            db.session.rollback()
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'deleted': [q_id for q_id in ids if q_id in deleted],
+            'results': [{'id': q_id, 'success': True} if q_id in deleted else
+                        {'id': q_id, 'success': False, 'error': 404, 'message': 'Not found'}
+                        for q_id in ids]
+        })
+
+
     @app.route('/api/questions', methods=['POST'])
     def add_question():
         '''This endpoint not only POSTs new questions, but is also how the search terms
@@ -145,20 +265,28 @@ def create_app(test_config=None):
 
         if "searchTerm" in form_data:
             search_term = form_data['searchTerm'].strip()
+            try:
+                # Search results have no categories map, but can be cut down to ?fields=
+                fields = listing_options(request.args)[0]
+            except ValueError:
+                abort(400)
+            use_replica()   # Searching only reads, like a GET
 
-            # Use filter, not filter_by when doing LIKE search (i=insensitive to case)
-            questions = Question.query.filter(Question.question.ilike(f'%{search_term}%')).all()   # Wildcards search before and after
-            
-            # Still good idea to paginate since search could return a ton (entire list if you search "", 
-            # which project doesn't exclude).  However Search Questions view in Frontend doesn't already include
-            # support for pagination, so this time I won't do it (or you can't see all valid search results).
-            #q_list = paginate(request, questions)
-            q_list = [q.format() for q in questions]
+            # Served from a search index (pg_trgm on Postgres) and ranked best match first.
+            # The Search Questions view in the frontend doesn't support pagination, so we
+            # still return every result by default, unless a ?page= is asked for.
+            page = request.args.get('page', None, type=int)
+            q_list, total_questions = search_questions(search_term, page)
 
-            return jsonify({
+            if page is not None and len(q_list) == 0:
+                # Requested a page past what exists
+                abort(404)
+
+            return jsonify(compact_listing({
                 "success": True,
-                "questions": q_list
-            })
+                "questions": q_list,
+                "total_questions": total_questions
+            }, fields))
         
         else:
             # Otherwise, adding a new question through form
@@ -167,10 +295,15 @@ def create_app(test_config=None):
             if (form_data['question'].strip() == "") or (form_data['answer'].strip() == ""):
                 # Don't populate blanks, return a bad request error
                 abort(400)
+            try:
+                # A whole number from 1 to 5, nothing int() would round or stretch to one
+                difficulty = parse_level(form_data.get('difficulty'))
+            except ValueError:
+                abort(400)
 
             try:
                 new_question = Question(question=form_data['question'].strip(), answer=form_data['answer'].strip(), \
-                    category=form_data['category'], difficulty=form_data['difficulty'])
+                    category=int(form_data['category']), difficulty=difficulty)
                 new_question.insert()
             except:
                 # Issue creating new question?  422 means understood the request but couldn't do it
@@ -182,24 +315,91 @@ def create_app(test_config=None):
             })
 
 
+    # Content types the bulk endpoints understand, by the ?format= name used for exports
+    BULK_FORMATS = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv'
+    }
+
+    @app.route('/api/questions/bulk', methods=['POST'])
+    def bulk_add_questions():
+        '''Adds a whole trivia pack of questions at once, streamed in as NDJSON or CSV.  Bad
+        rows are skipped and reported back rather than failing the whole import.'''
+        if request.mimetype not in BULK_FORMATS.values():
+            abort(400)
+
+        try:
+            added, num_errors, errors = import_questions(request.stream, request.mimetype, category_cache.all())
+        except MissingColumns as e:
+            # A 400 like the error handler's, but saying which columns the CSV needs
+            return jsonify({
+                "success": False,
+                "error": 400,
+                "message": "Bad Request",
+                "missing_columns": e.columns
+            })
+        except:
+            # Couldn't get the questions into the database (batches before the one that
+            # failed are already committed)
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'added': added,
+            'num_errors': num_errors,
+            'errors': errors
+        })
+
+
+    @app.route('/api/questions/export')
+    def export_all_questions():
+        '''Streams every question out as NDJSON (the default) or ?format=csv'''
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in BULK_FORMATS:
+            abort(400)
+
+        # stream_with_context keeps the database session around while the generator runs,
+        # which is after this function has returned
+        rows = export_questions(BULK_FORMATS[fmt], json_backend=app.config['JSON_BACKEND'])
+        return Response(stream_with_context(rows),
+                        mimetype=BULK_FORMATS[fmt],
+                        headers={'Content-Disposition': f'attachment; filename=questions.{fmt}'})
+
+
     @app.route('/api/categories/<int:cat_id>/questions')
+    @response_cache.cached
     def get_category_questions(cat_id):
         '''GET all the questions based on a particular category'''
-        questions = Question.query.filter_by(category=str(cat_id)).all()
+        try:
+            fields, with_categories = listing_options(request.args)
+        except ValueError:
+            abort(400)
 
-        q_list = paginate(request, questions)
+        # Unknown categories (including ids too big for the database to even compare) have
+        # no questions to look for
+        category = category_cache.get(cat_id) if cat_id <= MAX_ID else None
+        if category is None:
+            abort(404)
+
+        catalogue = current_catalogue()
+        if catalogue is not None:
+            q_list, total_questions = paginate_ids(request, catalogue.ids(cat_id))
+        else:
+            questions = Question.query.filter_by(category=cat_id)
+            q_list, total_questions = paginate(request, questions, Question.id, QuestionCount.get(cat_id))
 
         if len(q_list) == 0:
             # Requested a page past what exists
             abort(404)
 
-        return jsonify({
+        return jsonify(compact_listing({
             'success': True,
             'questions': q_list,
-            'total_questions': len(questions),
-            'categories': Category.query.get(cat_id).format(),
+            'total_questions': total_questions,
+            'categories': category,
+            'categories_version': category_cache.version,
             'current_category': cat_id
-        })
+        }, fields, with_categories))
 
 
     @app.route('/api/quizzes', methods=['POST'])
@@ -213,74 +413,119 @@ def create_app(test_config=None):
         # Get questions of category.  Category 0 is ALL.
         request_data = request.json
         try:
-            request_cat = request_data['quiz_category']['id']
+            request_cat = int(request_data['quiz_category']['id'])
+            prev_qs = parse_previous_questions(request_data['previous_questions'])    # This is a list by id
+            # Optional, e.g. 3 or {min: 1, max: 5, ramp: 10} (see quiz.py)
+            difficulty = parse_difficulty(request_data.get('difficulty'))
+            # Optional, for everyone with the same seed to get the same questions
+            seed = parse_seed(request_data, difficulty)
         except:
-            # Category must be supplied in this format
+            # Category and previous questions must be supplied in this format
             abort(400)
 
-        if request_cat == 0:
-            # Get questions from all categories
-            questions = Question.query.all()
-        else:
-            # Get questions for only one category
-            questions = Question.query.filter_by(category=str(request_cat)).all()
+        # Picking a question only reads, so it can come from a read replica
+        use_replica()
 
-        # Format the questions
-        questions = [q.format() for q in questions]
-        
-        # print("Questions before filtering:")
-        # for q in questions:
-        #     print(q['id'])
-
-        # First prune out the questions from the set that have already been asked.
-        # This is much more performant (with larger datasets) than randomly iterating over and over picking
-        # questions and then testing if they've been asked before.  Can't guarantee maximum latency that way.
-        # For example, could get sequence of several identical random numbers in a row.
-        try:
-            prev_qs = request_data['previous_questions']    # This is a list by id
-        except:
-            # Previous questions must be supplied
-            abort(400)
-        
-        # print("Previous questions:")
-        # print(prev_qs)
-        
-        # Prune the list
-        pruned_qs = []
-        for q in questions:
-            if q['id'] not in prev_qs:
-                pruned_qs.append(q)
-
-        # print("Questions after filtering:")
-        # for q in pruned_qs:
-        #     print(q['id'])
-
-        # Make sure this isn't an empty set (played all the questions)
-        # If we've used al the questions up, return without a question to inform frontend quiz is over.
-        if len(pruned_qs) == 0:
+        # Rather than loading and formatting every question in the category and then pruning
+        # out the ones already asked, the question pool keeps just the ids of each category
+        # (and of each difficulty) in memory and picks a random unasked one, so only the
+        # chosen row gets loaded.
+        question = question_pool.pick(request_cat, prev_qs, difficulty, seed)
+
+        # If we've used all the questions up, return without a question to inform frontend quiz is over.
+        if question is None:
             return jsonify({
                 'success': True
             })
 
-        # Otherwise, pick a random question from the pruned set
-        question = random.choice(pruned_qs)
+        # Now return it
+        return jsonify({
+            'success': True,
+            'question': question.format()
+        })
 
-        # print(f'Picked question: {question}')
 
-        # Now return it
+    @app.route('/api/quizzes/round', methods=['POST'])
+    def play_quiz_round():
+        '''Like play_quiz, but returns a whole round of questions at once, so the frontend
+        only needs the one request (and the database only one query) per round'''
+        request_data = request.json
+        try:
+            request_cat = int(request_data['quiz_category']['id'])
+            prev_qs = parse_previous_questions(request_data.get('previous_questions', []))
+            num_questions = int(request_data.get('num_questions', ROUND_SIZE))
+            difficulty = parse_difficulty(request_data.get('difficulty'))
+            seed = parse_seed(request_data, difficulty)
+        except:
+            abort(400)
+
+        if num_questions < 1 or num_questions > app.config['QUIZ_ROUND_MAX']:
+            abort(400)
+
+        use_replica()
+
+        # Fewer questions than asked for (or none) means the category is running out
+        q_list = question_pool.pick_round(request_cat, prev_qs, num_questions, difficulty, seed)
+
+        return jsonify({
+            'success': True,
+            'questions': q_list
+        })
+
+
+    @app.route('/api/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        '''Optional alternative to play_quiz, where the server keeps track of what's been asked.
+        Creates a session with a shuffled deck of the category's questions to deal from.'''
+        request_data = request.json
+        try:
+            request_cat = int(request_data['quiz_category']['id'])
+        except:
+            # Category must be supplied in this format
+            abort(400)
+
+        deck = question_pool.deck(request_cat)
+        session_id = session_store.create(deck)
+
         return jsonify({
             'success': True,
-            'question': question
+            'session_id': session_id,
+            'total_questions': len(deck)
         })
 
 
+    @app.route('/api/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def next_quiz_question(session_id):
+        '''Deals the next question from a quiz session's deck, no previous_questions needed'''
+        while True:
+            try:
+                q_id = session_store.pop(session_id)
+            except KeyError:
+                # Session doesn't exist, or expired
+                abort(404)
+
+            # Same as play_quiz, no question in the response means the quiz is over
+            if q_id is None:
+                return jsonify({
+                    'success': True
+                })
+
+            # Skip over any questions deleted since the deck was shuffled
+            question = Question.query.get(q_id)
+            if question is not None:
+                return jsonify({
+                    'success': True,
+                    'question': question.format()
+                })
+
+
     return app
 
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
-# Default port:
+# Default port (the development server, for production run serve.py instead):
 if __name__ == '__main__':
     app.run()
 
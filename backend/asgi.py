@@ -0,0 +1,462 @@
+'''
+ASGI entry point, for serving the API from an async server such as uvicorn:
+
+    uvicorn asgi:create_asgi_app --factory --workers 4
+
+The read-heavy routes (categories, question listings, search and quizzes) are served
+natively with an async database driver (asyncpg on Postgres, aiosqlite on SQLite) through
+the `databases` library, using the same tables as models.py and the same in-memory caches
+as the Flask app.  Everything else (adding and deleting questions, bulk import/export, quiz
+sessions, ...) is handed to the Flask app from create_app, running in a thread pool, so
+every route works the same in both modes.
+
+Needs the packages in requirements-async.txt.
+'''
+import bisect
+from contextlib import asynccontextmanager, nullcontext
+from email.utils import formatdate
+
+from a2wsgi import WSGIMiddleware
+from databases import Database
+from sqlalchemy import and_, func, select
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+from app import create_app
+from category_cache import category_cache
+from models import Question, QuestionCount, Category, ALL_CATEGORIES
+from pagination import page_window, QUESTIONS_PER_PAGE, MAX_ID
+from quiz import question_pool, category_filter, parse_difficulty, parse_previous_questions, parse_seed, ROUND_SIZE
+from rate_limit import RateLimited
+from response_cache import ResponseCache, cache_key
+from search import trigram_index, search_condition, search_ranking
+from serialization import dumps, listing_options, compact_listing
+
+questions = Question.__table__
+question_counts = QuestionCount.__table__
+categories = Category.__table__
+
+# Same messages as the Flask app's error handlers
+ERROR_MESSAGES = {
+    400: "Bad Request",
+    404: "Not found",
+    422: "Unprocessable Entity",
+    429: "Too Many Requests",
+    500: "Internal Server Error"
+}
+
+
+def format_row(row):
+    # Same as Question.format(), but for a plain row
+    return {
+        'id': row['id'],
+        'question': row['question'],
+        'answer': row['answer'],
+        'category': str(row['category']) if row['category'] is not None else None,
+        'difficulty': row['difficulty']
+    }
+
+
+class QueryArgs:
+    '''Just enough of werkzeug's request.args for page_window and listing_options'''
+
+    def __init__(self, query_params):
+        self.query_params = query_params
+
+    def get(self, key, default=None, type=None):
+        value = self.query_params.get(key)
+        if value is None:
+            return default
+        try:
+            return type(value) if type is not None else value
+        except ValueError:
+            return default
+
+
+'''
+create_asgi_app(test_config)
+    the async version of create_app, taking the same settings
+'''
+
+
+def create_asgi_app(test_config=None):
+    flask_app = create_app(test_config)
+    config = flask_app.config
+
+    # Starlette's gzip middleware compresses every response, the Flask app's included, so
+    # the Flask app mustn't do it as well.  (gzip only, brotli is just in the Flask app.)
+    compress = config['COMPRESS_ENABLED']
+    config['COMPRESS_ENABLED'] = False
+
+    # asyncpg gets a pool the same size as the sync one.  SQLite connections are cheap.
+    options = {}
+    if not config['DATABASE_PATH'].startswith('sqlite'):
+        options = {'min_size': config['DB_POOL_SIZE'],
+                   'max_size': config['DB_POOL_SIZE'] + config['DB_MAX_OVERFLOW']}
+    database = Database(config['DATABASE_PATH'], **options)
+
+    # The Flask app's question catalogue, if it has one.  It reads through the Flask app's
+    # (sync) session, so it catches up with changes in the thread pool.
+    catalogue = flask_app.extensions.get('catalogue')
+
+    class APIResponse(JSONResponse):
+        # Encoded with the app's JSON_BACKEND, and keys sorted like Flask's jsonify
+        def render(self, content):
+            return dumps(content, config['JSON_BACKEND'])
+
+    class ErrorResponse(APIResponse):
+        pass
+
+    def error(code, status_code=200, headers=None):
+        # The Flask app's error handlers return their JSON with a 200 (bar 429), so do the same
+        return ErrorResponse({
+            "success": False,
+            "error": code,
+            "message": ERROR_MESSAGES[code]
+        }, status_code=status_code, headers=headers)
+
+    # The same response cache as the Flask app's question listings
+    response_cache = flask_app.extensions['response_cache']
+
+    def cached(route):
+        if not isinstance(response_cache, ResponseCache):
+            return route
+
+        async def cached_route(request):
+            key = cache_key(request.url.path, request.query_params.multi_items())
+            entry, version, changed_at = response_cache.lookup(key)
+            if entry is None:
+                response = await route(request)
+                if isinstance(response, ErrorResponse) or response.status_code != 200:
+                    return response
+                entry = response_cache.store(key, version, changed_at, response.body, 'application/json')
+
+            headers = {
+                'ETag': f'"{entry.etag}"',
+                'Last-Modified': formatdate(entry.changed_at, usegmt=True),
+                'Cache-Control': response_cache.cache_control()
+            }
+            if headers['ETag'] in request.headers.get('if-none-match', ''):
+                return Response(status_code=304, headers=headers)
+            return Response(entry.body, media_type=entry.mimetype, headers=headers)
+        return cached_route
+
+    async def http_error(request, exc):
+        return error(exc.status_code if exc.status_code in ERROR_MESSAGES else 500)
+
+    async def server_error(request, exc):
+        return error(500)
+
+    async def rate_limited(request, exc):
+        return error(429, 429, {'Retry-After': str(exc.retry_after)})
+
+    # The Flask app's rate limiter, if RATE_LIMIT_ENABLED is on, for the searches and quiz
+    # turns served here (the Flask app admits its own routes)
+    limiter = flask_app.extensions.get('rate_limiter')
+
+    def admitted(request, group):
+        if limiter is None:
+            return nullcontext()
+        client = limiter.client(request.client.host if request.client else None, request.headers)
+        return limiter.admitted(client, group)
+
+    def limited(group, route):
+        if limiter is None:
+            return route
+
+        async def limited_route(request):
+            with admitted(request, group):
+                return await route(request)
+        return limited_route
+
+    # Loading the in-memory caches
+    ###############################
+    async def category_map():
+        if category_cache.stale():
+            rows = await database.fetch_all(select([categories.c.id, categories.c.type]))
+            category_cache.load({row['id']: row['type'] for row in rows})
+        return category_cache.all()
+
+    def in_flask_context(fn, *args):
+        # For the question pool and catalogue, which look up the app they're working for
+        with flask_app.app_context():
+            return fn(*args)
+
+    async def refresh_catalogue():
+        if catalogue is not None and catalogue.due():
+            await run_in_threadpool(in_flask_context, catalogue.refresh)
+
+    async def count_questions(category=ALL_CATEGORIES):
+        if catalogue is not None:
+            await refresh_catalogue()
+            return catalogue.count(category)
+        num = await database.fetch_val(select([question_counts.c.num_questions])
+                                       .where(question_counts.c.category == category))
+        return num if num is not None else 0
+
+    async def category_ids(category, difficulty=None):
+        if catalogue is not None:
+            await refresh_catalogue()
+            return catalogue.ids(category, difficulty)
+        ids = question_pool.cached_ids(category, difficulty)
+        if ids is None:
+            rows = await database.fetch_all(select([questions.c.id])
+                                            .where(and_(*category_filter(category, difficulty))))
+            ids = question_pool.load(category, (row['id'] for row in rows), difficulty)
+        return ids
+
+    async def load_buckets(category, difficulty):
+        # Loads every id list the question pool could pick from for this difficulty through
+        # the async database, so its picks that follow never fall back to the Flask session
+        low, high, _ = difficulty or (None, None, None)
+        for d in ([None] if difficulty is None else range(low, high + 1)):
+            await category_ids(category, d)
+
+    async def fetch_questions(ids):
+        # Loads the questions with these ids, keeping the order of ids
+        found = {}
+        for start in range(0, len(ids), 900):
+            rows = await database.fetch_all(questions.select().where(questions.c.id.in_(ids[start:start + 900])))
+            found.update((row['id'], format_row(row)) for row in rows)
+        return [found[q_id] for q_id in ids if q_id in found]
+
+    async def paginate(request, category):
+        window = page_window(QueryArgs(request.query_params))
+        if window is None:
+            return []
+        after_id, offset = window
+
+        if catalogue is not None:
+            ids = await category_ids(category)
+            start = bisect.bisect_right(ids, after_id) if after_id is not None else offset
+            return await fetch_questions(ids[start:start + QUESTIONS_PER_PAGE].tolist())
+
+        query = questions.select().where(and_(*category_filter(category))).order_by(questions.c.id)
+        if after_id is not None:
+            query = query.where(questions.c.id > after_id)
+        else:
+            query = query.offset(offset)
+        rows = await database.fetch_all(query.limit(QUESTIONS_PER_PAGE))
+        return [format_row(row) for row in rows]
+
+    # Routes
+    ###############################
+    async def get_categories(request):
+        cat_dict = await category_map()
+        body = {
+            "success": True,
+            "categories": cat_dict,
+            "categories_version": category_cache.version
+        }
+
+        if QueryArgs(request.query_params).get('with_counts', 0, type=int):
+            if catalogue is not None:
+                await refresh_catalogue()
+                counts = {**catalogue.counts(), ALL_CATEGORIES: catalogue.count()}
+            else:
+                rows = await database.fetch_all(select([question_counts.c.category, question_counts.c.num_questions]))
+                counts = {row['category']: row['num_questions'] for row in rows}
+            body["question_counts"] = {cat_id: counts.get(cat_id, 0) for cat_id in cat_dict}
+            body["total_questions"] = counts.get(ALL_CATEGORIES, 0)
+            return APIResponse(body)
+
+        etag = f'"{category_cache.etag()}"'
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag in request.headers.get('if-none-match', ''):
+            return Response(status_code=304, headers=headers)
+        return APIResponse(body, headers=headers)
+
+    async def get_questions(request):
+        try:
+            fields, with_categories = listing_options(QueryArgs(request.query_params))
+        except ValueError:
+            return error(400)
+        total_questions = await count_questions()
+        q_list = await paginate(request, ALL_CATEGORIES)
+        if len(q_list) == 0:
+            return error(404)
+
+        return APIResponse(compact_listing({
+            'success': True,
+            'questions': q_list,
+            'total_questions': total_questions,
+            'categories': await category_map(),
+            'categories_version': category_cache.version,
+            'current_category': None
+        }, fields, with_categories))
+
+    async def get_category_questions(request):
+        try:
+            fields, with_categories = listing_options(QueryArgs(request.query_params))
+        except ValueError:
+            return error(400)
+        cat_id = request.path_params['cat_id']
+        # Same as the Flask app, unknown categories are a 404 before anything is queried
+        category = (await category_map()).get(cat_id) if cat_id <= MAX_ID else None
+        if category is None:
+            return error(404)
+        total_questions = await count_questions(cat_id)
+        q_list = await paginate(request, cat_id)
+        if len(q_list) == 0:
+            return error(404)
+
+        return APIResponse(compact_listing({
+            'success': True,
+            'questions': q_list,
+            'total_questions': total_questions,
+            'categories': {'id': cat_id, 'type': category},
+            'categories_version': category_cache.version,
+            'current_category': cat_id
+        }, fields, with_categories))
+
+    async def search_questions(term, page):
+        if page is not None and (page < 1 or (page - 1) * QUESTIONS_PER_PAGE > MAX_ID):
+            return [], 0
+
+        # Like the Flask app, by what setup_db found (databases calls a postgres:// URL's
+        # dialect 'postgres', not 'postgresql', so that's no help)
+        if config['SEARCH_BACKEND'] == 'pg_trgm':
+            total = await database.fetch_val(select([func.count(questions.c.id)]).where(search_condition(term)))
+            query = questions.select().where(search_condition(term)).order_by(*search_ranking(term))
+            if page is not None:
+                query = query.offset((page - 1) * QUESTIONS_PER_PAGE).limit(QUESTIONS_PER_PAGE)
+            elif config['SEARCH_MAX_RESULTS']:
+                query = query.limit(config['SEARCH_MAX_RESULTS'])
+            return [format_row(row) for row in await database.fetch_all(query)], total
+
+        if trigram_index.stale():
+            rows = await database.fetch_all(select([questions.c.id, questions.c.question]))
+            trigram_index.load((row['id'], row['question']) for row in rows)
+        hits = trigram_index.search(term)
+        total = len(hits)
+        if page is not None:
+            hits = hits[(page - 1) * QUESTIONS_PER_PAGE:page * QUESTIONS_PER_PAGE]
+        elif config['SEARCH_MAX_RESULTS']:
+            hits = hits[:config['SEARCH_MAX_RESULTS']]
+        return await fetch_questions(hits), total
+
+    async def add_question(request):
+        try:
+            form_data = await request.json()
+        except ValueError:
+            return error(400)   # Not JSON, which Flask turns away with a 400 too
+        if "searchTerm" not in form_data:
+            # Adding a question goes through the Flask app, so it's the exact same
+            # Question.insert() (counters, cache hooks and all)
+            return await run_in_threadpool(add_question_sync, form_data)
+        with admitted(request, 'search'):
+            return await search(request, form_data)
+
+    async def search(request, form_data):
+        args = QueryArgs(request.query_params)
+        try:
+            fields = listing_options(args)[0]
+        except ValueError:
+            return error(400)
+        page = args.get('page', None, type=int)
+        q_list, total_questions = await search_questions(form_data['searchTerm'].strip(), page)
+        if page is not None and len(q_list) == 0:
+            return error(404)
+
+        return APIResponse(compact_listing({
+            "success": True,
+            "questions": q_list,
+            "total_questions": total_questions
+        }, fields))
+
+    def add_question_sync(form_data):
+        # Rebuilds the request from the JSON we already read, and runs it through Flask
+        with flask_app.test_request_context('/api/questions', method='POST', json=form_data):
+            response = flask_app.full_dispatch_request()
+            return Response(response.get_data(), status_code=response.status_code,
+                            media_type=response.mimetype)
+
+    async def play_quiz(request):
+        try:
+            request_data = await request.json()
+            request_cat = int(request_data['quiz_category']['id'])
+            prev_qs = parse_previous_questions(request_data['previous_questions'])
+            difficulty = parse_difficulty(request_data.get('difficulty'))
+            seed = parse_seed(request_data, difficulty)
+        except:
+            return error(400)
+
+        # Same question pool as play_quiz in the Flask app
+        while True:
+            await load_buckets(request_cat, difficulty)
+            ids = in_flask_context(question_pool.choose_ids, request_cat, prev_qs, 1, difficulty, seed)
+            if len(ids) == 0:
+                return APIResponse({'success': True})
+
+            # database is the primary (there are no replicas here), so a missing row really is gone
+            row = await database.fetch_one(questions.select().where(questions.c.id == ids[0]))
+            if row is not None:
+                return APIResponse({'success': True, 'question': format_row(row)})
+            in_flask_context(question_pool.forget, request_cat, ids)
+
+    async def play_quiz_round(request):
+        try:
+            request_data = await request.json()
+            request_cat = int(request_data['quiz_category']['id'])
+            prev_qs = parse_previous_questions(request_data.get('previous_questions', []))
+            num_questions = int(request_data.get('num_questions', ROUND_SIZE))
+            difficulty = parse_difficulty(request_data.get('difficulty'))
+            seed = parse_seed(request_data, difficulty)
+        except:
+            return error(400)
+
+        if num_questions < 1 or num_questions > flask_app.config['QUIZ_ROUND_MAX']:
+            return error(400)
+
+        while True:
+            await load_buckets(request_cat, difficulty)
+            ids = in_flask_context(question_pool.choose_ids, request_cat, prev_qs, num_questions, difficulty, seed)
+            q_list = await fetch_questions(ids)
+            if len(q_list) == len(ids):
+                return APIResponse({'success': True, 'questions': q_list})
+            found = {question['id'] for question in q_list}
+            in_flask_context(question_pool.forget, request_cat, [q_id for q_id in ids if q_id not in found])
+
+    async def add_cors_headers(request, call_next):
+        response = await call_next(request)
+        if request.url.path.startswith('/api/'):
+            response.headers.setdefault('Access-Control-Allow-Origin', '*')
+            response.headers.setdefault('Access-Control-Allow-Methods', 'GET,PATCH,POST,DELETE,OPTIONS')
+        return response
+
+    routes = [
+        Route('/api/categories', get_categories),
+        Route('/api/questions', cached(get_questions), methods=['GET']),
+        Route('/api/questions', add_question, methods=['POST']),
+        Route('/api/categories/{cat_id:int}/questions', cached(get_category_questions)),
+        Route('/api/quizzes', limited('quiz', play_quiz), methods=['POST']),
+        Route('/api/quizzes/round', limited('quiz', play_quiz_round), methods=['POST']),
+        # Anything else is served by the Flask app
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ]
+
+    @asynccontextmanager
+    async def lifespan(app):
+        await database.connect()
+        yield
+        await database.disconnect()
+
+    middleware = [Middleware(BaseHTTPMiddleware, dispatch=add_cors_headers)]
+    if compress:
+        middleware.insert(0, Middleware(GZipMiddleware, minimum_size=config['COMPRESS_MIN_SIZE'],
+                                        compresslevel=config['COMPRESS_LEVEL']))
+
+    app = Starlette(routes=routes,
+                    middleware=middleware,
+                    exception_handlers={HTTPException: http_error, RateLimited: rate_limited,
+                                        Exception: server_error},
+                    lifespan=lifespan)
+    app.state.flask_app = flask_app
+    app.state.database = database
+    return app
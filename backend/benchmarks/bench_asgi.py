@@ -0,0 +1,67 @@
+'''
+Load test comparing the WSGI (Flask under gunicorn) and ASGI (asgi.py under uvicorn)
+serving modes.
+
+Both servers get the same number of worker processes and the same seeded database, and
+are driven with a mix of question listings, category listings, searches and quiz turns at
+increasing concurrency.  Needs the packages in requirements-async.txt as well.
+
+Run from the backend folder:
+    python -m benchmarks.bench_asgi [concurrency...]
+'''
+import random
+import sys
+
+from benchmarks.loadgen import start_server, stop_server, run_load, PYTHON
+from benchmarks.seed import bench_app, seed_questions
+
+DEFAULT_CONCURRENCY = [10, 50, 200]
+NUM_QUESTIONS = 100000
+WORKERS = 4
+DURATION = 10   # Seconds of load per run
+WARMUP = 20     # Seconds of load before measuring, so every worker has built its caches
+PORT = 5099
+
+
+async def mixed_request(client, i):
+    rng = random.Random(i)
+    kind = i % 4
+    if kind == 0:
+        return await client.get(f'/api/questions?page={rng.randint(1, 1000)}')
+    if kind == 1:
+        return await client.get(f'/api/categories/{rng.randint(1, 6)}/questions?page={rng.randint(1, 100)}')
+    if kind == 2:
+        return await client.post('/api/questions?page=1', json={'searchTerm': f'number {rng.randint(1, 99999)}?'})
+    previous = rng.sample(range(1, NUM_QUESTIONS), 20)
+    return await client.post('/api/quizzes', json={'previous_questions': previous,
+                                                   'quiz_category': {'id': rng.randint(0, 6)}})
+
+
+def main(concurrencies):
+    app = bench_app('trivia_bench_asgi')
+    seed_questions(app, NUM_QUESTIONS)
+    env = {'TRIVIA_DATABASE_PATH': app.config['DATABASE_PATH']}
+
+    servers = {
+        'wsgi': [PYTHON, '-m', 'gunicorn', '-w', str(WORKERS), '--threads', '8', '-b', f'127.0.0.1:{PORT}',
+                 'app:create_app()'],
+        'asgi': [PYTHON, '-m', 'uvicorn', '--factory', '--workers', str(WORKERS), '--port', str(PORT),
+                 '--log-level', 'warning', 'asgi:create_asgi_app'],
+    }
+
+    print(f"{'mode':>5} {'concurrency':>12} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, command in servers.items():
+        server = start_server(command, PORT, env)
+        try:
+            # Warm up the caches in every worker before measuring
+            run_load(f'http://127.0.0.1:{PORT}', mixed_request, WORKERS * 4, WARMUP)
+            for concurrency in concurrencies:
+                result = run_load(f'http://127.0.0.1:{PORT}', mixed_request, concurrency, DURATION)
+                print(f"{mode:>5} {concurrency:>12} {result['requests']:>9} {result['errors']:>7} "
+                      f"{result['rps']:>8.0f} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f}")
+        finally:
+            stop_server(server)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_CONCURRENCY)
@@ -0,0 +1,60 @@
+'''
+Benchmark for bulk question import and export.
+
+Compares adding a trivia pack one question at a time through Question.insert() (one
+transaction each) against a single POST /api/questions/bulk, then times exporting the
+whole table through GET /api/questions/export.
+
+Run from the backend folder:
+    python -m benchmarks.bench_bulk [sizes...]
+'''
+import json
+import sys
+import time
+
+from models import Question
+from benchmarks.seed import bench_app, seed_questions
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+
+# Adding one at a time is slow enough that only this many are timed, then scaled up
+ONE_AT_A_TIME_SAMPLE = 1000
+
+
+def pack(size):
+    return ''.join(json.dumps({'question': f'Pack question {i}?', 'answer': 'Yes',
+                               'category': i % 6 + 1, 'difficulty': i % 5 + 1}) + '\n'
+                   for i in range(size))
+
+
+def main(sizes):
+    app = bench_app('trivia_bench_bulk')
+    client = app.test_client()
+
+    print(f"{'questions':>10} {'one at a time':>14} {'bulk':>10} {'export':>10} {'export MB':>10}  (seconds)")
+    for size in sizes:
+        seed_questions(app, 0)
+        sample = min(size, ONE_AT_A_TIME_SAMPLE)
+        with app.app_context():
+            start = time.perf_counter()
+            for i in range(sample):
+                Question(question=f'Single question {i}?', answer='Yes', category=i % 6 + 1, difficulty=1).insert()
+            one_at_a_time = (time.perf_counter() - start) * size / sample
+
+        seed_questions(app, 0)
+        body = pack(size)
+        start = time.perf_counter()
+        res = client.post('/api/questions/bulk', data=body, content_type='application/x-ndjson')
+        bulk = time.perf_counter() - start
+        assert res.get_json()['added'] == size, res.get_json()
+
+        start = time.perf_counter()
+        res = client.get('/api/questions/export')
+        exported = len(res.data)
+        export = time.perf_counter() - start
+
+        print(f'{size:>10} {one_at_a_time:>14.2f} {bulk:>10.2f} {export:>10.2f} {exported / 2 ** 20:>10.1f}')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,107 @@
+'''
+Benchmark for the in-memory question catalogue.
+
+For each database size: how long create_app takes with CATALOGUE_ENABLED on and off, how
+much memory the catalogue holds (traced Python allocations, and the growth in resident
+memory), then the median latency of the routes it serves with and without it (the response
+cache is off, so every request does the work), and of catching up with another worker's
+change through the change feed.
+
+Run from the backend folder:
+    python -m benchmarks.bench_catalogue [sizes...]
+'''
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+from catalogue import QuestionCatalogue
+from benchmarks.seed import bench_app, seed_questions
+from benchmarks.timing import time_call, time_request
+
+DEFAULT_SIZES = [100000, 1000000]
+
+
+def rss_mb():
+    # Resident memory, from /proc on Linux (None elsewhere)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return None
+
+
+def startup(size):
+    timings = {}
+    for enabled in (False, True):
+        start = time.perf_counter()
+        app = bench_app('trivia_bench_catalogue', DB_CREATE_SCHEMA=False, CATALOGUE_ENABLED=enabled)
+        timings[enabled] = time.perf_counter() - start
+
+    # The catalogue on its own, to see what it keeps hold of
+    gc.collect()
+    rss_before = rss_mb()
+    tracemalloc.start()
+    catalogue = QuestionCatalogue()
+    with app.app_context():
+        catalogue.load()
+    traced = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    tracemalloc.stop()
+    gc.collect()
+    rss_after = rss_mb()
+    rss = f'{rss_after - rss_before:>8.1f}' if rss_before is not None else f"{'-':>8}"
+
+    return [f'{size:>10} {timings[False]:>11.2f} {timings[True]:>11.2f} {traced:>10.1f} {rss} '
+            f'{traced * 2 ** 20 / size:>10.1f}']
+
+
+def routes(size):
+    num_pages = size // 10
+    requests = [
+        ('first page', 'GET', '/api/questions', None),
+        ('deep page', 'GET', f'/api/questions?page={num_pages * 9 // 10}', None),
+        ('category', 'GET', f'/api/categories/1/questions?page={num_pages // 60}', None),
+        ('counts', 'GET', '/api/categories?with_counts=1', None),
+        ('quiz turn', 'POST', '/api/quizzes', {'previous_questions': [], 'quiz_category': {'id': 1}}),
+    ]
+    clients = [bench_app('trivia_bench_catalogue', DB_CREATE_SCHEMA=False, RESPONSE_CACHE='off',
+                         CATALOGUE_ENABLED=enabled).test_client() for enabled in (False, True)]
+    lines = []
+    for label, method, url, body in requests:
+        timings = [time_request(lambda: client.open(url, method=method, json=body)) for client in clients]
+        lines.append(f'{size:>10} {label:>11} {timings[0]:>10.2f} {timings[1]:>10.2f}')
+    return lines
+
+
+def change_feed(size):
+    # Another worker adds a question, then this one catches up on its next request
+    config = dict(DB_CREATE_SCHEMA=False, RESPONSE_CACHE='off', CATALOGUE_ENABLED=True, CATALOGUE_POLL_INTERVAL=0)
+    worker = bench_app('trivia_bench_catalogue', **config).test_client()
+    other = bench_app('trivia_bench_catalogue', **config).test_client()
+
+    def catch_up():
+        other.post('/api/questions', json={'question': 'New?', 'answer': 'Yes', 'category': 1, 'difficulty': 1})
+        worker.get('/api/categories?with_counts=1')
+    total = time_call(catch_up)
+    idle = time_call(lambda: worker.get('/api/categories?with_counts=1'))
+    return [f'{size:>10} {idle:>13.2f} {total:>16.2f}']
+
+
+def main(sizes):
+    tables = {
+        f"{'questions':>10} {'startup off':>11} {'startup on':>11} {'traced MB':>10} {'RSS MB':>8} {'B/question':>10}": [],
+        f"{'questions':>10} {'route':>11} {'off ms':>10} {'on ms':>10}  (median per request)": [],
+        f"{'questions':>10} {'no change ms':>13} {'add + poll ms':>16}": [],
+    }
+    for size in sizes:
+        seed_questions(bench_app('trivia_bench_catalogue'), size)
+        for lines, measure in zip(tables.values(), (startup, routes, change_feed)):
+            lines.extend(measure(size))
+
+    for header, lines in tables.items():
+        print('\n'.join([header] + lines) + '\n')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,70 @@
+'''
+Load test for the category cache.
+
+Fires a mix of requests that all need the categories map (GET /api/categories, with and
+without If-None-Match, GET /api/questions and GET /api/categories/<id>/questions) and counts
+the SQL queries per request with the cache turned off and on.
+
+Run from the backend folder:
+    python -m benchmarks.bench_categories [requests]
+'''
+import random
+import sys
+import time
+
+from sqlalchemy import event
+
+from category_cache import category_cache
+from models import db
+from benchmarks.seed import bench_app, seed_questions
+
+DEFAULT_REQUESTS = 2000
+
+
+def run(client, num_requests, etag):
+    rng = random.Random(0)
+    not_modified = 0
+    for _ in range(num_requests):
+        kind = rng.randrange(4)
+        if kind == 0:
+            client.get('/api/categories')
+        elif kind == 1:
+            res = client.get('/api/categories', headers={'If-None-Match': etag})
+            not_modified += res.status_code == 304
+        elif kind == 2:
+            client.get(f'/api/questions?page={rng.randint(1, 100)}')
+        else:
+            client.get(f'/api/categories/{rng.randint(1, 6)}/questions')
+    return not_modified
+
+
+def main(num_requests):
+    app = bench_app('trivia_bench_categories')
+    client = app.test_client()
+    seed_questions(app, 10000)
+
+    queries = [0]
+
+    def count_query(*args):
+        queries[0] += 1
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+        etag = category_cache.etag()
+
+    print(f"{'cache':>6} {'requests':>9} {'queries':>8} {'per req':>8} {'304s':>6} {'req/s':>8}")
+    for label, max_age in (('off', 0), ('on', category_cache.MAX_AGE)):
+        category_cache.max_age = max_age
+        category_cache.invalidate()
+        queries[0] = 0
+
+        start = time.perf_counter()
+        not_modified = run(client, num_requests, etag)
+        elapsed = time.perf_counter() - start
+
+        print(f'{label:>6} {num_requests:>9} {queries[0]:>8} {queries[0] / num_requests:>8.2f} '
+              f'{not_modified:>6} {num_requests / elapsed:>8.0f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REQUESTS)
@@ -0,0 +1,82 @@
+'''
+Benchmark for the indexes on questions.category.
+
+Seeds questions with a skewed spread over the categories (so there are big and small
+ones), then times the first and last category pages and loading a category's ids for
+quizzes, with the category indexes dropped and then put back.  Also prints the database's
+query plan for a category page, to show whether the index is being used.
+
+Run from the backend folder:
+    python -m benchmarks.bench_category_index [sizes...]
+'''
+import sys
+
+from models import db, Question, QuestionCount
+from quiz import category_filter
+from benchmarks.seed import bench_app, seed_questions, CATEGORY_TYPES
+from benchmarks.timing import time_call, time_request
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+BIG_CATEGORY = 1
+SMALL_CATEGORY = len(CATEGORY_TYPES)
+
+
+def drop_indexes():
+    for index in Question.__table__.indexes:
+        db.session.execute(f'DROP INDEX IF EXISTS {index.name}')
+    db.session.commit()
+
+
+def create_indexes():
+    for index in Question.__table__.indexes:
+        index.create(db.engine)
+    db.session.execute('ANALYZE')
+    db.session.commit()
+
+
+def query_plan(category):
+    query = Question.query.filter(*category_filter(category)).order_by(Question.id).limit(10)
+    sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    explain = 'EXPLAIN' if db.engine.dialect.name == 'postgresql' else 'EXPLAIN QUERY PLAN'
+    return [' '.join(str(col) for col in row) for row in db.session.execute(f'{explain} {sql}')]
+
+
+def load_ids(category):
+    # What the question pool does to load a category for quizzes
+    return db.session.query(Question.id).filter(*category_filter(category)).all()
+
+
+def main(sizes):
+    app = bench_app('trivia_bench_category_index')
+    client = app.test_client()
+
+    print(f"{'questions':>10} {'indexes':>8} {'small p1':>9} {'small last':>11} {'big last':>9} "
+          f"{'small ids':>10} {'big ids':>8}  (median ms)")
+    for size in sizes:
+        seed_questions(app, size, category_skew=1.0)
+        with app.app_context():
+            # The last page of each category, which OFFSET has to walk all the way through
+            small_last = QuestionCount.get(SMALL_CATEGORY) // 10
+            big_last = QuestionCount.get(BIG_CATEGORY) // 10
+
+        plans = {}
+        for label, change_indexes in (('off', drop_indexes), ('on', create_indexes)):
+            with app.app_context():
+                change_indexes()
+                plans[label] = query_plan(SMALL_CATEGORY)
+                small_ids = time_call(lambda: load_ids(SMALL_CATEGORY), repeat=5)
+                big_ids = time_call(lambda: load_ids(BIG_CATEGORY), repeat=5)
+
+            small_p1 = time_request(lambda: client.get(f'/api/categories/{SMALL_CATEGORY}/questions'))
+            small_deep = time_request(lambda: client.get(f'/api/categories/{SMALL_CATEGORY}/questions?page={small_last}'))
+            big_deep = time_request(lambda: client.get(f'/api/categories/{BIG_CATEGORY}/questions?page={big_last}'))
+
+            print(f'{size:>10} {label:>8} {small_p1:>9.2f} {small_deep:>11.2f} {big_deep:>9.2f} '
+                  f'{small_ids:>10.2f} {big_ids:>8.2f}')
+
+        for label, plan in plans.items():
+            print(f'    plan with indexes {label}: ' + ' | '.join(plan))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,60 @@
+'''
+Overhead of the request instrumentation in metrics.py.
+
+Times the same mix of requests (question pages, category pages, searches and quiz turns)
+through apps with METRICS_ENABLED off and on, against the same database.
+
+Run from the backend folder:
+    python -m benchmarks.bench_metrics [requests]
+'''
+import random
+import sys
+
+from benchmarks.seed import bench_app, seed_questions
+from benchmarks.timing import time_call
+
+DEFAULT_REQUESTS = 2000
+NUM_QUESTIONS = 10000
+ROUNDS = 7
+
+
+def run(client, num_requests):
+    rng = random.Random(0)
+    for i in range(num_requests):
+        kind = i % 4
+        if kind == 0:
+            client.get(f'/api/questions?page={rng.randint(1, 100)}')
+        elif kind == 1:
+            client.get(f'/api/categories/{rng.randint(1, 6)}/questions')
+        elif kind == 2:
+            client.post('/api/questions?page=1', json={'searchTerm': f'number {rng.randint(1, 9999)}?'})
+        else:
+            client.post('/api/quizzes', json={'previous_questions': [],
+                                              'quiz_category': {'id': rng.randint(0, 6)}})
+
+
+def main(num_requests):
+    app = bench_app('trivia_bench_metrics')
+    seed_questions(app, NUM_QUESTIONS)
+    apps = {
+        'off': app,
+        'on': bench_app('trivia_bench_metrics', DB_CREATE_SCHEMA=False, METRICS_ENABLED=True),
+    }
+
+    clients = {label: bench.test_client() for label, bench in apps.items()}
+    for client in clients.values():
+        run(client, 200)    # Warm up the caches
+
+    # Alternate between the two, so drift in the machine's speed hits both the same
+    samples = {label: [] for label in apps}
+    for _ in range(ROUNDS):
+        for label, client in clients.items():
+            samples[label].append(time_call(lambda: run(client, num_requests), repeat=1))
+
+    print(f"{'metrics':>8} {'requests':>9} {'median ms':>10} {'req/s':>8}")
+    for label, times in samples.items():
+        elapsed = sorted(times)[len(times) // 2]
+        print(f'{label:>8} {num_requests:>9} {elapsed:>10.0f} {num_requests / elapsed * 1000:>8.0f}')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REQUESTS)
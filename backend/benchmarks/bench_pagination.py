@@ -0,0 +1,46 @@
+'''
+Benchmark for GET /api/questions pagination.
+
+Compares the old approach (load every question, slice out a page in Python) against the
+LIMIT/OFFSET and ?after_id= keyset modes, as the questions table grows.
+
+Run from the backend folder:
+    python -m benchmarks.bench_pagination [sizes...]
+'''
+import sys
+
+from models import Question
+from benchmarks.seed import bench_app, seed_questions
+from benchmarks.timing import time_call, time_request
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def legacy_page(page, per_page=10):
+    # What get_questions used to do before pagination moved into SQL
+    questions = Question.query.all()
+    start = (page - 1) * per_page
+    return len(questions), [q.format() for q in questions[start:start + per_page]]
+
+
+def main(sizes):
+    app = bench_app('trivia_bench_pagination')
+    client = app.test_client()
+
+    print(f"{'questions':>10} {'legacy p1':>10} {'page 1':>10} {'deep page':>10} {'deep after_id':>14}  (median ms)")
+    for size in sizes:
+        seed_questions(app, size)
+        deep_page = size // 10 - 1
+        deep_after_id = (deep_page - 1) * 10
+
+        with app.test_request_context():
+            legacy = time_call(lambda: legacy_page(1), repeat=5)
+        page_1 = time_request(lambda: client.get('/api/questions?page=1'))
+        deep = time_request(lambda: client.get(f'/api/questions?page={deep_page}'))
+        keyset = time_request(lambda: client.get(f'/api/questions?after_id={deep_after_id}'))
+
+        print(f'{size:>10} {legacy:>10.2f} {page_1:>10.2f} {deep:>10.2f} {keyset:>14.2f}')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,75 @@
+'''
+Benchmark for the size of responses on the wire, and what it costs to shrink them.
+
+For a page of questions and an unpaginated search (thousands of hits), in full and cut
+down with ?fields=id,question&with_categories=0, shows the bytes pretty printed (what
+flask.jsonify sent in debug mode), compact, and compressed at a few gzip levels (and
+brotli qualities if brotli is installed), with the CPU time each compression takes.  Then
+times whole requests with and without Accept-Encoding: gzip, where the cached question
+pages reuse their compressed bodies and the searches compress every time.
+
+Run from the backend folder:
+    python -m benchmarks.bench_payload [questions]
+'''
+import json
+import sys
+
+from compression import compress, brotli
+from benchmarks.seed import bench_app, seed_questions, WORDS
+from benchmarks.timing import time_call
+
+DEFAULT_QUESTIONS = 20000
+GZIP_LEVELS = [1, 5, 9]
+BROTLI_QUALITIES = [4, 11]
+COMPACT = 'fields=id,question&with_categories=0'
+
+
+def requests(search_term):
+    return [
+        ('page', 'GET', '/api/questions?page=3', None),
+        ('page compact', 'GET', f'/api/questions?page=3&{COMPACT}', None),
+        ('search', 'POST', '/api/questions', {'searchTerm': search_term}),
+        ('search compact', 'POST', '/api/questions?fields=id,question', {'searchTerm': search_term}),
+    ]
+
+
+def sizes(client, reqs):
+    codecs = [('gzip', level) for level in GZIP_LEVELS]
+    if brotli is not None:
+        codecs += [('br', quality) for quality in BROTLI_QUALITIES]
+    print(f"{'response':>15} {'pretty':>9} {'compact':>9} " +
+          ' '.join(f'{encoding + str(level):>15}' for encoding, level in codecs) + '  (bytes, compress ms)')
+    for label, method, url, body in reqs:
+        data = client.open(url, method=method, json=body).data
+        pretty = json.dumps(json.loads(data), indent=2, separators=(', ', ': '), sort_keys=True)
+        cells = []
+        for encoding, level in codecs:
+            compressed = compress(data, encoding, level, level)
+            ms = time_call(lambda: compress(data, encoding, level, level), repeat=7)
+            cells.append(f'{len(compressed):>8} {ms:>6.2f}')
+        print(f'{label:>15} {len(pretty):>9} {len(data):>9} ' + ' '.join(cells))
+
+
+def latency(client, reqs):
+    print(f"\n{'response':>15} {'identity':>9} {'gzip':>9}  (median ms per request)")
+    for label, method, url, body in reqs:
+        timings = []
+        for headers in ({}, {'Accept-Encoding': 'gzip'}):
+            timings.append(time_call(lambda: client.open(url, method=method, json=body, headers=headers)))
+        print(f'{label:>15} {timings[0]:>9.2f} {timings[1]:>9.2f}')
+
+
+def main(num_questions):
+    # Without the cap on search results, to see what a really big response costs
+    app = bench_app('trivia_bench_payload', SEARCH_MAX_RESULTS=0)
+    seed_questions(app, num_questions)
+    client = app.test_client()
+
+    # The most common word, so the search hits a good share of the questions
+    reqs = requests(WORDS[0])
+    sizes(client, reqs)
+    latency(client, reqs)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_QUESTIONS)
@@ -0,0 +1,88 @@
+'''
+Benchmark for POST /api/quizzes question selection.
+
+Puts every question in one category and compares the old approach (load and format the
+whole category, then prune previous_questions with a list scan) against the question pool,
+and a seeded quiz at that turn, for different category sizes and lengths of previous_questions.  Then compares playing
+ROUND_SIZE turns one request at a time against getting them all from POST /api/quizzes/round.
+
+Run from the backend folder:
+    python -m benchmarks.bench_quiz [sizes...]
+'''
+import random
+import sys
+
+from models import Question
+from quiz import question_pool
+from benchmarks.seed import bench_app, seed_questions
+from benchmarks.timing import time_call, time_request
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+PREVIOUS_LENGTHS = [0, 100, 1000, 10000]
+
+# The old path takes minutes per turn on big categories with long lists, so skip it there
+LEGACY_MAX_WORK = 10 ** 8
+
+ROUND_SIZE = 10
+
+
+def legacy_pick(category, prev_qs):
+    # What play_quiz used to do before the question pool
+    questions = [q.format() for q in Question.query.filter_by(category=str(category)).all()]
+    pruned_qs = [q for q in questions if q['id'] not in prev_qs]
+    return random.choice(pruned_qs) if pruned_qs else None
+
+
+def main(sizes):
+    app = bench_app('trivia_bench_quiz')
+    client = app.test_client()
+
+    print(f"{'questions':>10} {'previous':>9} {'legacy':>10} {'pool':>10} {'seeded':>10}  (median ms per turn)")
+    for size in sizes:
+        seed_questions(app, size, num_categories=1)
+
+        # Loading the id list is a one-off cost per category (per worker), report it separately
+        with app.app_context():
+            load = time_call(lambda: (question_pool.invalidate(), question_pool.ids(1)), repeat=1)
+        print(f'{size:>10} {"(load)":>9} {"":>10} {load:>10.2f}')
+
+        for num_previous in PREVIOUS_LENGTHS:
+            prev_qs = random.sample(range(1, size + 1), min(num_previous, size))
+            body = {'previous_questions': prev_qs, 'quiz_category': {'type': 'Science', 'id': 1}}
+
+            legacy = float('nan')
+            if size * max(num_previous, 1) <= LEGACY_MAX_WORK:
+                with app.app_context():
+                    legacy = time_call(lambda: legacy_pick(1, prev_qs), repeat=3)
+            pool = time_request(lambda: client.post('/api/quizzes', json=body))
+            # Only the turn number matters for a seeded quiz, previous_questions isn't read
+            seeded_body = {'previous_questions': [], 'quiz_category': body['quiz_category'],
+                           'seed': 'bench', 'turn': min(num_previous, size - 1)}
+            seeded = time_request(lambda: client.post('/api/quizzes', json=seeded_body))
+
+            print(f'{size:>10} {num_previous:>9} {legacy:>10.2f} {pool:>10.2f} {seeded:>10.2f}')
+
+    print(f"\n{'questions':>10} {'previous':>9} {'turns':>10} {'round':>10}  (median ms for {ROUND_SIZE} questions)")
+    for size in sizes:
+        seed_questions(app, size, num_categories=1)
+        for num_previous in PREVIOUS_LENGTHS:
+            if num_previous + ROUND_SIZE > size:
+                continue
+            prev_qs = random.sample(range(1, size + 1), num_previous)
+            category = {'type': 'Science', 'id': 1}
+
+            def play_turns():
+                asked = list(prev_qs)
+                for _ in range(ROUND_SIZE):
+                    data = client.post('/api/quizzes', json={'previous_questions': asked, 'quiz_category': category}).get_json()
+                    asked.append(data['question']['id'])
+
+            body = {'previous_questions': prev_qs, 'quiz_category': category, 'num_questions': ROUND_SIZE}
+            client.post('/api/quizzes/round', json=body)
+            turns = time_call(play_turns)
+            round_ = time_request(lambda: client.post('/api/quizzes/round', json=body))
+            print(f'{size:>10} {num_previous:>9} {turns:>10.2f} {round_:>10.2f}')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
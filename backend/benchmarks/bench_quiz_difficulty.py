@@ -0,0 +1,108 @@
+'''
+Benchmark for quiz questions picked by difficulty.
+
+Latency: puts every question in one category and times a quiz turn for each kind of
+difficulty request, against filtering the category by difficulty in SQL every turn (what
+you'd do without the question pool's per-difficulty buckets).
+
+Fairness: picks lots of first questions from a range of difficulties and checks each
+question comes up about as often as any other (so the bigger buckets aren't under-served),
+then plays whole ramped quizzes and shows the average difficulty at each turn.
+
+Run from the backend folder:
+    python -m benchmarks.bench_quiz_difficulty [sizes...]
+'''
+import random
+import statistics
+import sys
+from collections import Counter
+
+from models import db, Question
+from quiz import question_pool, difficulty_groups, parse_difficulty
+from benchmarks.seed import bench_app, seed_questions
+from benchmarks.timing import time_call, time_request
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+PREVIOUS_LENGTHS = [0, 1000]
+MODES = {
+    'any': None,
+    'exact': 3,
+    'range': {'min': 2, 'max': 4},
+    'ramp': {'min': 1, 'max': 5, 'ramp': 10},
+}
+
+FAIRNESS_QUESTIONS = 1000
+FAIRNESS_PICKS = 100000
+RAMP_QUIZZES = 200
+RAMP_TURNS = 12
+
+
+def query_pick(difficulty, prev_qs):
+    # Load the matching ids from the database every turn, and prune the asked ones
+    group = difficulty_groups(difficulty, len(prev_qs))[0]
+    query = db.session.query(Question.id).filter(Question.category == 1)
+    if group != [None]:
+        query = query.filter(Question.difficulty.in_(group))
+    asked = set(prev_qs)
+    remaining = [row.id for row in query if row.id not in asked]
+    return random.choice(remaining) if remaining else None
+
+
+def latency(app, sizes):
+    client = app.test_client()
+    print(f"{'questions':>10} {'previous':>9} {'mode':>6} {'query':>9} {'pool':>9}  (median ms per turn)")
+    for size in sizes:
+        seed_questions(app, size, num_categories=1)
+
+        for num_previous in PREVIOUS_LENGTHS:
+            prev_qs = random.sample(range(1, size + 1), min(num_previous, size))
+            for mode, difficulty in MODES.items():
+                body = {'previous_questions': prev_qs, 'quiz_category': {'id': 1}, 'difficulty': difficulty}
+                with app.app_context():
+                    query = time_call(lambda: query_pick(parse_difficulty(difficulty), prev_qs), repeat=3)
+                # The first turn loads the buckets, time the turns after that
+                client.post('/api/quizzes', json=body)
+                pool = time_request(lambda: client.post('/api/quizzes', json=body))
+                print(f'{size:>10} {num_previous:>9} {mode:>6} {query:>9.2f} {pool:>9.2f}')
+
+
+def fairness(app):
+    seed_questions(app, FAIRNESS_QUESTIONS, num_categories=1)
+    difficulty = parse_difficulty(MODES['range'])
+    with app.app_context():
+        levels = dict(db.session.query(Question.id, Question.difficulty).all())
+        picks = Counter(question_pool.pick_id(1, [], difficulty) for _ in range(FAIRNESS_PICKS))
+
+    eligible = [q_id for q_id, level in levels.items() if 2 <= level <= 4]
+    expected = FAIRNESS_PICKS / len(eligible)
+    counts = [picks[q_id] for q_id in eligible]
+    print(f'\nrange 2-4: {len(eligible)} questions, {FAIRNESS_PICKS} picks, {expected:.0f} expected each')
+    print(f'  per question: min {min(counts)}, max {max(counts)}, '
+          f'stdev {statistics.pstdev(counts):.1f} (sqrt(expected) is {expected ** 0.5:.1f})')
+    print(f"  {'difficulty':>10} {'questions':>10} {'share':>7} {'picked':>7}")
+    for level in range(2, 5):
+        in_level = [q_id for q_id in eligible if levels[q_id] == level]
+        print(f'  {level:>10} {len(in_level):>10} {len(in_level) / len(eligible):>7.1%} '
+              f'{sum(picks[q_id] for q_id in in_level) / FAIRNESS_PICKS:>7.1%}')
+
+    difficulty = parse_difficulty(MODES['ramp'])
+    by_turn = [[] for _ in range(RAMP_TURNS)]
+    with app.app_context():
+        for _ in range(RAMP_QUIZZES):
+            prev_qs = []
+            for turn in range(RAMP_TURNS):
+                q_id = question_pool.pick_id(1, prev_qs, difficulty)
+                prev_qs.append(q_id)
+                by_turn[turn].append(levels[q_id])
+    print(f"\nramp 1-5 over 10 questions, average difficulty by turn ({RAMP_QUIZZES} quizzes):")
+    print('  ' + ' '.join(f'{statistics.mean(turn_levels):.2f}' for turn_levels in by_turn))
+
+
+def main(sizes):
+    app = bench_app('trivia_bench_quiz_difficulty')
+    latency(app, sizes)
+    fairness(app)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
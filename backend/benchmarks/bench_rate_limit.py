@@ -0,0 +1,101 @@
+'''
+Benchmark for rate limiting and admission control.
+
+First what admitting a request costs: the median latency of a quiz turn and a search with
+RATE_LIMIT_ENABLED off and on (with budgets nobody reaches), and of an unpaginated search
+for "" (every question) with and without the SEARCH_MAX_RESULTS cap.
+
+Then a flood: a few threads send searches for "" as fast as they can, from one client,
+while another client plays quiz turns at a steady pace.  For each setting, how many of the
+flood's searches were served and turned away, and the p50/p99 latency of the quiz turns.
+
+Run from the backend folder:
+    python -m benchmarks.bench_rate_limit [questions] [flood threads] [seconds]
+'''
+import sys
+import threading
+import time
+
+from benchmarks.seed import bench_app, seed_questions
+from benchmarks.timing import time_request
+
+DEFAULT_QUESTIONS = 20000
+DEFAULT_THREADS = 8
+DEFAULT_SECONDS = 5
+QUIZ = {'previous_questions': [], 'quiz_category': {'id': 1}}
+UNLIMITED = dict(RATE_LIMIT_SEARCH_PER_MINUTE=0, RATE_LIMIT_SEARCH_CONCURRENCY=0,
+                 RATE_LIMIT_QUIZ_PER_MINUTE=0, RATE_LIMIT_QUIZ_CONCURRENCY=0)
+
+
+def overhead():
+    print(f"{'request':>15} {'off ms':>8} {'on ms':>8}  (median per request)")
+    clients = [bench_app('trivia_bench_rate_limit', DB_CREATE_SCHEMA=False, RATE_LIMIT_ENABLED=enabled,
+                         **UNLIMITED).test_client() for enabled in (False, True)]
+    for label, body in (('quiz turn', None), ('search', {'searchTerm': 'kakaka'})):
+        url = '/api/quizzes' if body is None else '/api/questions?page=1'
+        timings = [time_request(lambda: client.post(url, json=body or QUIZ)) for client in clients]
+        print(f'{label:>15} {timings[0]:>8.2f} {timings[1]:>8.2f}')
+
+    print(f"\n{'empty search':>15} {'uncapped':>8} {'capped':>8}  (median ms, hits returned)")
+    timings, sizes = [], []
+    for max_results in (0, None):
+        config = {} if max_results is None else {'SEARCH_MAX_RESULTS': max_results}
+        client = bench_app('trivia_bench_rate_limit', DB_CREATE_SCHEMA=False, **config).test_client()
+        sizes.append(len(client.post('/api/questions', json={'searchTerm': ''}).get_json()['questions']))
+        timings.append(time_request(lambda: client.post('/api/questions', json={'searchTerm': ''}), repeat=7))
+    print(f"{'':>15} {timings[0]:>8.2f} {timings[1]:>8.2f}\n{'':>15} {sizes[0]:>8} {sizes[1]:>8}")
+
+
+def flood(label, num_threads, seconds, **config):
+    app = bench_app('trivia_bench_rate_limit', DB_CREATE_SCHEMA=False, RATE_LIMIT_CLIENT_HEADER='X-Client',
+                    **config)
+    stop = threading.Event()
+    counts = {'served': 0, 'rejected': 0}
+    lock = threading.Lock()
+
+    def flooder():
+        client = app.test_client()
+        while not stop.is_set():
+            res = client.post('/api/questions', json={'searchTerm': ''}, headers={'X-Client': 'flood'})
+            with lock:
+                counts['served' if res.status_code == 200 else 'rejected'] += 1
+
+    threads = [threading.Thread(target=flooder) for _ in range(num_threads)]
+    for thread in threads:
+        thread.start()
+
+    # The bystander, a quiz turn every 10ms
+    client = app.test_client()
+    samples = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        client.post('/api/quizzes', json=QUIZ, headers={'X-Client': 'player'})
+        samples.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.01)
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    samples.sort()
+    print(f"{label:>24} {counts['served']:>8} {counts['rejected']:>9} "
+          f"{samples[len(samples) // 2]:>9.2f} {samples[len(samples) * 99 // 100]:>9.2f}")
+
+
+def main(num_questions, num_threads, seconds):
+    seed_questions(bench_app('trivia_bench_rate_limit'), num_questions)
+    overhead()
+
+    print(f"\n{'flood of ' + str(num_threads) + ' threads':>24} {'served':>8} {'rejected':>9} "
+          f"{'quiz p50':>9} {'quiz p99':>9}  (ms)")
+    flood('no limits', num_threads, seconds, SEARCH_MAX_RESULTS=0)
+    flood('result cap', num_threads, seconds)
+    flood('cap + concurrency 2', num_threads, seconds, RATE_LIMIT_ENABLED=True, RATE_LIMIT_SEARCH_PER_MINUTE=0,
+          RATE_LIMIT_SEARCH_CONCURRENCY=2)
+    flood('cap + default limits', num_threads, seconds, RATE_LIMIT_ENABLED=True)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    defaults = [DEFAULT_QUESTIONS, DEFAULT_THREADS, DEFAULT_SECONDS]
+    main(*(args + defaults[len(args):]))
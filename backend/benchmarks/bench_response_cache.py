@@ -0,0 +1,69 @@
+'''
+Benchmark for the response cache on the question listings.
+
+Replays the same page views (popular pages far more often than the rest) against apps with
+RESPONSE_CACHE off, in memory and on the filesystem, with and without clients sending
+back the ETag they were given, plus a question added now and then to invalidate the cache.
+
+Run from the backend folder:
+    python -m benchmarks.bench_response_cache [requests]
+'''
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.seed import bench_app, seed_questions
+
+DEFAULT_REQUESTS = 2000
+NUM_QUESTIONS = 100000
+WRITE_EVERY = 500       # Requests between adding questions
+
+
+def page_views(num_requests, seed=0):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(100)]
+    pages = rng.choices(range(1, 101), weights, k=num_requests)
+    return [f'/api/questions?page={page}' if i % 2 else f'/api/categories/{i % 6 + 1}/questions?page={page}'
+            for i, page in enumerate(pages)]
+
+
+def run(client, urls, revalidate):
+    etags = {}
+    not_modified = 0
+    for i, url in enumerate(urls):
+        if i and i % WRITE_EVERY == 0:
+            client.post('/api/questions', json={'question': 'New?', 'answer': 'Yes', 'category': 1, 'difficulty': 1})
+
+        headers = {'If-None-Match': etags[url]} if revalidate and url in etags else {}
+        res = client.get(url, headers=headers)
+        not_modified += res.status_code == 304
+        if 'ETag' in res.headers:
+            etags[url] = res.headers['ETag']
+    return not_modified
+
+
+def main(num_requests):
+    cache_dir = tempfile.mkdtemp(prefix='trivia_bench_cache')
+    app = bench_app('trivia_bench_response_cache')
+    seed_questions(app, NUM_QUESTIONS)
+    urls = page_views(num_requests)
+
+    print(f"{'cache':>7} {'etags':>6} {'requests':>9} {'304s':>6} {'req/s':>8}")
+    try:
+        for setting in ('off', 'memory', f'file://{cache_dir}'):
+            bench = bench_app('trivia_bench_response_cache', DB_CREATE_SCHEMA=False, RESPONSE_CACHE=setting)
+            client = bench.test_client()
+            for revalidate in (False, True):
+                start = time.perf_counter()
+                not_modified = run(client, urls, revalidate)
+                elapsed = time.perf_counter() - start
+                print(f"{setting.split(':')[0]:>7} {'yes' if revalidate else 'no':>6} {num_requests:>9} "
+                      f"{not_modified:>6} {num_requests / elapsed:>8.0f}")
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REQUESTS)
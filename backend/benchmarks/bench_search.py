@@ -0,0 +1,66 @@
+'''
+Benchmark for the searchTerm path of POST /api/questions.
+
+Compares the original unindexed ILIKE '%term%' query against the search index (pg_trgm
+on Postgres, the Python trigram index elsewhere) for a rare word, a common word and a
+short term, returning either every hit or just the first page.  Returning every hit of a
+common term is dominated by loading and serializing the rows, not by the search itself.
+
+Run from the backend folder:
+    python -m benchmarks.bench_search [sizes...]
+'''
+import sys
+
+from flask import jsonify
+
+from models import Question
+from search import trigram_index
+from benchmarks.seed import bench_app, seed_questions, WORDS
+from benchmarks.timing import time_call, time_request
+
+DEFAULT_SIZES = [10000, 100000, 300000]
+TERMS = {
+    'rare': WORDS[-1],
+    'common': WORDS[0],
+    'short': 'ka',
+}
+
+
+def legacy_search(term):
+    # What add_question used to do before the search index
+    questions = Question.query.filter(Question.question.ilike(f'%{term}%')).all()
+    return jsonify({'success': True, 'questions': [q.format() for q in questions]})
+
+
+def main(sizes):
+    # Every hit, like the ILIKE query it's compared against (not capped at SEARCH_MAX_RESULTS)
+    app = bench_app('trivia_bench_search', SEARCH_MAX_RESULTS=0)
+    client = app.test_client()
+    print(f"search backend: {app.config['SEARCH_BACKEND']}")
+
+    print(f"{'questions':>10} {'term':>7} {'hits':>7} {'ilike':>10} {'index':>10} {'index p1':>10}  (median ms)")
+    for size in sizes:
+        seed_questions(app, size)
+
+        if app.config['SEARCH_BACKEND'] == 'python':
+            # Building the in-memory index is a one-off cost per worker, report it separately
+            with app.app_context():
+                build = time_call(lambda: (trigram_index.question_changed('reset', None), trigram_index.search('')), repeat=1)
+            print(f'{size:>10} {"(build)":>7} {"":>7} {"":>10} {build:>10.2f}')
+
+        for name, term in TERMS.items():
+            with app.test_request_context():
+                hits = len(legacy_search(term).get_json()['questions'])
+                legacy = time_call(lambda: legacy_search(term), repeat=5)
+            indexed = time_request(lambda: client.post('/api/questions', json={'searchTerm': term}), repeat=5)
+            if hits:
+                first_page = time_request(lambda: client.post('/api/questions?page=1', json={'searchTerm': term}))
+                first_page = f'{first_page:>10.2f}'
+            else:
+                first_page = f"{'-':>10}"   # No first page to get (it's a 404)
+
+            print(f'{size:>10} {name:>7} {hits:>7} {legacy:>10.2f} {indexed:>10.2f} {first_page}')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,58 @@
+'''
+Benchmark for turning questions into JSON.
+
+Compares the cost per row of the old read path (load full Question objects, then call
+format() on each) against selecting just QUESTION_COLUMNS into plain rows, and the
+standard library JSON encoder against orjson, for result sets of a few sizes.
+
+Run from the backend folder:
+    python -m benchmarks.bench_serialization [rows...]
+'''
+import sys
+
+from models import db, format_question, Question, QUESTION_COLUMNS
+from serialization import dumps, orjson
+from benchmarks.seed import bench_app, seed_questions
+from benchmarks.timing import time_call
+
+DEFAULT_ROWS = [10, 1000, 10000]
+NUM_QUESTIONS = 20000
+
+
+def orm_rows(num_rows):
+    # What the read endpoints used to do
+    return [q.format() for q in Question.query.order_by(Question.id).limit(num_rows)]
+
+
+def column_rows(num_rows):
+    rows = db.session.query(*QUESTION_COLUMNS).order_by(Question.id).limit(num_rows)
+    return [format_question(row) for row in rows]
+
+
+def main(row_counts):
+    app = bench_app('trivia_bench_serialization')
+    seed_questions(app, NUM_QUESTIONS)
+
+    backends = ['stdlib'] + (['orjson'] if orjson is not None else [])
+    print(f"{'rows':>6} {'path':>8} {'load us/row':>12} " +
+          ' '.join(f"{backend + ' us/row':>15}" for backend in backends) + f" {'best us/row':>12}")
+    with app.app_context():
+        for num_rows in row_counts:
+            for label, load in (('orm', orm_rows), ('columns', column_rows)):
+                # Expunge between runs so the ORM path builds its objects from scratch every time
+                def timed_load():
+                    load(num_rows)
+                    db.session.expunge_all()
+                load_ms = time_call(timed_load, repeat=7)
+
+                body = {'success': True, 'questions': load(num_rows)}
+                encode_ms = [time_call(lambda: dumps(body, backend), repeat=7) for backend in backends]
+
+                per_row = lambda ms: ms * 1000 / num_rows
+                print(f'{num_rows:>6} {label:>8} {per_row(load_ms):>12.2f} ' +
+                      ' '.join(f'{per_row(ms):>15.2f}' for ms in encode_ms) +
+                      f' {per_row(load_ms + min(encode_ms)):>12.2f}')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_ROWS)
@@ -0,0 +1,101 @@
+'''
+Benchmark for starting up serve.py, preloaded (workers forked from a warmed parent) and
+not (--no-preload, every worker loads the app itself).
+
+For each database size: seconds from launch until every worker is ready, how long each
+worker took from being forked, their memory once they've served a few requests (private
+to each worker on average, and everything counting shared pages once, from /proc on
+Linux), then how long a graceful reload (SIGHUP) takes until every new worker is ready.
+Any TRIVIA_* settings in the environment are passed on, e.g. TRIVIA_CATALOGUE_ENABLED=1.
+
+Run from the backend folder:
+    python -m benchmarks.bench_startup [sizes...]
+'''
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.seed import bench_app, seed_questions
+
+DEFAULT_SIZES = [10000, 100000]
+WORKERS = 4
+PORT = 5097
+PYTHON = sys.executable
+READY = re.compile(r'Worker (\d+) ready in ([\d.]+)ms')
+
+
+def wait_for_workers(server, num_workers):
+    '''Reads the server's log until num_workers more workers are ready, returning their
+    {pid: ms from fork to ready}'''
+    ready = {}
+    while len(ready) < num_workers:
+        line = server.stderr.readline()
+        if not line:
+            raise RuntimeError('The server stopped before its workers were ready')
+        match = READY.search(line)
+        if match:
+            ready[int(match.group(1))] = float(match.group(2))
+    return ready
+
+
+def memory_mb(pids):
+    '''(average private MB per process, total PSS MB) from /proc/<pid>/smaps_rollup'''
+    private = pss = 0
+    for pid in pids:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, value = line.split()[:2]
+                if key in ('Private_Clean:', 'Private_Dirty:'):
+                    private += int(value)
+                elif key == 'Pss:':
+                    pss += int(value)
+    return private / len(pids) / 1024, pss / 1024
+
+
+def run(database_path, size, preload):
+    pidfile = os.path.join(tempfile.gettempdir(), 'trivia_bench_startup.pid')
+    command = [PYTHON, 'serve.py', '--workers', str(WORKERS), '--bind', f'127.0.0.1:{PORT}', '--pid', pidfile]
+    env = {**os.environ, 'TRIVIA_DATABASE_PATH': database_path, 'TRIVIA_DB_CREATE_SCHEMA': 'false'}
+    start = time.perf_counter()
+    server = subprocess.Popen(command + ([] if preload else ['--no-preload']), env=env,
+                              stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True)
+    try:
+        workers = wait_for_workers(server, WORKERS)
+        started = time.perf_counter() - start
+
+        for i in range(50):
+            urllib.request.urlopen(f'http://127.0.0.1:{PORT}/api/questions?page={i + 1}').read()
+        private, pss = memory_mb(list(workers) + [server.pid])
+
+        start = time.perf_counter()
+        server.send_signal(signal.SIGHUP)
+        wait_for_workers(server, WORKERS)
+        reloaded = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    label = 'preloaded' if preload else 'no preload'
+    ready = sorted(workers.values())
+    return (f'{size:>10} {label:>11} {started:>9.2f} {ready[len(ready) // 2]:>12.1f} {private:>12.1f} '
+            f'{pss:>10.1f} {reloaded:>10.2f}')
+
+
+def main(sizes):
+    print(f"{'questions':>10} {'':>11} {'start s':>9} {'worker ms':>12} {'private MB':>12} "
+          f"{'total MB':>10} {'reload s':>10}  ({WORKERS} workers, median worker)")
+    for size in sizes:
+        app = bench_app('trivia_bench_startup')
+        seed_questions(app, size)
+        database_path = app.config['DATABASE_PATH']
+        for preload in (True, False):
+            print(run(database_path, size, preload))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PYTHON = sys.executable
+
+'''
+start_server(command, port, env)
+    starts an API server in the backend folder and waits until it answers
+'''
+
+
+def port_in_use(port):
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+def start_server(command, port, env, timeout=60):
+    if port_in_use(port):
+        raise RuntimeError(f'Something is already listening on {port}')
+
+    # In its own process group, so stop_server can take the workers down along with it
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env={**os.environ, **env},
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              start_new_session=True)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'{command[0]} exited with {server.returncode}')
+        if port_in_use(port):
+            return server
+        time.sleep(0.2)
+    stop_server(server)
+    raise RuntimeError(f'{command[0]} did not start listening on {port}')
+
+
+def stop_server(server):
+    os.killpg(server.pid, signal.SIGTERM)
+    try:
+        server.wait(10)
+    except subprocess.TimeoutExpired:
+        os.killpg(server.pid, signal.SIGKILL)
+        server.wait()
+
+    # Wait for the workers to let go of the port too, before the next server wants it
+    while True:
+        try:
+            os.killpg(server.pid, 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.2)
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return float('nan')
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+'''
+run_load(base_url, make_request, concurrency, duration)
+    keeps concurrency requests in flight for duration seconds.  make_request(client, i)
+    sends the i-th request.  Returns {"requests", "errors", "rps", "p50_ms", "p99_ms"}.
+'''
+
+
+def run_load(base_url, make_request, concurrency, duration):
+    async def main():
+        latencies = []
+        errors = 0
+        counter = 0
+        deadline = time.perf_counter() + duration
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            async def worker():
+                nonlocal errors, counter
+                while time.perf_counter() < deadline:
+                    i = counter
+                    counter += 1
+                    start = time.perf_counter()
+                    try:
+                        res = await make_request(client, i)
+                        if res.status_code >= 400 or res.json().get('success') is False:
+                            errors += 1
+                    except (httpx.HTTPError, ValueError):
+                        errors += 1
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            'rps': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.50),
+            'p99_ms': percentile(latencies, 0.99),
+        }
+
+    return asyncio.run(main())
+
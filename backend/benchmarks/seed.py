@@ -0,0 +1,63 @@
+import os
+import random
+import tempfile
+
+from app import create_app
+from models import db, questions_changed, categories_changed, Question, QuestionCount, Category
+
+CATEGORY_TYPES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+
+# Made up words for the question text, used with a Zipf-like skew (a few words are in lots
+# of questions, most are rare) so searches have realistic numbers of hits
+SYLLABLES = ['ka', 'lo', 'mi', 'ter', 'van', 'qui', 'sor', 'pel', 'dun', 'rix']
+WORDS = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+WORD_WEIGHTS = [1 / (rank + 1) for rank in range(len(WORDS))]
+
+'''
+bench_app(name, **config)
+    creates an app bound to the benchmark database, with any other settings given.  Set
+    TRIVIA_BENCH_DATABASE to point the benchmarks at Postgres, otherwise they use a
+    throwaway SQLite file.
+'''
+
+
+def bench_app(name='trivia_bench', **config):
+    database_path = os.environ.get('TRIVIA_BENCH_DATABASE')
+    if database_path is None:
+        database_path = 'sqlite:///' + os.path.join(tempfile.gettempdir(), f'{name}.db')
+    return create_app({'DATABASE_PATH': database_path, **config})
+
+
+'''
+seed_questions(app, num_questions)
+    wipes the benchmark database and fills it with synthetic questions, spread over the
+    first num_categories categories.  With category_skew above 0 the categories get a
+    Zipf-like share of the questions (category 1 the most), otherwise they're even.
+'''
+
+
+def seed_questions(app, num_questions, num_categories=len(CATEGORY_TYPES), batch_size=10000, seed=0,
+                   category_skew=0.0):
+    rng = random.Random(seed)
+    category_ids = [i + 1 for i in range(num_categories)]
+    category_weights = [1 / (rank + 1) ** category_skew for rank in range(num_categories)]
+    with app.app_context():
+        db.session.query(Question).delete()
+        db.session.query(Category).delete()
+        db.session.execute(Category.__table__.insert(),
+                           [{'id': i + 1, 'type': t} for i, t in enumerate(CATEGORY_TYPES)])
+
+        # Insert in big executemany batches, one row at a time would take forever at 1M
+        for start in range(0, num_questions, batch_size):
+            rows = [{
+                'id': i + 1,
+                'question': f"Which {' '.join(rng.choices(WORDS, WORD_WEIGHTS, k=5))} is number {i + 1}?",
+                'answer': f'Answer {i + 1}',
+                'category': rng.choices(category_ids, category_weights)[0],
+                'difficulty': rng.randint(1, 5)
+            } for i in range(start, min(start + batch_size, num_questions))]
+            db.session.execute(Question.__table__.insert(), rows)
+        QuestionCount.rebuild()
+        db.session.commit()
+    questions_changed('reset')
+    categories_changed('reset')
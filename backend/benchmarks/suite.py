@@ -0,0 +1,295 @@
+'''
+Benchmark suite for the main API endpoints, for catching performance regressions.
+
+For each dataset size it seeds the benchmark database with synthetic questions (optionally
+with a skewed spread over the categories), then drives question pages, category pages,
+searches and quiz turns through the Flask test client, and optionally a real multi-worker
+server (gunicorn).  Every run reports throughput, p50/p99 latency and peak memory, and the
+whole lot is written out as JSON so the results of two commits can be compared.
+
+Run from the backend folder:
+    python -m benchmarks.suite --sizes 1000,100000 --skew 1.0 --output before.json
+    python -m benchmarks.suite --sizes 1000,100000 --skew 1.0 --server --output after.json
+    python -m benchmarks.suite --compare before.json after.json
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from benchmarks.loadgen import start_server, stop_server, run_load, percentile, PYTHON
+from benchmarks.seed import bench_app, seed_questions
+from models import Question, QuestionCount
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+REQUESTS = 500          # Requests per endpoint through the test client
+MEMORY_REQUESTS = 50    # Requests per endpoint traced for peak memory
+WORKERS = 4
+CONCURRENCY = 20
+DURATION = 10           # Seconds of load per endpoint against the server
+PORT = 5099
+
+'''
+Scenarios
+
+Each one is a function of (rng, dataset) returning the (method, path, json body) of a
+request, so the same requests can go through the test client or over HTTP.  dataset has
+the number of questions, the number in each category, and words to search for.
+'''
+
+
+def questions_page(rng, dataset):
+    pages = max(dataset['total'] // 10, 1)
+    return 'GET', f'/api/questions?page={rng.randint(1, pages)}', None
+
+
+def category_page(rng, dataset):
+    counts = dataset['categories']
+    cat_id = rng.choice([cat_id for cat_id, num in counts.items() if num > 0])
+    pages = max(counts[cat_id] // 10, 1)
+    return 'GET', f'/api/categories/{cat_id}/questions?page={rng.randint(1, pages)}', None
+
+
+def search(rng, dataset):
+    # The words come from a sample of the questions, so they're as skewed as the seeded
+    # text: some searches hit a big chunk of the questions and most hit only a few
+    return 'POST', '/api/questions?page=1', {'searchTerm': rng.choice(dataset['words'])}
+
+
+def quiz_turn(rng, dataset):
+    previous = rng.sample(range(1, dataset['total'] + 1), min(20, dataset['total']))
+    cat_id = rng.choice([0] + list(dataset['categories']))
+    return 'POST', '/api/quizzes', {'previous_questions': previous, 'quiz_category': {'id': cat_id}}
+
+
+SCENARIOS = {
+    'questions': questions_page,
+    'category_questions': category_page,
+    'search': search,
+    'quiz': quiz_turn,
+}
+
+
+def failed(status_code, data):
+    # Error handlers answer with a 200 and success: false, so check the body too
+    return status_code >= 400 or (isinstance(data, dict) and data.get('success') is False)
+
+
+'''
+bench_client(app, scenario, dataset, num_requests)
+    sends num_requests of a scenario through the test client, one at a time
+'''
+
+
+def bench_client(app, scenario, dataset, num_requests=REQUESTS):
+    client = app.test_client()
+
+    def send(rng):
+        method, path, body = scenario(rng, dataset)
+        res = client.open(path, method=method, json=body)
+        return failed(res.status_code, res.get_json())
+
+    # A few requests first so the caches are loaded before anything is measured
+    rng = random.Random(1)
+    for _ in range(10):
+        send(rng)
+
+    rng = random.Random(0)
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(num_requests):
+        request_start = time.perf_counter()
+        errors += send(rng)
+        latencies.append((time.perf_counter() - request_start) * 1000)
+    elapsed = time.perf_counter() - start
+
+    # Peak memory is traced on a separate pass, since tracemalloc slows everything down
+    rng = random.Random(0)
+    tracemalloc.start()
+    for _ in range(min(num_requests, MEMORY_REQUESTS)):
+        send(rng)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'requests': num_requests,
+        'errors': errors,
+        'rps': round(num_requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'peak_kb': peak // 1024,
+    }
+
+
+def process_group_peak_kb(pgid):
+    '''Sum of the peak resident memory of every process in the group (Linux only)'''
+    total = 0
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                # The process group is the 5th field, after the (parenthesised) name
+                if int(f.read().rsplit(')', 1)[1].split()[2]) != pgid:
+                    continue
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+    return total
+
+
+'''
+bench_server(database_path, scenario, dataset)
+    runs a scenario against a gunicorn server with WORKERS workers, at CONCURRENCY requests
+    at once for DURATION seconds
+'''
+
+
+def bench_server(database_path, scenario, dataset, concurrency=CONCURRENCY, duration=DURATION):
+    async def send(client, i):
+        method, path, body = scenario(random.Random(i), dataset)
+        return await client.request(method, path, json=body)
+
+    command = [PYTHON, '-m', 'gunicorn', '-w', str(WORKERS), '--threads', '4',
+               '-b', f'127.0.0.1:{PORT}', 'app:create_app()']
+    server = start_server(command, PORT, {'TRIVIA_DATABASE_PATH': database_path,
+                                          'TRIVIA_DB_CREATE_SCHEMA': 'false'})
+    try:
+        base_url = f'http://127.0.0.1:{PORT}'
+        run_load(base_url, send, concurrency, min(duration, 3))    # Warm up every worker
+        result = run_load(base_url, send, concurrency, duration)
+        peak_kb = process_group_peak_kb(server.pid) if os.path.isdir('/proc') else None
+    finally:
+        stop_server(server)
+
+    return {
+        'requests': result['requests'],
+        'errors': result['errors'],
+        'rps': round(result['rps'], 1),
+        'p50_ms': round(result['p50_ms'], 3),
+        'p99_ms': round(result['p99_ms'], 3),
+        'peak_kb': peak_kb,
+    }
+
+
+def describe_dataset(app, size, sample=200):
+    with app.app_context():
+        counts = QuestionCount.all()
+        sample_ids = random.Random(0).sample(range(1, size + 1), min(sample, size))
+        texts = [q.question for q in Question.query.filter(Question.id.in_(sample_ids))]
+    return {
+        'total': size,
+        'categories': {cat_id: num for cat_id, num in counts.items() if cat_id != 0},
+        # "Which <five words> is number N?"
+        'words': [word for text in texts for word in text.split()[1:-3]],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes, skew, server, scenarios, num_requests):
+    app = bench_app('trivia_bench_suite')
+    results = []
+    for size in sizes:
+        seed_questions(app, size, category_skew=skew)
+        dataset = describe_dataset(app, size)
+
+        for name in scenarios:
+            modes = [('client', lambda: bench_client(app, SCENARIOS[name], dataset, num_requests))]
+            if server:
+                modes.append(('server', lambda: bench_server(app.config['DATABASE_PATH'],
+                                                             SCENARIOS[name], dataset)))
+            for mode, bench in modes:
+                result = {'size': size, 'skew': skew, 'endpoint': name, 'mode': mode, **bench()}
+                results.append(result)
+                print(format_row(result), file=sys.stderr)
+
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'database': app.config['DATABASE_PATH'].split(':', 1)[0],
+        'results': results,
+    }
+
+
+HEADER = f"{'size':>8} {'endpoint':>19} {'mode':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'peak KB':>9} {'errors':>7}"
+
+
+def format_row(r):
+    peak = r['peak_kb'] if r['peak_kb'] is not None else '-'
+    return (f"{r['size']:>8} {r['endpoint']:>19} {r['mode']:>7} {r['rps']:>8.0f} {r['p50_ms']:>8.2f} "
+            f"{r['p99_ms']:>8.2f} {peak:>9} {r['errors']:>7}")
+
+
+'''
+compare(before, after)
+    prints how each result in after changed from the same run in before
+'''
+
+
+def compare(before, after):
+    key = lambda r: (r['size'], r['skew'], r['endpoint'], r['mode'])
+    old = {key(r): r for r in before['results']}
+
+    print(f"{before['commit']} -> {after['commit']}")
+    print(f"{'size':>8} {'endpoint':>19} {'mode':>7} {'req/s':>16} {'p50 ms':>18} {'p99 ms':>18}")
+    for r in after['results']:
+        o = old.get(key(r))
+        if o is None:
+            continue
+
+        def change(field):
+            pct = (r[field] - o[field]) / o[field] * 100 if o[field] else 0
+            return f'{r[field]:.1f} ({pct:+.0f}%)'
+        print(f"{r['size']:>8} {r['endpoint']:>19} {r['mode']:>7} {change('rps'):>16} "
+              f"{change('p50_ms'):>18} {change('p99_ms'):>18}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the API endpoints')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma separated numbers of questions to seed')
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='how unevenly questions are spread over categories (0 for even)')
+    parser.add_argument('--endpoints', default=','.join(SCENARIOS),
+                        help='comma separated scenarios to run')
+    parser.add_argument('--requests', type=int, default=REQUESTS,
+                        help='requests per endpoint through the test client')
+    parser.add_argument('--server', action='store_true',
+                        help='also load test a multi-worker gunicorn server')
+    parser.add_argument('--output', help='file to write the JSON results to (default stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='compare two results files instead of running')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as before, open(args.compare[1]) as after:
+            compare(json.load(before), json.load(after))
+        return
+
+    print(HEADER, file=sys.stderr)
+    report = run_suite([int(size) for size in args.sizes.split(',')], args.skew, args.server,
+                       args.endpoints.split(','), args.requests)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
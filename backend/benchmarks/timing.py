@@ -0,0 +1,29 @@
+import time
+
+'''
+time_call(fn, repeat)
+    runs fn repeat times and returns the median latency in milliseconds
+'''
+
+
+def time_call(fn, repeat=20):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+'''
+time_request(client_call, repeat)
+    same as time_call, but also checks the API didn't hand back an error
+'''
+
+
+def time_request(client_call, repeat=20):
+    def checked_call():
+        data = client_call().get_json()
+        assert data.get('success', True), data
+    return time_call(checked_call, repeat)
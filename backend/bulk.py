@@ -0,0 +1,169 @@
+import csv
+import io
+import json
+from collections import Counter
+
+from models import db, questions_changed, format_question, Question, QuestionChange, QuestionCount, ALL_CATEGORIES
+from quiz import parse_level, DIFFICULTIES
+from serialization import dumps
+
+BATCH_SIZE = 1000       # Questions inserted per executemany (and per transaction)
+MAX_ERRORS = 100        # Most row errors reported back, the rest are only counted
+CHUNK_SIZE = 64 * 1024  # Characters of export sent at a time
+MAX_DELETE_IDS = 500    # Most questions one DELETE /api/questions can delete
+
+EXPORT_COLUMNS = ['id', 'question', 'answer', 'category', 'difficulty']  # Same as QUESTION_COLUMNS
+IMPORT_COLUMNS = ['question', 'answer', 'category', 'difficulty']       # What a CSV import needs
+
+
+class MissingColumns(ValueError):
+    '''Raised for a CSV import whose header row doesn't have all of IMPORT_COLUMNS'''
+
+    def __init__(self, columns):
+        super().__init__(f"Missing columns: {', '.join(columns)}")
+        self.columns = columns
+
+'''
+Bulk import
+
+Questions come in as NDJSON (one JSON object per line) or CSV (with a header row), with the
+same question/answer/category/difficulty fields as POST /api/questions.  The body is read a
+line at a time and inserted in batches, so a big import never sits in memory all at once.
+'''
+
+
+def read_rows(stream, content_type):
+    '''Yields (line number, row dict or None if the line isn't valid) from the request body'''
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+    if content_type == 'text/csv':
+        reader = csv.DictReader(text)
+        # Without them every row would be bad, so refuse the whole file up front
+        missing = [column for column in IMPORT_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise MissingColumns(missing)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(text, start=1):
+            if line.strip() == '':
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_num, row if isinstance(row, dict) else None
+
+
+def validate_row(row, categories):
+    '''Returns (question values, None) for a valid row, or (None, error message)'''
+    if row is None:
+        return None, 'Not a valid question'
+
+    question = (row.get('question') or '').strip()
+    answer = (row.get('answer') or '').strip()
+    if question == '' or answer == '':
+        return None, 'Question and answer must not be blank'
+
+    try:
+        category = int(row.get('category'))
+    except (TypeError, ValueError):
+        return None, 'Category must be a number'
+    if category not in categories:
+        return None, f'Category {category} does not exist'
+    try:
+        difficulty = parse_level(row.get('difficulty'))
+    except ValueError:
+        return None, f'Difficulty must be a whole number from {DIFFICULTIES[0]} to {DIFFICULTIES[-1]}'
+
+    return {
+        'question': question,
+        'answer': answer,
+        'category': category,
+        'difficulty': difficulty
+    }, None
+
+
+def _insert_batch(batch):
+    # One executemany for the whole batch, and the counters bumped once per category
+    # rather than once per question, all committed together
+    db.session.execute(Question.__table__.insert(), batch)
+    for category, num in Counter(values['category'] for values in batch).items():
+        QuestionCount.adjust([category], num)
+    QuestionCount.adjust([ALL_CATEGORIES], len(batch))
+    QuestionChange.log_everything()
+    db.session.commit()
+
+
+'''
+import_questions(stream, content_type, categories)
+    inserts every valid question in the body, returning (number added, number of bad rows,
+    list of up to MAX_ERRORS {"line", "message"} dicts)
+'''
+
+
+def import_questions(stream, content_type, categories, batch_size=BATCH_SIZE):
+    # (raises MissingColumns for a CSV without the columns we need, before adding anything)
+    added = 0
+    num_errors = 0
+    errors = []
+    batch = []
+
+    try:
+        for line_num, row in read_rows(stream, content_type):
+            values, error = validate_row(row, categories)
+            if error is not None:
+                num_errors += 1
+                if len(errors) < MAX_ERRORS:
+                    errors.append({'line': line_num, 'message': error})
+                continue
+
+            batch.append(values)
+            if len(batch) == batch_size:
+                _insert_batch(batch)
+                added += len(batch)
+                batch = []
+
+        if batch:
+            _insert_batch(batch)
+            added += len(batch)
+    finally:
+        if added:
+            questions_changed('reset')
+
+    return added, num_errors, errors
+
+
+'''
+export_questions(content_type, json_backend)
+    generator of NDJSON lines or CSV rows for every question, in id order
+'''
+
+
+def export_questions(content_type, batch_size=BATCH_SIZE, json_backend='stdlib'):
+    # stream_results asks for a server-side cursor (on Postgres), and yield_per hands rows
+    # over batch_size at a time, so neither the database driver nor we hold the whole table
+    rows = db.session.query(*[getattr(Question, column) for column in EXPORT_COLUMNS]) \
+        .order_by(Question.id) \
+        .execution_options(stream_results=True) \
+        .yield_per(batch_size)
+
+    # Rows are gathered into chunks of about CHUNK_SIZE characters before being sent, rather
+    # than sending every row on its own
+    buffer = io.StringIO()
+    if content_type == 'text/csv':
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        write_row = writer.writerow
+    else:
+        # The same JSON as Question.format() (the rows have the same fields), in column order
+        write_row = lambda row: buffer.write(
+            dumps(format_question(row), json_backend, sort_keys=False).decode('utf-8') + '\n')
+
+    for row in rows:
+        write_row(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,279 @@
+import bisect
+import threading
+import time
+import weakref
+from array import array
+from itertools import chain
+
+from flask import current_app, has_app_context
+from sqlalchemy import exc, func, select
+
+from models import db, on_questions_changed, Question, QuestionChange, ALL_CATEGORIES
+
+POLL_INTERVAL = 1       # Seconds between checks of the change feed for other workers' changes
+POLL_OVERLAP = 100      # Changes before the last one we saw that each poll reads again (see poll)
+FETCH_CHUNK = 900       # Ids per IN (...) when loading the questions that changed
+
+'''
+Question catalogue
+
+With CATALOGUE_ENABLED on, create_app loads the id, category and difficulty of every
+question into memory, so the question listings, counts and quiz picks can work out which
+questions they want without asking the database.  (Listings then load just the rows on
+their page, by primary key.)  Trivia is read far more than it's written, so it's worth the
+memory: 16 bytes a question (its id in four arrays).
+
+The ids are kept in sorted arrays of 32 bit ints: all of them, the ones in each category,
+and the ones of each difficulty in each category (and in all of them), which are what the
+listings and the quiz pool use.  Which arrays a question is in is also how we know its
+category and difficulty, so nothing else is kept per question.
+
+This worker's own inserts and deletes are patched in as they're committed.  Everybody's
+changes also go into the question_changes table (see QuestionChange), which the catalogue
+checks before a request, at most every CATALOGUE_POLL_INTERVAL seconds, patching in just
+the questions that changed since it last looked.  A change too big to list (a bulk
+import, a category deleted) reloads the whole catalogue.
+'''
+
+
+def _category(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None     # Not in a category (e.g. it was set NULL)
+
+
+def _contains(ids, q_id):
+    index = bisect.bisect_left(ids, q_id)
+    return index < len(ids) and ids[index] == q_id
+
+
+def _bucket_keys(category, difficulty):
+    keys = [(ALL_CATEGORIES, None)]
+    if difficulty is not None:
+        keys.append((ALL_CATEGORIES, difficulty))
+    if category is not None:
+        keys.append((category, None))
+        if difficulty is not None:
+            keys.append((category, difficulty))
+    return keys
+
+
+class QuestionCatalogue:
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.version = 0            # The last change in the feed we've caught up to
+        self.loaded = False
+        self._polled_at = float('-inf')
+        self._poll_now = False
+        self._lock = threading.RLock()
+        # (category, difficulty or None) -> sorted array of ids ('i', as ids are a 32 bit
+        # INTEGER column).  Category 0 is every question, including any without a category.
+        self._buckets = {}
+
+    def _primary(self):
+        # Always the primary database, even in a request reading from a replica (see
+        # db_replicas.py).  A replica that's behind would look like the feed went backwards
+        # and reload everything, and its rows could be older than the changes say.
+        return db.session.connection(bind=db.get_engine())
+
+    def _feed_versions(self):
+        table = QuestionChange.__table__
+        oldest, newest = self._primary().execute(select([func.min(table.c.version), func.max(table.c.version)])).first()
+        return oldest or 0, newest or 0
+
+    def load(self):
+        '''(Re)loads every question from the database'''
+        with self._lock:
+            # Before reading the questions, so anything changed while we read them gets
+            # patched in (again) by the next poll
+            version = self._feed_versions()[1]
+
+            # One array per (category, difficulty), which come out sorted since the rows are
+            # in id order.  A server-side cursor on Postgres, so a million rows don't all
+            # land in memory at once.
+            groups = {}
+            query = select([Question.id, Question.category, Question.difficulty]).order_by(Question.id)
+            rows = self._primary().execution_options(stream_results=True).execute(query)
+            for q_id, category, difficulty in rows:
+                group = groups.get((category, difficulty))
+                if group is None:
+                    group = groups[category, difficulty] = array('i')
+                group.append(q_id)
+
+            # Then the buckets are those merged together (sorted() spots the sorted runs).
+            # Always copies, as every bucket is patched on its own.
+            merged = {}
+            for (category, difficulty), ids in groups.items():
+                for key in _bucket_keys(category, difficulty):
+                    merged.setdefault(key, []).append(ids)
+            self._buckets = {key: array('i', parts[0] if len(parts) == 1 else sorted(chain.from_iterable(parts)))
+                             for key, parts in merged.items()}
+            self.version = version
+            self.loaded = True
+            self._polled_at = time.monotonic()
+            self._poll_now = False
+
+    def due(self):
+        '''Whether refresh has anything to do'''
+        return (not self.loaded or self._poll_now
+                or time.monotonic() - self._polled_at >= self.poll_interval)
+
+    def refresh(self):
+        '''Catches up with the change feed, if it's time to (run before every request)'''
+        if not self.due():
+            return
+        with self._lock:
+            if not self.loaded:
+                self.load()
+            elif self.due():
+                self.poll()
+
+    def poll(self):
+        '''Patches in the questions that changed since we last looked'''
+        with self._lock:
+            self._polled_at = time.monotonic()
+            self._poll_now = False
+            try:
+                oldest, newest = self._feed_versions()
+                if newest == self.version:
+                    return
+                if newest < self.version or oldest > self.version + 1:
+                    # The feed was cleared out, or pruned past changes we hadn't seen yet
+                    self.load()
+                    return
+
+                # Read the last few changes we've seen again too.  On Postgres the version
+                # numbers are handed out before the changes commit, so one that committed
+                # late can show up behind one we've already seen.  Patching is idempotent.
+                table = QuestionChange.__table__
+                changes = self._primary().execute(select([table.c.version, table.c.question_id])
+                                                  .where(table.c.version > self.version - POLL_OVERLAP)).fetchall()
+                if any(row.question_id is None and row.version > self.version for row in changes):
+                    self.load()
+                    return
+
+                changed = list({row.question_id for row in changes if row.question_id is not None})
+                found = {}
+                for start in range(0, len(changed), FETCH_CHUNK):
+                    rows = self._primary().execute(select([Question.id, Question.category, Question.difficulty])
+                                                   .where(Question.id.in_(changed[start:start + FETCH_CHUNK])))
+                    found.update((row.id, (row.category, row.difficulty)) for row in rows)
+                for q_id in changed:
+                    self._apply(q_id, found.get(q_id))
+                self.version = newest
+            except exc.SQLAlchemyError as e:
+                # Keep serving what we have, and try again next time
+                db.session.rollback()
+                current_app.logger.warning(f'Could not check the question catalogue for changes: {e}')
+
+    def _find(self, q_id):
+        '''Returns the (category, difficulty) the catalogue has for question q_id, or None
+        if it doesn't have it'''
+        if not _contains(self.ids(), q_id):
+            return None
+        category = difficulty = None
+        for (bucket_category, bucket_difficulty), ids in self._buckets.items():
+            if bucket_category == ALL_CATEGORIES and bucket_difficulty is not None and _contains(ids, q_id):
+                difficulty = bucket_difficulty
+            elif bucket_category != ALL_CATEGORIES and bucket_difficulty is None and _contains(ids, q_id):
+                category = bucket_category
+        return category, difficulty
+
+    def _apply(self, q_id, row):
+        '''Makes the catalogue's copy of question q_id match row, its (category, difficulty),
+        or None if it doesn't exist'''
+        with self._lock:
+            if row is not None:
+                row = (_category(row[0]), row[1])
+            old = self._find(q_id)
+            if old == row:
+                return
+            if old is not None:
+                for key in _bucket_keys(*old):
+                    ids = self._buckets[key]
+                    del ids[bisect.bisect_left(ids, q_id)]
+            if row is not None:
+                for key in _bucket_keys(*row):
+                    bisect.insort(self._buckets.setdefault(key, array('i')), q_id)
+
+    def invalidate(self):
+        '''Reloads the catalogue before the next request (keeping what it has until then)'''
+        self.loaded = False
+
+    def discard(self, q_id):
+        '''Drops a question that turned out not to exist any more'''
+        self._apply(q_id, None)
+
+    def ids(self, category=ALL_CATEGORIES, difficulty=None):
+        '''Returns the sorted array of ids in the category, and of one difficulty if given'''
+        return self._buckets.get((category, difficulty), array('i'))
+
+    def count(self, category=ALL_CATEGORIES):
+        return len(self.ids(category))
+
+    def counts(self):
+        '''Returns a {category id: question count} map, not including the total'''
+        return {category: len(ids) for (category, difficulty), ids in self._buckets.items()
+                if difficulty is None and category != ALL_CATEGORIES}
+
+    def question_changed(self, action, question):
+        if not self.loaded:
+            return
+        if action == 'insert':
+            self._apply(question.id, (question.category, question.difficulty))
+        elif action == 'delete':
+            self._apply(question.id, None)
+        else:
+            # What changed is in the feed, so catch up with it before the next request
+            self._poll_now = True
+
+
+'''
+current_catalogue()
+    the current app's catalogue, or None if it doesn't have one (CATALOGUE_ENABLED is off)
+'''
+
+
+def current_catalogue():
+    return current_app.extensions.get('catalogue') if has_app_context() else None
+
+
+# Every live catalogue, to tell about resets made outside of an app (like seeding the
+# benchmark database), which might not be in the change feed.  Weak references, so the
+# catalogues of apps that have gone away aren't kept alive.
+live_catalogues = weakref.WeakSet()
+
+
+def question_changed(action, question=None):
+    if has_app_context():
+        # Changes made in another app's context are for that app's database
+        catalogue = current_catalogue()
+        if catalogue is not None:
+            catalogue.question_changed(action, question)
+    elif action == 'reset':
+        for catalogue in list(live_catalogues):
+            catalogue.invalidate()
+
+
+on_questions_changed(question_changed)
+
+
+'''
+setup_catalogue(app)
+    loads the app's question catalogue, if CATALOGUE_ENABLED is on
+'''
+
+
+def setup_catalogue(app):
+    if not app.config.get('CATALOGUE_ENABLED', False):
+        return None
+
+    catalogue = QuestionCatalogue(app.config.get('CATALOGUE_POLL_INTERVAL', POLL_INTERVAL))
+    with app.app_context():
+        catalogue.load()
+    app.extensions['catalogue'] = catalogue
+    live_catalogues.add(catalogue)
+    app.before_request(catalogue.refresh)
+    return catalogue
@@ -0,0 +1,61 @@
+import json
+import time
+import zlib
+
+from models import Category, on_categories_changed
+
+'''
+CategoryCache
+    keeps the {id: type} map of categories in memory, since categories almost never change
+    but nearly every request needs them
+'''
+
+
+class CategoryCache:
+    # Other worker processes can change categories without our listeners hearing about
+    # it, so the map is reloaded once it gets this old (in seconds).  0 turns caching off.
+    MAX_AGE = 60
+
+    def __init__(self, max_age=MAX_AGE):
+        self.max_age = max_age
+        self._loaded_at = None
+        self._categories = {}
+        self.version = None
+
+    def stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.max_age
+
+    def _ensure_loaded(self):
+        if self.stale():
+            self.load({cat.id: cat.type for cat in Category.query.all()})
+
+    def load(self, categories):
+        # The version is a checksum of the map rather than a counter, so every worker
+        # agrees on it (and on the ETag) without having to talk to each other
+        canonical = json.dumps(sorted(categories.items()))
+        self.version = zlib.crc32(canonical.encode('utf-8'))
+        self._categories = categories
+        self._loaded_at = time.monotonic()
+
+    def all(self):
+        '''Returns the {id: type} map of every category'''
+        self._ensure_loaded()
+        return self._categories
+
+    def get(self, cat_id):
+        '''Returns the category's formatted dict, or None if it doesn't exist'''
+        categories = self.all()
+        if cat_id not in categories:
+            return None
+        return {'id': cat_id, 'type': categories[cat_id]}
+
+    def etag(self):
+        self._ensure_loaded()
+        return f'categories-{self.version}'
+
+    def invalidate(self, *args):
+        self._loaded_at = None
+
+
+category_cache = CategoryCache()
+on_categories_changed(category_cache.invalidate)
@@ -0,0 +1,124 @@
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_SIZE = 1024         # Bytes below which a response isn't worth compressing
+MAX_CACHED = 256        # Compressed bodies kept for responses with an ETag
+
+'''
+Response compression
+
+JSON (and the NDJSON/CSV of the bulk routes) is mostly repeated keys and words, so it
+compresses to a fraction of its size.  Responses of at least COMPRESS_MIN_SIZE bytes are
+gzipped, or brotli'd if the brotli package is installed (pip install brotli) and the
+client prefers it, for clients whose Accept-Encoding takes either.  Smaller responses go
+out as they are, since the headers would eat most of the saving.
+
+Compressing the same cached page over and over would be wasted CPU, so the compressed
+bodies of responses with an ETag (the response cache's) are kept too, keyed by the ETag.
+Streamed responses (the exports) are left alone, a reverse proxy can compress those.
+'''
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/csv')
+
+
+def available_encodings():
+    # In the order we'd rather use them, when the client likes them equally
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(data, encoding, level=5, brotli_quality=4):
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    # mtime=0 so the same body always compresses to the same bytes
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+'''
+choose_encoding(accept_encodings)
+    returns the encoding to use for a request's Accept-Encoding (werkzeug's parsed
+    request.accept_encodings), or None if it doesn't take any we have
+'''
+
+
+def choose_encoding(accept_encodings):
+    best, best_quality = None, 0
+    for encoding in available_encodings():
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class CompressedBodies:
+    '''LRU of compressed bodies, keyed by (path, ETag, encoding)'''
+
+    def __init__(self, max_entries=MAX_CACHED):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        with self._lock:
+            self._entries[key] = body
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+'''
+setup_compression(app)
+    compresses the app's responses for the clients that accept it, if COMPRESS_ENABLED is on
+'''
+
+
+def setup_compression(app):
+    if not app.config.get('COMPRESS_ENABLED', True):
+        return
+    config = app.config
+    bodies = CompressedBodies()
+
+    @app.after_request
+    def compress_response(response):
+        if (not config['COMPRESS_ENABLED'] or response.status_code != 200 or response.direct_passthrough
+                or response.is_streamed or response.mimetype not in COMPRESSIBLE_TYPES
+                or 'Content-Encoding' in response.headers):
+            return response
+        data = response.get_data()
+        if len(data) < config.get('COMPRESS_MIN_SIZE', MIN_SIZE):
+            return response
+
+        # Caches in between have to keep the compressed and plain versions apart
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        etag, weak = response.get_etag()
+        key = (request.path, etag, encoding)
+        compressed = bodies.get(key) if etag else None
+        if compressed is None:
+            compressed = compress(data, encoding, config.get('COMPRESS_LEVEL', 5),
+                                  config.get('COMPRESS_BROTLI_QUALITY', 4))
+            if etag:
+                bodies.set(key, compressed)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            # Not byte for byte the body the ETag was made from any more, so it's only a
+            # weak match now (like nginx does).  Revalidating with it still gets a 304.
+            response.set_etag(etag, weak=True)
+        return response
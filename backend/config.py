@@ -0,0 +1,100 @@
+import os
+
+from catalogue import POLL_INTERVAL
+from compression import MIN_SIZE
+from db_replicas import RETRY_AFTER
+from models import database_path
+from quiz import MAX_ROUND_SIZE
+from rate_limit import (SEARCH_PER_MINUTE, SEARCH_BURST, SEARCH_CONCURRENCY,
+                        QUIZ_PER_MINUTE, QUIZ_BURST, QUIZ_CONCURRENCY, TRUSTED_PROXIES)
+from search import MAX_RESULTS
+from sessions import SESSION_TTL, MAX_SESSIONS
+
+'''
+Settings for create_app, with their defaults.  Every one of them can be set with an
+environment variable of the same name prefixed with TRIVIA_ (e.g. TRIVIA_DB_POOL_SIZE=20),
+and test_config passed to create_app overrides both.
+'''
+DEFAULTS = {
+    # Database
+    'DATABASE_PATH': database_path,
+    'DB_CREATE_SCHEMA': True,       # Create missing tables/indexes at startup
+    'DB_POOL_SIZE': 5,              # Connections kept open per worker process
+    'DB_MAX_OVERFLOW': 10,          # Extra connections allowed when the pool is all in use
+    'DB_POOL_TIMEOUT': 30,          # Seconds to wait for a connection before giving up
+    'DB_POOL_RECYCLE': 1800,        # Seconds before a connection is replaced (-1 for never)
+    'DB_POOL_PRE_PING': True,       # Check connections are still alive before using them
+    'DB_STATEMENT_TIMEOUT': 0,      # Milliseconds before Postgres cancels a query (0 for never)
+    'DB_READ_ONLY': False,          # Refuse every write, e.g. for a server of a copied SQLite file
+    'DB_REPLICAS': '',              # Read replica URLs, comma separated (see db_replicas.py)
+    'DB_REPLICA_RETRY': RETRY_AFTER,    # Seconds before a replica that failed is tried again
+
+    # Responses
+    'JSON_BACKEND': 'stdlib',       # 'orjson' for faster JSON encoding, if it's installed
+    'COMPRESS_ENABLED': True,       # gzip/brotli responses for clients that accept it
+    'COMPRESS_MIN_SIZE': MIN_SIZE,  # Bytes below which responses go out uncompressed
+    'COMPRESS_LEVEL': 5,            # gzip level, 1 (fastest) to 9 (smallest)
+    'COMPRESS_BROTLI_QUALITY': 4,   # brotli quality, 0 (fastest) to 11, if brotli is installed
+
+    # Response cache for question listings (see response_cache.py)
+    'RESPONSE_CACHE': 'memory',     # 'memory', 'file:///<directory>' or 'off'
+    'RESPONSE_CACHE_SIZE': 1000,    # Most responses the cache keeps (per worker with 'memory')
+    'RESPONSE_CACHE_HTTP_MAX_AGE': 0,   # Seconds browsers/proxies may reuse a page without asking
+
+    # In-memory question catalogue (see catalogue.py)
+    'CATALOGUE_ENABLED': False,     # Keep every question's id/category/difficulty in memory
+    'CATALOGUE_POLL_INTERVAL': POLL_INTERVAL,   # Seconds between checks for other workers' changes
+
+    # Request instrumentation (see metrics.py)
+    'METRICS_ENABLED': False,       # Record request/query stats and serve them at /metrics
+    'METRICS_SLOW_QUERY_MS': 500,   # Log queries slower than this (0 for never)
+    'METRICS_N_PLUS_ONE': 10,       # Log requests running the same SQL this many times
+
+    # Searches
+    'SEARCH_MAX_RESULTS': MAX_RESULTS,  # Most hits a search without ?page= returns (0 for all of them)
+
+    # Rate limiting and admission control for searches and quiz turns (see rate_limit.py)
+    'RATE_LIMIT_ENABLED': False,
+    'RATE_LIMIT_CLIENT_HEADER': '',     # e.g. X-Forwarded-For behind a proxy, otherwise the IP address
+    'RATE_LIMIT_TRUSTED_PROXIES': TRUSTED_PROXIES,  # Proxies adding to that header, its client is this far from the right
+    'RATE_LIMIT_SEARCH_PER_MINUTE': SEARCH_PER_MINUTE,      # Per client (0 for no limit)
+    'RATE_LIMIT_SEARCH_BURST': SEARCH_BURST,                # Per client, all at once
+    'RATE_LIMIT_SEARCH_CONCURRENCY': SEARCH_CONCURRENCY,    # Per worker, at the same time (0 for no limit)
+    'RATE_LIMIT_QUIZ_PER_MINUTE': QUIZ_PER_MINUTE,
+    'RATE_LIMIT_QUIZ_BURST': QUIZ_BURST,
+    'RATE_LIMIT_QUIZ_CONCURRENCY': QUIZ_CONCURRENCY,
+
+    # Quizzes
+    'QUIZ_ROUND_MAX': MAX_ROUND_SIZE,   # Most questions one POST /api/quizzes/round can ask for
+
+    # Quiz sessions
+    'QUIZ_SESSION_STORE': 'memory',
+    'QUIZ_SESSION_TTL': SESSION_TTL,
+    'QUIZ_SESSION_MAX': MAX_SESSIONS,
+}
+
+
+def _parse(value, default):
+    # Environment variables are all strings, so convert them to the type of the default
+    if isinstance(default, bool):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, int):
+        return int(value)
+    return value
+
+
+'''
+load_config(test_config)
+    returns the settings dict for create_app
+'''
+
+
+def load_config(test_config=None, environ=os.environ):
+    config = dict(DEFAULTS)
+    for key, default in DEFAULTS.items():
+        value = environ.get(f'TRIVIA_{key}')
+        if value is not None:
+            config[key] = _parse(value, default)
+    if test_config is not None:
+        config.update(test_config)
+    return config
@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+'''
+TimedQueuePool
+    SQLAlchemy's usual connection pool, but keeping track of how long requests wait to get
+    a connection, so pool sizes can be chosen against Postgres' connection limit
+'''
+
+
+class TimedQueuePool(QueuePool):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'size': self.size(),
+                'checked_out': self.checkedout(),
+                'overflow': max(self.overflow(), 0),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'total_wait_seconds': round(self.total_wait, 6),
+                'max_wait_seconds': round(self.max_wait, 6),
+            }
+
+
+'''
+engine_options(config, database_path)
+    SQLALCHEMY_ENGINE_OPTIONS for the pool settings in config
+'''
+
+
+def engine_options(config, database_path):
+    options = {
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', -1),
+    }
+
+    # SQLite doesn't go over the network, so it doesn't get a pool of connections (or
+    # statement timeouts) and SQLAlchemy picks its own pool for it
+    if database_path.startswith('sqlite'):
+        return options
+
+    options.update({
+        'poolclass': TimedQueuePool,
+        'pool_size': config.get('DB_POOL_SIZE', 5),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+    })
+    settings = []
+    statement_timeout = config.get('DB_STATEMENT_TIMEOUT', 0)
+    if statement_timeout:
+        settings.append(f'-c statement_timeout={int(statement_timeout)}')
+    if config.get('DB_READ_ONLY', False):
+        settings.append('-c default_transaction_read_only=on')
+    if settings and database_path.startswith(('postgres', 'postgresql')):
+        options['connect_args'] = {'options': ' '.join(settings)}
+    return options
+
+
+'''
+pool_stats(engine)
+    the stats of the engine's pool, or None if it isn't a TimedQueuePool
+'''
+
+
+def pool_stats(engine):
+    if isinstance(engine.pool, TimedQueuePool):
+        return engine.pool.stats()
+    return None
+
+
+'''
+sqlite_pragmas(read_only)
+    returns an engine connect listener that sets up each new SQLite connection
+'''
+
+
+def sqlite_pragmas(read_only=False):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # SQLite ignores foreign keys unless they're turned on for every connection, and
+        # deleting a category relies on ON DELETE SET NULL like it does on Postgres
+        cursor.execute('PRAGMA foreign_keys=ON')
+        if read_only:
+            cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+    return on_connect
+
+
+'''
+fork_safe(engine)
+    makes sure no process uses a connection opened by another (e.g. its parent, before it
+    forked), by replacing those as they're checked out of the pool
+'''
+
+
+def fork_safe(engine):
+    def on_connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info.get('pid', os.getpid()) != os.getpid():
+            # Let go of it without closing it, it's still the other process' connection
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError('Connection belongs to another process')
+
+    event.listen(engine, 'connect', on_connect)
+    event.listen(engine, 'checkout', on_checkout)
@@ -0,0 +1,167 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event, exc, orm
+from sqlalchemy.sql.expression import UpdateBase
+
+from db_pool import engine_options, pool_stats, sqlite_pragmas
+
+RETRY_AFTER = 30    # Seconds a replica that failed is left alone before it's tried again
+
+'''
+Read replicas
+
+With DB_REPLICAS set (database URLs, comma separated), the reads of GET requests and quiz
+turns go to one of the replicas instead of the primary database, taking turns round-robin
+between them.  Everything else, and any write (ORM flushes, INSERT/UPDATE/DELETE
+statements), always goes to the primary.  A request sticks to the replica it was given,
+so all its reads see the same data.
+
+A replica that can't be connected to is left out for DB_REPLICA_RETRY seconds, and when
+every replica is out the reads go to the primary.  Each replica is also checked (a
+connection checked out of its pool, which pings it) when it's first used and then at most
+every DB_REPLICA_RETRY seconds.  A replica that goes down between checks fails the requests
+already sent to it, but not the ones after.
+'''
+
+
+class ReplicaSet:
+
+    def __init__(self, engines, retry_after=RETRY_AFTER):
+        self.engines = engines
+        self.retry_after = retry_after
+        self._turns = itertools.count()
+        self._lock = threading.Lock()
+        self._down_until = {}   # engine -> time it can be tried again
+        self._checked_at = {}   # engine -> time it last connected fine
+
+        for engine in engines:
+            event.listen(engine, 'handle_error', self._handle_error)
+
+    def _handle_error(self, context):
+        # Only trouble reaching the replica counts, not errors in the SQL
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+    def mark_down(self, engine):
+        self._down_until[engine] = time.monotonic() + self.retry_after
+        self._checked_at.pop(engine, None)
+
+    def healthy(self, engine):
+        return time.monotonic() >= self._down_until.get(engine, 0)
+
+    def _check(self, engine):
+        if time.monotonic() - self._checked_at.get(engine, float('-inf')) < self.retry_after:
+            return True
+        try:
+            engine.connect().close()
+        except exc.SQLAlchemyError:
+            self.mark_down(engine)
+            return False
+        self._checked_at[engine] = time.monotonic()
+        return True
+
+    def pick(self):
+        '''Returns the next healthy replica's engine, or None if they're all down'''
+        with self._lock:
+            start = next(self._turns)
+        for i in range(len(self.engines)):
+            engine = self.engines[(start + i) % len(self.engines)]
+            if self.healthy(engine) and self._check(engine):
+                return engine
+        return None
+
+    def status(self):
+        return [{
+            'url': repr(engine.url),    # With the password masked
+            'healthy': self.healthy(engine),
+            'pool': pool_stats(engine)
+        } for engine in self.engines]
+
+
+class RoutingSession(SignallingSession):
+    '''Flask-SQLAlchemy's session, but reading from the request's replica if it has one'''
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('db_replica') if has_app_context() else None
+        if replica is not None and not self._flushing and not isinstance(clause, UpdateBase):
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+'''
+use_replica()
+    sends the rest of this request's reads to a replica (if there are any, and one's up).
+    GET requests do this automatically, views that only read but aren't GETs (like quiz
+    turns) call it themselves.
+'''
+
+
+def use_replica():
+    replicas = current_app.extensions.get('db_replicas')
+    if replicas is not None and 'db_replica' not in g:
+        g.db_replica = replicas.pick()
+
+
+def route_reads():
+    if request.method in ('GET', 'HEAD'):
+        use_replica()
+
+
+'''
+reading_replica()
+    whether this request's reads are going to a replica
+on_primary()
+    a with block whose reads go to the primary, even in a request reading from a replica.
+    For making sure of something a replica that's behind might not have seen yet.
+'''
+
+
+def reading_replica():
+    return has_app_context() and g.get('db_replica') is not None
+
+
+@contextmanager
+def on_primary():
+    replica = g.pop('db_replica', None)
+    try:
+        yield
+    finally:
+        if replica is not None:
+            g.db_replica = replica
+
+
+'''
+setup_replicas(app)
+    creates the engines for the DB_REPLICAS of app.config, if there are any
+'''
+
+
+def setup_replicas(app):
+    urls = app.config.get('DB_REPLICAS', '')
+    if isinstance(urls, str):
+        urls = [url.strip() for url in urls.split(',')]
+    urls = [url for url in urls if url]
+    if not urls:
+        return
+
+    engines = []
+    for url in urls:
+        engine = create_engine(url, **engine_options(app.config, url))
+        if engine.dialect.name == 'sqlite':
+            # A stand-in for a real replica, so make sure nothing gets written to it
+            event.listen(engine, 'connect', sqlite_pragmas(read_only=True))
+        engines.append(engine)
+
+    app.extensions['db_replicas'] = ReplicaSet(engines, app.config.get('DB_REPLICA_RETRY', RETRY_AFTER))
+    app.before_request(route_reads)
@@ -0,0 +1,97 @@
+import os
+import re
+import sys
+
+from sqlalchemy import Integer
+
+from models import db, questions_changed, categories_changed, Category, Question, QuestionChange, QuestionCount
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trivia.psql')
+
+'''
+Fixtures
+
+Loads the data in a pg_dump file (trivia.psql) into whatever database the app is bound to,
+so the tests and small deployments can run on SQLite without Postgres and psql.  Only the
+COPY blocks of the tables we have models for are read, everything else in the dump (owners,
+sequences, constraints, ...) comes from the models instead.
+'''
+FIXTURE_MODELS = [Category, Question]      # In the order they're loaded, for the foreign key
+
+COPY_HEADER = re.compile(r'^COPY (?:\w+\.)?(\w+) \(([^)]*)\) FROM stdin;$')
+COPY_ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', '\\': '\\'}
+
+
+def _unescape(value):
+    # COPY's text format: \N is NULL, and tabs/newlines/backslashes are backslash escaped
+    if value == '\\N':
+        return None
+    return re.sub(r'\\(.)', lambda m: COPY_ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def read_dump(path=FIXTURE_PATH):
+    '''Returns {table name: list of row dicts} from the COPY blocks of a pg_dump file'''
+    tables = {}
+    with open(path, encoding='utf-8') as f:
+        rows = None
+        for line in f:
+            line = line.rstrip('\n')
+            if rows is None:
+                header = COPY_HEADER.match(line)
+                if header:
+                    columns = [column.strip() for column in header.group(2).split(',')]
+                    rows = tables.setdefault(header.group(1), [])
+            elif line == '\\.':
+                rows = None
+            else:
+                rows.append(dict(zip(columns, (_unescape(value) for value in line.split('\t')))))
+    return tables
+
+
+def _typed(model, row):
+    # Everything in a dump is text, so convert it for the column types that aren't
+    table = model.__table__
+    return {name: int(value) if value is not None and isinstance(table.c[name].type, Integer) else value
+            for name, value in row.items() if name in table.c}
+
+
+'''
+load_fixture(app, path)
+    replaces the categories and questions in the app's database with the ones in the dump
+    at path (trivia.psql by default), and recounts the questions
+'''
+
+
+def load_fixture(app, path=FIXTURE_PATH):
+    tables = read_dump(path)
+    with app.app_context():
+        for model in reversed(FIXTURE_MODELS):
+            db.session.query(model).delete()
+        for model in FIXTURE_MODELS:
+            rows = [_typed(model, row) for row in tables.get(model.__tablename__, [])]
+            if rows:
+                db.session.execute(model.__table__.insert(), rows)
+
+        # Ids were given explicitly, so Postgres' sequences need moving past them
+        if db.engine.dialect.name == 'postgresql':
+            for model in FIXTURE_MODELS:
+                table = model.__tablename__
+                db.session.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                   f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)")
+
+        QuestionCount.rebuild()
+        QuestionChange.log_everything()
+        db.session.commit()
+
+    questions_changed('reset')
+    categories_changed('reset')
+
+
+# Builds a database from a dump, e.g. a SQLite file for a server without Postgres:
+#     python fixtures.py sqlite:////srv/trivia.db [trivia.psql]
+if __name__ == '__main__':
+    from app import create_app
+
+    if len(sys.argv) < 2:
+        sys.exit('usage: python fixtures.py <database url> [dump file]')
+    load_fixture(create_app({'DATABASE_PATH': sys.argv[1]}), *sys.argv[2:3])
@@ -0,0 +1,210 @@
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event
+
+from db_pool import pool_stats
+
+logger = logging.getLogger(__name__)
+
+# Prometheus' default latency buckets (in seconds), and some for counts per request
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+'''
+Request instrumentation
+
+When METRICS_ENABLED is on, every request records how long it took, how many SQL queries
+it ran (and how long they took, and how many rows they returned or changed), per endpoint.
+It's all served in Prometheus' text format at GET /metrics.  On top of that:
+    - queries slower than METRICS_SLOW_QUERY_MS are logged with their SQL
+    - a request that runs the same SQL METRICS_N_PLUS_ONE times or more is logged as a
+      likely N+1 (e.g. loading rows one at a time in a loop) and counted
+
+The numbers are kept per worker process, so each worker has to be scraped on its own.
+When METRICS_ENABLED is off none of the hooks are even registered, so it costs nothing.
+'''
+
+
+class Histogram:
+    '''Cumulative bucket counts, a sum and a count, the way Prometheus wants them'''
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class RequestStats:
+    '''What one request did with the database, kept on flask.g while it runs'''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.rows = 0
+        self.statements = Counter()     # SQL text -> times run
+
+
+class Metrics:
+
+    def __init__(self, slow_query_ms=500, n_plus_one=10):
+        self.slow_query = slow_query_ms / 1000 if slow_query_ms else None
+        self.n_plus_one = n_plus_one
+        self._lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))     # (endpoint, method)
+        self.queries_per_request = defaultdict(lambda: Histogram(QUERY_BUCKETS))  # endpoint
+        self.requests = Counter()       # (endpoint, method, status)
+        self.queries = Counter()        # endpoint
+        self.query_time = Counter()     # endpoint
+        self.rows = Counter()           # endpoint
+        self.slow_queries = Counter()   # endpoint
+        self.n_plus_ones = Counter()    # endpoint
+        self.collectors = []            # Functions returning more lines for render (e.g. the rate limiter's)
+
+    # SQLAlchemy engine events
+    ###############################
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context.query_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.query_start
+        stats = getattr(g, 'request_stats', None) if has_app_context() else None
+        if stats is None:
+            return  # Not part of a request (e.g. startup)
+
+        stats.queries += 1
+        stats.query_time += elapsed
+        stats.statements[statement] += 1
+        # Rows returned or changed, when the driver says (psycopg2 does for SELECTs too,
+        # sqlite3 only for writes)
+        if cursor.rowcount > 0:
+            stats.rows += cursor.rowcount
+
+        if self.slow_query is not None and elapsed >= self.slow_query:
+            endpoint = request.endpoint or 'unmatched'
+            with self._lock:
+                self.slow_queries[endpoint] += 1
+            logger.warning('Slow query (%.0f ms) in %s: %s', elapsed * 1000, endpoint, statement)
+
+    # Flask request hooks
+    ###############################
+    def before_request(self):
+        g.request_stats = RequestStats()
+
+    def after_request(self, response):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats.start
+        endpoint = request.endpoint or 'unmatched'
+
+        repeated = [(sql, times) for sql, times in stats.statements.items() if times >= self.n_plus_one]
+        for sql, times in repeated:
+            logger.warning('Possible N+1 in %s: ran %d times: %s', endpoint, times, sql)
+
+        with self._lock:
+            self.latency[endpoint, request.method].observe(elapsed)
+            self.queries_per_request[endpoint].observe(stats.queries)
+            self.requests[endpoint, request.method, response.status_code] += 1
+            self.queries[endpoint] += stats.queries
+            self.query_time[endpoint] += stats.query_time
+            self.rows[endpoint] += stats.rows
+            if repeated:
+                self.n_plus_ones[endpoint] += 1
+        return response
+
+    # Prometheus text format
+    ###############################
+    def render(self, engine):
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def histogram(name, help_text, histograms):
+            header(name, 'histogram', help_text)
+            for labels, hist in sorted(histograms.items()):
+                labels = format_labels(labels)
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f'{name}_sum{{{labels}}} {hist.sum}')
+                lines.append(f'{name}_count{{{labels}}} {hist.count}')
+
+        def counter(name, help_text, values):
+            header(name, 'counter', help_text)
+            for labels, value in sorted(values.items()):
+                lines.append(f'{name}{{{format_labels(labels)}}} {value}')
+
+        with self._lock:
+            histogram('trivia_request_duration_seconds', 'Time taken to serve requests',
+                      {(('endpoint', e), ('method', m)): h for (e, m), h in self.latency.items()})
+            histogram('trivia_request_queries', 'SQL queries run per request',
+                      {(('endpoint', e),): h for e, h in self.queries_per_request.items()})
+            counter('trivia_requests_total', 'Requests served',
+                    {(('endpoint', e), ('method', m), ('status', s)): n for (e, m, s), n in self.requests.items()})
+            counter('trivia_db_queries_total', 'SQL queries run by requests',
+                    {(('endpoint', e),): n for e, n in self.queries.items()})
+            counter('trivia_db_query_seconds_total', 'Time spent in SQL queries by requests',
+                    {(('endpoint', e),): n for e, n in self.query_time.items()})
+            counter('trivia_db_rows_total', 'Rows returned or changed by SQL queries, where the driver reports it',
+                    {(('endpoint', e),): n for e, n in self.rows.items()})
+            counter('trivia_db_slow_queries_total', 'SQL queries slower than METRICS_SLOW_QUERY_MS',
+                    {(('endpoint', e),): n for e, n in self.slow_queries.items()})
+            counter('trivia_db_n_plus_one_total', 'Requests that ran the same SQL METRICS_N_PLUS_ONE times or more',
+                    {(('endpoint', e),): n for e, n in self.n_plus_ones.items()})
+
+        pool = pool_stats(engine)
+        if pool is not None:
+            for key, value in pool.items():
+                kind = 'counter' if key in ('checkouts', 'timeouts', 'total_wait_seconds') else 'gauge'
+                header(f'trivia_db_pool_{key}', kind, f'Connection pool {key.replace("_", " ")}')
+                lines.append(f'trivia_db_pool_{key} {value}')
+
+        for collect in self.collectors:
+            lines.extend(collect())
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels)
+
+
+'''
+setup_metrics(app, db)
+    hooks request instrumentation into app if METRICS_ENABLED is set, and adds the
+    /metrics endpoint.  Returns the Metrics, or None when it's turned off.
+'''
+
+
+def setup_metrics(app, db):
+    if not app.config.get('METRICS_ENABLED', False):
+        return None
+
+    metrics = Metrics(slow_query_ms=app.config.get('METRICS_SLOW_QUERY_MS', 500),
+                      n_plus_one=app.config.get('METRICS_N_PLUS_ONE', 10))
+    engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', metrics.before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', metrics.after_cursor_execute)
+    app.before_request(metrics.before_request)
+    app.after_request(metrics.after_request)
+
+    @app.route('/metrics')
+    def get_metrics():
+        return Response(metrics.render(engine), mimetype='text/plain; version=0.0.4')
+
+    app.extensions['trivia_metrics'] = metrics
+    return metrics
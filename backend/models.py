@@ -1,39 +1,207 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import random
+from collections import Counter
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, create_engine, event, func, inspect, select
+from sqlalchemy.schema import CreateTable
 import json
 
+from db_pool import engine_options, sqlite_pragmas
+from db_replicas import RoutingSQLAlchemy, setup_replicas
+
 database_name = "trivia"
 database_path = "postgres://{}/{}".format('postgres:a@localhost:5432', database_name)
 
-db = SQLAlchemy()
+# Reads can be sent to read replicas (see db_replicas.py)
+db = RoutingSQLAlchemy()
+
+'''
+on_questions_changed(listener)
+    registers listener(action, question) to be called after questions are committed.
+    action is 'insert' or 'delete' for a single question, or 'reset' (with question=None)
+    when the questions table changed in some way we can't describe row by row
+'''
+question_listeners = []
+
+
+def on_questions_changed(listener):
+    question_listeners.append(listener)
+    return listener
+
+
+def questions_changed(action, question=None):
+    for listener in question_listeners:
+        listener(action, question)
+
+
+'''
+on_categories_changed(listener)
+    same as on_questions_changed, but for categories.  action is 'insert', 'update' or
+    'delete' for a single category, or 'reset' (with category=None)
+'''
+category_listeners = []
+
+
+def on_categories_changed(listener):
+    category_listeners.append(listener)
+    return listener
+
+
+def categories_changed(action, category=None):
+    for listener in category_listeners:
+        listener(action, category)
+
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service.  Connection pool settings come
+    from app.config (see config.py), and DB_CREATE_SCHEMA=False skips creating tables and
+    indexes, for when the database is known to be set up already.
+
+    database_path can also be SQLite: a file (sqlite:///trivia.db), or in memory (sqlite://),
+    which lasts as long as the app and starts out empty.  fixtures.py loads trivia.psql into
+    either.  DB_READ_ONLY=True makes the database refuse writes (and skips the schema setup).
 '''
 
 
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config, database_path)
     db.app = app
     db.init_app(app)
-    db.create_all()
+    setup_replicas(app)
+
+    # In the app's context, so the session used here is thrown away afterwards rather than
+    # staying bound to this app (and its database) for whatever runs next on the thread
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', sqlite_pragmas(app.config.get('DB_READ_ONLY', False)))
+
+        if not app.config.get('DB_CREATE_SCHEMA', True) or app.config.get('DB_READ_ONLY', False):
+            setup_search_index(app, create=False)
+            return
+
+        db.create_all()
+        migrate_category_column(app)
+        setup_search_index(app)
+
+        # Fill in the question counters if they're new (e.g. a database restored from trivia.psql)
+        if QuestionCount.query.first() is None:
+            QuestionCount.rebuild()
+            db.session.commit()
+
+
+'''
+setup_search_index(app, create)
+    on Postgres, makes sure the pg_trgm GIN index that question searches use exists.  This
+    also covers databases restored from trivia.psql, which create_all leaves alone.  With
+    create=False it only checks whether the index is there.
+'''
+
+
+def setup_search_index(app, create=True):
+    if 'SEARCH_BACKEND' in app.config:
+        return  # Set explicitly, so leave it be
+    app.config['SEARCH_BACKEND'] = 'python'
+    if db.engine.dialect.name != 'postgresql':
+        return
+
+    if not create:
+        with db.engine.connect() as conn:
+            found = conn.execute("SELECT 1 FROM pg_indexes WHERE indexname = 'questions_question_trgm'").scalar()
+        if found:
+            app.config['SEARCH_BACKEND'] = 'pg_trgm'
+        return
+
+    try:
+        with db.engine.begin() as conn:
+            conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            conn.execute('CREATE INDEX IF NOT EXISTS questions_question_trgm '
+                         'ON questions USING gin (question gin_trgm_ops)')
+        app.config['SEARCH_BACKEND'] = 'pg_trgm'
+    except Exception as e:
+        # Probably not allowed to create the extension.  Searching still works, just slower.
+        app.logger.warning(f'Could not set up the pg_trgm search index: {e}')
+
+
+'''
+migrate_category_column(app)
+    brings an existing questions table up to date with the Question model: the category
+    column used to be a string, and had no indexes.  Does nothing if it's all there already.
+'''
+
+
+def migrate_category_column(app):
+    inspector = inspect(db.engine)
+    category = next(col for col in inspector.get_columns('questions') if col['name'] == 'category')
+
+    if not isinstance(category['type'], Integer):
+        app.logger.warning('Migrating questions.category to an integer foreign key')
+        if db.engine.dialect.name == 'postgresql':
+            with db.engine.begin() as conn:
+                conn.execute("ALTER TABLE questions ALTER COLUMN category TYPE integer "
+                             "USING NULLIF(trim(category), '')::integer")
+                # Questions pointing at categories that don't exist would stop the foreign key
+                if not inspector.get_foreign_keys('questions'):
+                    conn.execute('UPDATE questions SET category = NULL '
+                                 'WHERE category NOT IN (SELECT id FROM categories)')
+                    conn.execute('ALTER TABLE questions ADD CONSTRAINT category FOREIGN KEY (category) '
+                                 'REFERENCES categories(id) ON UPDATE CASCADE ON DELETE SET NULL')
+        else:
+            # SQLite can't change a column's type, so copy everything into a new table.  The
+            # driver only opens a transaction of its own before inserts and updates, so the
+            # whole swap gets an explicit one: either it all happens, or the old table stays.
+            conn = db.engine.raw_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN')
+                cursor.execute('ALTER TABLE questions RENAME TO questions_old')
+                cursor.execute(str(CreateTable(Question.__table__).compile(db.engine)))
+                # Blank categories become NULL like on Postgres, and so do categories that
+                # don't exist, which would break the foreign key
+                cursor.execute("INSERT INTO questions (id, question, answer, category, difficulty) "
+                               "SELECT id, question, answer, "
+                               "CASE WHEN CAST(NULLIF(TRIM(category), '') AS INTEGER) IN (SELECT id FROM categories) "
+                               "THEN CAST(NULLIF(TRIM(category), '') AS INTEGER) END, difficulty "
+                               "FROM questions_old")
+                cursor.execute('DROP TABLE questions_old')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        inspector = inspect(db.engine)
+
+    # create_all only makes indexes along with new tables, so add any missing ones here
+    existing = {index['name'] for index in inspector.get_indexes('questions')}
+    for index in Question.__table__.indexes:
+        if index.name not in existing:
+            index.create(db.engine)
 
 
 '''
 Question
 '''
+DELETE_PATCH_MAX = 50   # Most deletes in one go that listeners hear about one by one
+
+
 class Question(db.Model):
     __tablename__ = 'questions'
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id', name='category', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
+    # Category pages go through questions in id order, and quizzes pick by category (and
+    # difficulty), so both of those are served from an index instead of a table scan
+    __table_args__ = (
+        Index('questions_category_id', 'category', 'id'),
+        Index('questions_category_difficulty', 'category', 'difficulty'),
+    )
+
     def __init__(self, question, answer, category, difficulty):
         self.question = question
         self.answer = answer
@@ -42,23 +210,203 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        QuestionCount.adjust([ALL_CATEGORIES, self.category], 1)
+        QuestionChange.log(self)
         db.session.commit()
+        questions_changed('insert', self)
 
     def update(self):
+        # If the category changed, move the question between the category counters
+        history = inspect(self).attrs.category.history
+        if history.has_changes():
+            QuestionCount.adjust(history.deleted, -1)
+            QuestionCount.adjust(history.added, 1)
+        QuestionChange.log(self)
         db.session.commit()
+        questions_changed('reset')
 
     def delete(self):
+        QuestionCount.adjust([ALL_CATEGORIES, self.category], -1)
+        QuestionChange.log(self)
         db.session.delete(self)
         db.session.commit()
+        questions_changed('delete', self)
 
     def format(self):
-        return {
-            'id': self.id,
-            'question': self.question,
-            'answer': self.answer,
-            'category': self.category,
-            'difficulty': self.difficulty
-        }
+        return format_question(self)
+
+    @staticmethod
+    def delete_ids(ids):
+        '''Deletes the questions with these ids, all in one transaction, without loading them
+        first.  Returns the (id, category, difficulty) rows of the ones that existed.'''
+        table = Question.__table__
+        delete = table.delete().where(table.c.id.in_(ids))
+        columns = (table.c.id, table.c.category, table.c.difficulty)
+
+        if db.engine.dialect.name == 'postgresql':
+            # A single statement that deletes and tells us what it deleted
+            deleted = db.session.execute(delete.returning(*columns)).fetchall()
+        else:
+            # SQLite has no RETURNING (in this SQLAlchemy), so look them up first in the same
+            # transaction.  SQLite fails the DELETE (rather than deleting less) if another
+            # connection wrote in between.
+            deleted = db.session.execute(select(columns).where(table.c.id.in_(ids))).fetchall()
+            db.session.execute(delete)
+
+        # One UPDATE per different number deleted from a category, so deleting a single
+        # question only needs the one (for its category and "all" together)
+        counts = Counter(row.category for row in deleted)
+        counts[ALL_CATEGORIES] += len(deleted)
+        changes = {}
+        for category, num in counts.items():
+            changes.setdefault(num, []).append(category)
+        for num, categories in changes.items():
+            QuestionCount.adjust(categories, -num)
+        QuestionChange.log(*deleted)
+        db.session.commit()
+
+        # Patching the in-memory lists one question at a time is cheaper than reloading
+        # them, until it's lots of questions
+        if len(deleted) > DELETE_PATCH_MAX:
+            questions_changed('reset')
+        else:
+            for row in deleted:
+                questions_changed('delete', row)
+        return deleted
+
+
+'''
+format_question(row)
+    the API's JSON for a question, from a Question or from a row of QUESTION_COLUMNS.
+    Read endpoints that return lots of questions select just those columns, which skips
+    building (and tracking) a full ORM object for every row.
+'''
+QUESTION_COLUMNS = (Question.id, Question.question, Question.answer, Question.category, Question.difficulty)
+
+
+def format_question(row):
+    return {
+        'id': row.id,
+        'question': row.question,
+        'answer': row.answer,
+        # Stored as an integer now, but the API has always sent it as a string
+        'category': str(row.category) if row.category is not None else None,
+        'difficulty': row.difficulty
+    }
+
+
+'''
+QuestionCount
+    how many questions each category has (category 0 counts all questions), kept up to date
+    by Question.insert()/update()/delete() in the same transaction as the change itself,
+    so totals are a primary key lookup instead of a COUNT over the questions table
+'''
+ALL_CATEGORIES = 0
+
+
+class QuestionCount(db.Model):
+    __tablename__ = 'question_counts'
+
+    category = Column(Integer, primary_key=True, autoincrement=False)
+    num_questions = Column(Integer, nullable=False, default=0)
+
+    @staticmethod
+    def adjust(categories, change):
+        '''Adds change to the counters of categories.  Doesn't commit.'''
+        categories = {int(category) for category in categories if category is not None}
+        if not categories:
+            return
+
+        # An atomic UPDATE (rather than read, add, write) so concurrent requests can't
+        # lose each other's changes
+        table = QuestionCount.__table__
+        result = db.session.execute(table.update()
+                                    .where(table.c.category.in_(categories))
+                                    .values(num_questions=table.c.num_questions + change))
+
+        if result.rowcount < len(categories):
+            # A category without a counter yet, so count everything from scratch
+            db.session.flush()
+            QuestionCount.rebuild()
+
+    @staticmethod
+    def rebuild():
+        '''Recounts every category from the questions table.  Doesn't commit.'''
+        counts = db.session.query(Question.category, func.count(Question.id)) \
+            .group_by(Question.category).all()
+
+        db.session.query(QuestionCount).delete()
+        rows = [{'category': int(category), 'num_questions': num}
+                for category, num in counts if category is not None]
+        rows.append({'category': ALL_CATEGORIES, 'num_questions': sum(num for category, num in counts)})
+
+        # Categories with no questions still get a counter, of zero
+        counted = {row['category'] for row in rows}
+        rows.extend({'category': cat_id, 'num_questions': 0}
+                    for cat_id, in db.session.query(Category.id) if cat_id not in counted)
+        db.session.execute(QuestionCount.__table__.insert(), rows)
+
+    @staticmethod
+    def get(category=ALL_CATEGORIES):
+        '''Returns how many questions the category has'''
+        # Just the column, so we never get back a stale copy of the row from the session
+        num = db.session.query(QuestionCount.num_questions).filter_by(category=category).scalar()
+        return num if num is not None else 0
+
+    @staticmethod
+    def all():
+        '''Returns a {category id: question count} map, not including the total'''
+        rows = db.session.query(QuestionCount.category, QuestionCount.num_questions) \
+            .filter(QuestionCount.category != ALL_CATEGORIES)
+        return {category: num for category, num in rows}
+
+
+'''
+QuestionChange
+    a feed of which questions have changed, for the question catalogues of every worker to
+    catch up from (see catalogue.py).  Each change gets a new version number and the id of
+    the question that changed, or NULL if it was too much to list one by one, meaning
+    "reload everything".  Only written while CATALOGUE_ENABLED is on, and only about the
+    last CHANGES_KEPT are kept.
+'''
+CHANGES_KEPT = 10000
+PRUNE_CHANCE = 0.01     # Chance each change has of clearing out the old ones
+
+
+class QuestionChange(db.Model):
+    __tablename__ = 'question_changes'
+
+    version = Column(Integer, primary_key=True)
+    question_id = Column(Integer)   # Not a foreign key, since deleted questions are in here too
+
+    @staticmethod
+    def log(*questions):
+        '''Records that these questions (anything with an id) changed.  Doesn't commit.'''
+        if questions and QuestionChange.enabled():
+            # A new question has no id until it's flushed
+            db.session.flush()
+            QuestionChange._write([{'question_id': question.id} for question in questions])
+
+    @staticmethod
+    def log_everything():
+        '''Records that too many questions changed to list.  Doesn't commit.'''
+        if QuestionChange.enabled():
+            QuestionChange._write([{'question_id': None}])
+
+    @staticmethod
+    def enabled():
+        # The app in context, or else the one setup_db bound last (the one db.session uses)
+        return db.get_app().config.get('CATALOGUE_ENABLED', False)
+
+    @staticmethod
+    def _write(rows):
+        table = QuestionChange.__table__
+        db.session.execute(table.insert(), rows)
+
+        # Every now and then rather than every time, which would be a second statement per change
+        if random.random() < PRUNE_CHANCE:
+            newest = select([func.max(table.c.version)]).as_scalar()
+            db.session.execute(table.delete().where(table.c.version <= newest - CHANGES_KEPT))
 
 
 '''
@@ -73,6 +421,26 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.flush()      # Assigns the id for the counter
+        db.session.add(QuestionCount(category=self.id, num_questions=0))
+        db.session.commit()
+        categories_changed('insert', self)
+
+    def update(self):
+        db.session.commit()
+        categories_changed('update', self)
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.flush()
+        # The database sets the category of its questions to NULL, so they need recounting
+        QuestionCount.rebuild()
+        QuestionChange.log_everything()
+        db.session.commit()
+        categories_changed('delete', self)
+
     def format(self):
         return {
             'id': self.id,
@@ -0,0 +1,86 @@
+import bisect
+
+from sqlalchemy import func
+
+from models import db, Question, QUESTION_COLUMNS, format_question
+
+QUESTIONS_PER_PAGE = 10
+MAX_ID = 2 ** 31 - 1    # Ids are a 32 bit INTEGER column, so no row is past this
+
+'''
+paginate(request, query, id_column, total)
+    pushes the pagination of a query of Questions into SQL, returning (formatted_rows,
+    total).  Pass in total if it's already known, otherwise it's counted with a COUNT query.
+'''
+
+
+def paginate(request, query, id_column, total=None, per_page=QUESTIONS_PER_PAGE):
+    # The total is its own COUNT query rather than len() on the full list, so we never
+    # have to pull every row back just to know how many pages there are
+    if total is None:
+        total = query.with_entities(func.count(id_column)).order_by(None).scalar()
+
+    window = page_window(request.args, per_page)
+    if window is None:
+        return [], total
+    after_id, offset = window
+
+    # LIMIT/OFFSET without an ORDER BY isn't guaranteed to be stable between queries,
+    # so always order by id (the same order the keyset mode walks in)
+    selection = query.order_by(id_column)
+    if after_id is not None:
+        selection = selection.filter(id_column > after_id)
+    else:
+        selection = selection.offset(offset)
+
+    # Only the columns the JSON needs, as plain rows rather than ORM objects
+    rows = selection.with_entities(*QUESTION_COLUMNS).limit(per_page).all()
+    return [format_question(row) for row in rows], total
+
+
+'''
+paginate_ids(request, ids)
+    the same as paginate, but for a sorted array of question ids (from the question
+    catalogue), so the page is found in memory and only its rows are loaded, by primary key
+'''
+
+
+def paginate_ids(request, ids, per_page=QUESTIONS_PER_PAGE):
+    window = page_window(request.args, per_page)
+    if window is None:
+        return [], len(ids)
+    after_id, offset = window
+
+    start = bisect.bisect_right(ids, after_id) if after_id is not None else offset
+    page_ids = ids[start:start + per_page].tolist()
+    if len(page_ids) == 0:
+        return [], len(ids)
+
+    rows = db.session.query(*QUESTION_COLUMNS).filter(Question.id.in_(page_ids))
+    found = {row.id: format_question(row) for row in rows}
+    return [found[q_id] for q_id in page_ids if q_id in found], len(ids)
+
+
+'''
+page_window(args, per_page)
+    works out which rows a request's ?page= or ?after_id= asks for, as (after_id, offset)
+    with one of them None, or None if the page can't exist (including ones too far out for
+    the database to even be asked about)
+'''
+
+
+def page_window(args, per_page=QUESTIONS_PER_PAGE):
+    after_id = args.get('after_id', None, type=int)
+    if after_id is not None:
+        # Keyset (cursor) mode: the client passes the last id it saw.  This stays fast
+        # on deep pages because the database can seek straight to the id in the primary
+        # key index, instead of walking and throwing away OFFSET rows.
+        if after_id >= MAX_ID:
+            return None
+        return max(after_id, 0), None   # Every id is above 0 anyway
+
+    page = args.get('page', 1, type=int)    # 1 is the default if not given
+    if page < 1 or (page - 1) * per_page > MAX_ID:
+        # There's no page zero (or below), so treat it like a page past the end
+        return None
+    return None, (page - 1) * per_page
@@ -0,0 +1,343 @@
+import bisect
+import hashlib
+import random
+import time
+from array import array
+
+from catalogue import current_catalogue
+from db_replicas import on_primary, reading_replica
+from models import db, format_question, Question, QUESTION_COLUMNS, on_questions_changed, ALL_CATEGORIES
+
+
+def category_filter(category, difficulty=None):
+    '''Returns the WHERE clauses for the questions in a category (none for all categories),
+    and optionally of one difficulty'''
+    clauses = () if category == ALL_CATEGORIES else (Question.category == category,)
+    if difficulty is not None:
+        clauses += (Question.difficulty == difficulty,)
+    return clauses
+
+
+'''
+Quiz difficulty
+
+A quiz request can ask for a "difficulty", which is either a number (only that difficulty),
+or {"min": 1, "max": 5, "ramp": 10}.  Without ramp, questions are picked evenly from the
+whole min-max range.  With ramp, the difficulty climbs from min on the first question to
+max by question number ramp, and stays there.
+'''
+DIFFICULTIES = range(1, 6)
+
+ROUND_SIZE = 5          # Questions in a round from POST /api/quizzes/round, unless it asks for more
+MAX_ROUND_SIZE = 50     # Most questions one round request can ask for
+
+
+def parse_level(value):
+    '''Returns one of the DIFFICULTIES, given as a number or a string of digits (form fields
+    and CSV cells are text).  Raises ValueError for anything else, like 2.7, true or 9.'''
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool) or value not in DIFFICULTIES:
+        raise ValueError(f'Bad difficulty: {value}')
+    return value
+
+
+def parse_difficulty(value):
+    '''Returns (min, max, ramp or None), or None if value is None.  Raises ValueError (or
+    TypeError) if it isn't valid.'''
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        low = parse_level(value.get('min', DIFFICULTIES[0]))
+        high = parse_level(value.get('max', DIFFICULTIES[-1]))
+        ramp = int(value['ramp']) if value.get('ramp') is not None else None
+    else:
+        low = high = parse_level(value)
+        ramp = None
+
+    if low > high or (ramp is not None and ramp < 1):
+        raise ValueError(f'Bad difficulty: {value}')
+    return low, high, ramp
+
+
+def parse_previous_questions(value):
+    '''Returns the list of question ids asked so far.  Raises ValueError if it isn't a list
+    of ids.'''
+    if not isinstance(value, list) or not all(isinstance(q_id, int) and not isinstance(q_id, bool)
+                                              for q_id in value):
+        raise ValueError(f'Bad previous_questions: {value}')
+    return value
+
+
+def difficulty_groups(difficulty, turn):
+    '''The difficulties to pick the next question from, as a list of groups to try in
+    order until one has a question left.  A difficulty of None means any difficulty.'''
+    if difficulty is None:
+        return [[None]]
+    low, high, ramp = difficulty
+    if ramp is None:
+        return [list(range(low, high + 1))]
+
+    # Aim for one difficulty, and if that has run out, the ones either side of it, and so on
+    progress = min(turn / (ramp - 1), 1) if ramp > 1 else 1
+    target = low + round((high - low) * progress)
+    groups = [[target]]
+    for distance in range(1, high - low + 1):
+        group = [d for d in (target - distance, target + distance) if low <= d <= high]
+        if group:
+            groups.append(group)
+    return groups
+
+
+'''
+Seeded quizzes
+
+A quiz request with a "seed" (and optionally "turn", which defaults to the length of
+previous_questions) gets the question at that turn of a shuffle of the category that only
+depends on the seed.  So everyone playing with the same seed gets the same questions in the
+same order, from any worker, without the server remembering anything or looking through
+previous_questions.  (As long as the category's questions don't change in the meantime.)
+
+The shuffle is never actually made.  shuffled_index maps a turn straight to a position in
+the category's sorted ids with a keyed Feistel network, which is a bijection on numbers of
+an even number of bits.  Positions past the end of the ids are fed back in again ("cycle
+walking") until they land inside, which keeps it a bijection on range(size).
+'''
+FEISTEL_ROUNDS = 4
+
+
+def parse_seed(request_data, difficulty):
+    '''Returns (seed, turn) for a seeded quiz request, or None if it isn't seeded.  Raises
+    ValueError if it's not valid, including a difficulty ramp, which depends on which
+    questions were asked so can't be seeded.'''
+    seed = request_data.get('seed')
+    if seed is None:
+        return None
+    # (bool is an int to isinstance, but true isn't a seed)
+    if (not isinstance(seed, (str, int)) or isinstance(seed, bool)
+            or (difficulty is not None and difficulty[2] is not None)):
+        raise ValueError(f'Bad seed: {seed}')
+    turn = int(request_data.get('turn', len(request_data.get('previous_questions', []))))
+    if turn < 0:
+        raise ValueError(f'Bad turn: {turn}')
+    return str(seed), turn
+
+
+def shuffled_index(index, size, key):
+    '''Where index is in a shuffle of range(size) keyed by key (up to 64 bytes)'''
+    half = max((size - 1).bit_length() + 1, 2) // 2
+    mask = (1 << half) - 1
+    while True:
+        left, right = index >> half, index & mask
+        for round_num in range(FEISTEL_ROUNDS):
+            digest = hashlib.blake2b(right.to_bytes(8, 'little') + bytes([round_num]), key=key, digest_size=8).digest()
+            left, right = right, left ^ (int.from_bytes(digest, 'little') & mask)
+        index = (left << half) | right
+        if index < size:
+            return index
+
+
+'''
+QuestionPool
+    keeps just the question ids of each category (and of each difficulty in a category)
+    in memory, so a quiz turn can pick a random unasked question and then load only that
+    one row.  If the app has a question catalogue (see catalogue.py), the ids come from
+    that instead.
+'''
+
+
+class QuestionPool:
+    # Other worker processes can add or delete questions without our listeners hearing
+    # about it, so the id lists are also reloaded once they get this old (in seconds)
+    MAX_AGE = 60
+
+    # How many random picks to try before giving up and scanning for what's left
+    MAX_ATTEMPTS = 32
+
+    def __init__(self, max_age=MAX_AGE):
+        self.max_age = max_age
+        # (category id, difficulty or None for all of them) -> (time loaded, array of question ids)
+        self._ids = {}
+
+    def cached_ids(self, category, difficulty=None):
+        '''Returns the loaded ids of the category, or None if they need (re)loading'''
+        catalogue = current_catalogue()
+        if catalogue is not None:
+            return catalogue.ids(category, difficulty)
+
+        entry = self._ids.get((category, difficulty))
+        if entry is None or time.monotonic() - entry[0] > self.max_age:
+            return None
+        return entry[1]
+
+    def load(self, category, ids, difficulty=None):
+        # Sorted, so seeded quizzes shuffle the same list in every worker
+        ids = array('q', sorted(ids))
+        self._ids[category, difficulty] = (time.monotonic(), ids)
+        return ids
+
+    def ids(self, category, difficulty=None):
+        ids = self.cached_ids(category, difficulty)
+        if ids is None:
+            query = db.session.query(Question.id).filter(*category_filter(category, difficulty))
+            ids = self.load(category, (row.id for row in query), difficulty)
+        return ids
+
+    def pick_id(self, category, previous_questions, difficulty=None):
+        '''Returns a random id from the category that isn't in previous_questions, or None
+        if they've all been asked.  difficulty is from parse_difficulty.'''
+        picked = self.pick_ids(category, previous_questions, 1, difficulty)
+        return picked[0] if picked else None
+
+    def pick_ids(self, category, previous_questions, count, difficulty=None):
+        '''Returns up to count different random ids from the category that aren't in
+        previous_questions, as if they were picked one turn at a time'''
+        asked = set(previous_questions)
+        picked = []
+        for turn in range(len(previous_questions), len(previous_questions) + count):
+            for group in difficulty_groups(difficulty, turn):
+                q_id = self.pick_from_buckets([self.ids(category, d) for d in group], asked)
+                if q_id is not None:
+                    break
+            if q_id is None:
+                break
+            picked.append(q_id)
+            asked.add(q_id)
+        return picked
+
+    def seeded_ids(self, category, seed, turn, count, difficulty=None):
+        '''Returns the ids for count turns from turn on, of the category shuffled by seed (fewer
+        if it runs out).  Not for difficulty ramps.'''
+        buckets = [self.ids(category, d) for d in difficulty_groups(difficulty, turn)[0]]
+        size = sum(len(ids) for ids in buckets)
+        key = hashlib.blake2b(f'{category}:{seed}'.encode('utf-8'), digest_size=32).digest()
+
+        picked = []
+        for k in range(turn, min(turn + count, size)):
+            index = shuffled_index(k, size, key)
+            for ids in buckets:
+                if index < len(ids):
+                    break
+                index -= len(ids)
+            picked.append(ids[index])
+        return picked
+
+    def choose_ids(self, category, previous_questions, count, difficulty=None, seed=None):
+        '''pick_ids, or seeded_ids if seed is a (seed, turn) from parse_seed'''
+        if seed is not None:
+            return self.seeded_ids(category, seed[0], seed[1], count, difficulty)
+        return self.pick_ids(category, previous_questions, count, difficulty)
+
+    def pick_from_buckets(self, buckets, asked):
+        '''Picks evenly from every id in the buckets that isn't in the set asked'''
+        total = sum(len(ids) for ids in buckets)
+
+        # Rejection sampling: while most of the ids are still unasked, a random pick is
+        # almost always good, so each turn is O(1) no matter how big the category is
+        if len(asked) < total // 2:
+            for _ in range(self.MAX_ATTEMPTS):
+                index = random.randrange(total)
+                for ids in buckets:
+                    if index < len(ids):
+                        break
+                    index -= len(ids)
+                if ids[index] not in asked:
+                    return ids[index]
+
+        # Near the end of a quiz (or after a run of bad luck) just scan the ids for the
+        # ones left.  That's still only a set lookup per id, and never touches the rows.
+        remaining = [q_id for ids in buckets for q_id in ids if q_id not in asked]
+        if len(remaining) == 0:
+            return None
+        return random.choice(remaining)
+
+    def pick(self, category, previous_questions, difficulty=None, seed=None):
+        '''Returns a random unasked Question from the category, or None if there are none left'''
+        while True:
+            ids = self.choose_ids(category, previous_questions, 1, difficulty, seed)
+            if len(ids) == 0:
+                return None
+
+            question = Question.query.get(ids[0])
+            if question is None and reading_replica():
+                # The replica may just be behind, only the primary can say it's gone
+                with on_primary():
+                    question = Question.query.get(ids[0])
+            if question is not None:
+                return question
+
+            # Deleted since we loaded the ids (probably by another worker), so reload and retry
+            self.forget(category, ids)
+
+    def pick_round(self, category, previous_questions, count, difficulty=None, seed=None):
+        '''Returns up to count different random unasked questions from the category, formatted,
+        all loaded in one query'''
+        while True:
+            ids = self.choose_ids(category, previous_questions, count, difficulty, seed)
+            if len(ids) == 0:
+                return []
+
+            rows = db.session.query(*QUESTION_COLUMNS).filter(Question.id.in_(ids))
+            found = {row.id: format_question(row) for row in rows}
+            if len(found) < len(ids) and reading_replica():
+                # Same as pick, the primary may have the ones the replica hasn't caught up on
+                with on_primary():
+                    missing = [q_id for q_id in ids if q_id not in found]
+                    rows = db.session.query(*QUESTION_COLUMNS).filter(Question.id.in_(missing))
+                    found.update((row.id, format_question(row)) for row in rows)
+            if len(found) == len(ids):
+                return [found[q_id] for q_id in ids]
+
+            # Same as pick, some were deleted since we loaded the ids
+            self.forget(category, [q_id for q_id in ids if q_id not in found])
+
+    def deck(self, category):
+        '''Returns every question id in the category, shuffled, for a quiz session to deal from'''
+        deck = list(self.ids(category))
+        random.shuffle(deck)
+        return deck
+
+    def forget(self, category, missing_ids):
+        '''For ids that turned out to have been deleted: the category's ids are reloaded, or
+        with a catalogue, just those ids dropped from it.  Only for ids the primary doesn't
+        have, the catalogue never gets back an id it drops.'''
+        catalogue = current_catalogue()
+        if catalogue is None:
+            self.invalidate(category)
+            return
+        for q_id in missing_ids:
+            catalogue.discard(q_id)
+
+    def invalidate(self, category=None):
+        if category is None:
+            self._ids.clear()
+        else:
+            for key in [key for key in self._ids if key[0] == category]:
+                del self._ids[key]
+
+    def question_changed(self, action, question):
+        if action == 'reset':
+            self.invalidate()
+            return
+
+        try:
+            categories = (ALL_CATEGORIES, int(question.category))
+        except (TypeError, ValueError):
+            # Not in a category (e.g. it was set NULL), so it's only in the "all" list
+            categories = (ALL_CATEGORIES,)
+
+        # Patch the loaded lists in place rather than reloading the whole category
+        for category in categories:
+            for difficulty in (None, question.difficulty):
+                entry = self._ids.get((category, difficulty))
+                if entry is None:
+                    continue
+                ids = entry[1]
+                if action == 'insert':
+                    bisect.insort(ids, question.id)
+                elif question.id in ids:
+                    ids.remove(question.id)
+
+
+question_pool = QuestionPool()
+on_questions_changed(question_pool.question_changed)
@@ -0,0 +1,232 @@
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from flask import g, request
+from werkzeug.exceptions import TooManyRequests
+
+MAX_CLIENTS = 10000     # Clients whose token buckets are kept (least recently seen go first)
+TRUSTED_PROXIES = 1     # Proxies in front that add to RATE_LIMIT_CLIENT_HEADER
+
+# Per-client budgets, per route group: requests a minute, and how many can come at once
+# (the bucket size).  Then the most of them each worker serves at the same time.
+SEARCH_PER_MINUTE, SEARCH_BURST, SEARCH_CONCURRENCY = 60, 10, 4
+QUIZ_PER_MINUTE, QUIZ_BURST, QUIZ_CONCURRENCY = 300, 30, 8
+
+'''
+Rate limiting and admission control
+
+With RATE_LIMIT_ENABLED on, searches and quiz turns are admitted in two steps before they
+get anywhere near the database:
+    - each client (by IP address, or the RATE_LIMIT_CLIENT_HEADER set by the
+      RATE_LIMIT_TRUSTED_PROXIES proxies in front) has a token bucket per route group, refilled at RATE_LIMIT_<GROUP>_PER_MINUTE and
+      holding up to RATE_LIMIT_<GROUP>_BURST, and every request takes a token
+    - each worker serves at most RATE_LIMIT_<GROUP>_CONCURRENCY requests of the group at
+      once, so a flood of them can't take every connection in the pool
+A request that fails either gets a 429, in the same JSON as the other errors, with a
+Retry-After header saying when to try again.  (Rather than queueing, as the requests
+waiting would be holding a worker thread each.)  Setting a budget to 0 turns that check
+off for the group.
+
+The buckets and the counts are kept per worker process, so with 4 workers a client can get
+up to 4 times its budget.  That's still a bound, which is the point.
+'''
+
+
+class TokenBucket:
+
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self):
+        '''Takes a token, returning 0, or else the seconds until there'll be one'''
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimited(TooManyRequests):
+    '''Raised for a request that wasn't admitted, with why ('rate' or 'busy')'''
+
+    def __init__(self, reason, retry_after):
+        super().__init__(retry_after=retry_after)
+        self.reason = reason
+
+
+class Budget:
+
+    def __init__(self, per_minute, burst, concurrency):
+        self.per_minute = per_minute
+        self.burst = max(burst, 1)
+        self.concurrency = concurrency
+
+
+class RateLimiter:
+
+    def __init__(self, budgets, client_header='', max_clients=MAX_CLIENTS, trusted_proxies=TRUSTED_PROXIES):
+        self.budgets = budgets          # route group -> Budget
+        self.client_header = client_header
+        self.trusted_proxies = max(trusted_proxies, 1)
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()   # (client, group) -> TokenBucket
+        self.in_flight = Counter()      # group -> requests being served right now
+        self.served = Counter()         # group -> requests admitted
+        self.rejected = Counter()       # (group, reason) -> requests turned away
+
+    def client(self, remote_addr, headers):
+        '''Who a request is from, given its remote address and its headers'''
+        if self.client_header:
+            # X-Forwarded-For style, where each proxy adds the address it got the request from.
+            # Anything left of what our own proxies added came from the client, who could have
+            # put anything there, so count from the right.
+            forwarded = [address.strip() for address in headers.get(self.client_header, '').split(',')]
+            if len(forwarded) >= self.trusted_proxies and forwarded[-self.trusted_proxies]:
+                return forwarded[-self.trusted_proxies]
+        return remote_addr or 'unknown'
+
+    def _bucket(self, client, group, budget):
+        key = (client, group)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(budget.per_minute, budget.burst)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _reject(self, group, reason, wait):
+        self.rejected[group, reason] += 1
+        # Retry-After is in whole seconds
+        raise RateLimited(reason, max(1, math.ceil(wait)))
+
+    def admit(self, client, group):
+        '''Lets a request of the group from the client in, or raises RateLimited.  Once
+        admitted, release(group) has to be called when it's done.'''
+        budget = self.budgets.get(group)
+        if budget is None:
+            return
+        with self._lock:
+            # The cheaper check first, and a request turned away for being busy doesn't
+            # use up the client's tokens
+            if budget.concurrency and self.in_flight[group] >= budget.concurrency:
+                self._reject(group, 'busy', 1)
+            if budget.per_minute:
+                wait = self._bucket(client, group, budget).take()
+                if wait:
+                    self._reject(group, 'rate', wait)
+            self.in_flight[group] += 1
+            self.served[group] += 1
+
+    def release(self, group):
+        if group in self.budgets:
+            with self._lock:
+                self.in_flight[group] -= 1
+
+    @contextmanager
+    def admitted(self, client, group):
+        self.admit(client, group)
+        try:
+            yield
+        finally:
+            self.release(group)
+
+    def status(self):
+        with self._lock:
+            return {group: {
+                'served': self.served[group],
+                'rejected_rate': self.rejected[group, 'rate'],
+                'rejected_busy': self.rejected[group, 'busy'],
+                'in_flight': self.in_flight[group],
+                'per_minute': budget.per_minute,
+                'burst': budget.burst,
+                'concurrency': budget.concurrency
+            } for group, budget in self.budgets.items()}
+
+    def render(self):
+        '''The counts in Prometheus' text format, for /metrics'''
+        status = self.status()
+        lines = ['# HELP trivia_rate_limit_served_total Requests admitted by the rate limiter',
+                 '# TYPE trivia_rate_limit_served_total counter']
+        lines += [f'trivia_rate_limit_served_total{{group="{group}"}} {s["served"]}' for group, s in status.items()]
+        lines += ['# HELP trivia_rate_limit_rejected_total Requests turned away with a 429',
+                  '# TYPE trivia_rate_limit_rejected_total counter']
+        for group, s in status.items():
+            for reason in ('rate', 'busy'):
+                lines.append(f'trivia_rate_limit_rejected_total{{group="{group}",reason="{reason}"}} '
+                             f'{s["rejected_" + reason]}')
+        lines += ['# HELP trivia_rate_limit_in_flight Requests being served right now',
+                  '# TYPE trivia_rate_limit_in_flight gauge']
+        lines += [f'trivia_rate_limit_in_flight{{group="{group}"}} {s["in_flight"]}' for group, s in status.items()]
+        return lines
+
+
+# Which route group each endpoint of the Flask app is in.  POST /api/questions is only a
+# search when it has a searchTerm, adding questions isn't limited.
+QUIZ_ENDPOINTS = ('play_quiz', 'play_quiz_round', 'create_quiz_session', 'next_quiz_question')
+
+
+def route_group(endpoint, json_body):
+    if endpoint in QUIZ_ENDPOINTS:
+        return 'quiz'
+    if endpoint == 'add_question' and isinstance(json_body, dict) and 'searchTerm' in json_body:
+        return 'search'
+    return None
+
+
+'''
+make_rate_limiter(config)
+    returns a RateLimiter with the budgets in the app's config
+'''
+
+
+def make_rate_limiter(config):
+    budgets = {group: Budget(config[f'RATE_LIMIT_{group.upper()}_PER_MINUTE'],
+                             config[f'RATE_LIMIT_{group.upper()}_BURST'],
+                             config[f'RATE_LIMIT_{group.upper()}_CONCURRENCY'])
+               for group in ('search', 'quiz')}
+    return RateLimiter(budgets, config.get('RATE_LIMIT_CLIENT_HEADER', ''),
+                       trusted_proxies=config.get('RATE_LIMIT_TRUSTED_PROXIES', TRUSTED_PROXIES))
+
+
+'''
+setup_rate_limit(app)
+    admits the app's searches and quiz turns through a RateLimiter, if RATE_LIMIT_ENABLED
+    is on.  Returns the RateLimiter, or None when it's turned off.
+'''
+
+
+def setup_rate_limit(app):
+    if not app.config.get('RATE_LIMIT_ENABLED', False):
+        return None
+    limiter = make_rate_limiter(app.config)
+
+    @app.before_request
+    def admit_request():
+        group = route_group(request.endpoint, request.get_json(silent=True))
+        if group is not None:
+            limiter.admit(limiter.client(request.remote_addr, request.headers), group)
+            g.rate_limit_group = group
+
+    @app.teardown_request
+    def release_request(exc):
+        group = g.pop('rate_limit_group', None)
+        if group is not None:
+            limiter.release(group)
+
+    metrics = app.extensions.get('trivia_metrics')
+    if metrics is not None:
+        metrics.collectors.append(limiter.render)
+
+    app.extensions['rate_limiter'] = limiter
+    return limiter
@@ -0,0 +1,264 @@
+import hashlib
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import current_app, request
+
+from models import on_questions_changed, on_categories_changed
+
+MAX_ENTRIES = 1000      # Most responses a backend keeps before evicting
+MAX_AGE = 60            # Seconds a backend trusts an entry (see MemoryBackend and FileBackend)
+PRUNE_EVERY = 100       # Entries the file backend stores between checks of how many it has
+
+# The query parameters the cached routes look at, and so the only ones in the cache key.
+# Anything else would only make more copies of the same page.
+KEY_PARAMS = ('page', 'after_id', 'fields', 'with_categories')
+
+'''
+Response cache
+
+Keeps whole GET responses (the JSON body) for the question listing routes, keyed by the
+path and query string, and tagged with the data version they were made from.  Any change
+to the questions or categories bumps the data version, which makes every older entry
+miss.  Cached responses carry an ETag and Last-Modified (when the data last changed), so
+browsers and reverse proxies can revalidate repeat views and get a 304 back.
+
+Backends:
+    MemoryBackend   an LRU in this process.  Other worker processes don't bump our
+                    data version, so entries are also only trusted for MAX_AGE seconds.
+    FileBackend     entries and the data version live in a directory, so every worker
+                    process on the machine shares them and sees each other's changes.
+                    Entries are also only trusted for MAX_AGE seconds, as a page can be
+                    rendered from a read replica that hasn't caught up with a change yet.
+'''
+
+CachedResponse = namedtuple('CachedResponse', 'version changed_at stored_at body mimetype etag')
+
+
+def new_version():
+    # Unique per bump (rather than a counter), so two workers bumping at the same time
+    # can't both land on the same "next" version
+    return f'{time.time_ns():x}{secrets.token_hex(2)}'
+
+
+class MemoryBackend:
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_age=MAX_AGE):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = OrderedDict()   # key -> CachedResponse
+        self._lock = threading.Lock()
+        self._version = (new_version(), time.time())
+
+    def version(self):
+        '''Returns (data version, time it changed)'''
+        return self._version
+
+    def bump(self):
+        self._version = (new_version(), time.time())
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry.stored_at > self.max_age:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class FileBackend:
+
+    def __init__(self, directory, max_entries=MAX_ENTRIES, max_age=MAX_AGE):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._stored = 0
+        os.makedirs(directory, exist_ok=True)
+        self._version_path = os.path.join(directory, 'version')
+        if not os.path.exists(self._version_path):
+            self.bump()
+
+    def _write(self, path, data):
+        # Write to a temporary file and move it into place, so readers in other processes
+        # only ever see a whole file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def version(self):
+        try:
+            with open(self._version_path) as f:
+                version, changed_at = f.read().split()
+            return version, float(changed_at)
+        except (OSError, ValueError):
+            self.bump()
+            return self.version()
+
+    def bump(self):
+        self._write(self._version_path, f'{new_version()} {time.time()}'.encode('utf-8'))
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = json.load(f)
+            entry = CachedResponse(**{**data, 'body': data['body'].encode('utf-8')})
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            return None     # Gone, half written by something else, or not one of ours
+        if time.time() - entry.stored_at > self.max_age:
+            return None     # Overwritten when the page is stored again
+        return entry
+
+    def set(self, key, entry):
+        # Stale entries are simply overwritten the next time their page is asked for.  As
+        # JSON (the bodies are JSON responses) rather than pickled, so whoever else can write
+        # to the directory can't get us to run anything by leaving a file in it.
+        data = {**entry._asdict(), 'body': entry.body.decode('utf-8')}
+        self._write(self._path(key), json.dumps(data).encode('utf-8'))
+        self._stored += 1
+        if self._stored % PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        '''Deletes the expired entries, then the oldest ones past max_entries'''
+        entries = []
+        with os.scandir(self.directory) as it:
+            for dir_entry in it:
+                if len(dir_entry.name) != 40:
+                    continue    # The version file, or one another process is writing
+                try:
+                    entries.append((dir_entry.stat().st_mtime, dir_entry.path))
+                except OSError:
+                    pass    # Deleted by another process
+        entries.sort(reverse=True)
+        expired_before = time.time() - self.max_age
+        for i, (mtime, path) in enumerate(entries):
+            if i >= self.max_entries or mtime < expired_before:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+# Every live cache hears about every change to the data.  Weak references, so caches of
+# apps that have gone away (e.g. between tests) aren't kept alive by the listeners.
+live_caches = weakref.WeakSet()
+
+
+def data_changed(action, item=None):
+    for cache in list(live_caches):
+        cache.backend.bump()
+
+
+on_questions_changed(data_changed)
+on_categories_changed(data_changed)
+
+
+def cache_key(path, args):
+    # The same query parameters in any order are the same page.  Only the first of a
+    # repeated parameter counts, as that's the one request.args.get() returns.
+    params = {}
+    for key, value in args:
+        if key in KEY_PARAMS:
+            params.setdefault(key, value)
+    return path + '?' + urlencode(sorted(params.items()))
+
+
+class ResponseCache:
+
+    def __init__(self, backend, http_max_age=0):
+        self.backend = backend
+        self.http_max_age = http_max_age
+        live_caches.add(self)
+
+    def lookup(self, key):
+        '''Returns (cached response or None, data version, time it changed)'''
+        version, changed_at = self.backend.version()
+        entry = self.backend.get(key)
+        if entry is not None and entry.version != version:
+            entry = None
+        return entry, version, changed_at
+
+    def store(self, key, version, changed_at, body, mimetype):
+        # From the body alone, so every worker gives the same page the same ETag
+        etag = hashlib.sha1(body).hexdigest()[:20]
+        entry = CachedResponse(version, changed_at, time.time(), body, mimetype, etag)
+        self.backend.set(key, entry)
+        return entry
+
+    def cache_control(self):
+        # Shared caches may keep it, but have to check back with us (a cheap 304) once
+        # it's http_max_age seconds old
+        return f'public, max-age={self.http_max_age}' if self.http_max_age else 'public, no-cache'
+
+    def cached(self, view):
+        '''Decorator for a Flask view whose successful responses can be cached'''
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = cache_key(request.path, request.args.items(multi=True))
+            entry, version, changed_at = self.lookup(key)
+            if entry is None:
+                # Errors (abort) raise straight past here, so only good responses get stored
+                response = view(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                entry = self.store(key, version, changed_at, response.get_data(), response.mimetype)
+
+            response = current_app.response_class(entry.body, mimetype=entry.mimetype)
+            response.set_etag(entry.etag)
+            response.last_modified = datetime.fromtimestamp(entry.changed_at, timezone.utc)
+            response.headers['Cache-Control'] = self.cache_control()
+            return response.make_conditional(request)
+        return wrapper
+
+
+class NoResponseCache:
+    '''Stand-in for when RESPONSE_CACHE is off'''
+
+    def cached(self, view):
+        return view
+
+
+'''
+make_response_cache(config)
+    builds the response cache named by the RESPONSE_CACHE setting: 'memory' (the default),
+    'file:///<path to directory>', or 'off'
+'''
+
+
+def make_response_cache(config):
+    setting = config.get('RESPONSE_CACHE', 'memory')
+    http_max_age = config.get('RESPONSE_CACHE_HTTP_MAX_AGE', 0)
+    max_entries = config.get('RESPONSE_CACHE_SIZE', MAX_ENTRIES)
+
+    if setting == 'off':
+        return NoResponseCache()
+    if setting == 'memory':
+        return ResponseCache(MemoryBackend(max_entries=max_entries), http_max_age)
+    if setting.startswith('file:///'):
+        return ResponseCache(FileBackend(setting[len('file://'):], max_entries=max_entries), http_max_age)
+    raise ValueError(f'Unknown RESPONSE_CACHE: {setting}')
@@ -0,0 +1,170 @@
+import time
+from array import array
+
+from flask import current_app
+from sqlalchemy import bindparam, func
+
+from models import db, Question, QUESTION_COLUMNS, format_question, on_questions_changed
+from pagination import QUESTIONS_PER_PAGE, MAX_ID
+
+MAX_RESULTS = 1000      # Most hits a search without a page returns (the best matches)
+
+'''
+Question search
+
+Searching is a case-insensitive substring match on the question text, the same as the
+original ILIKE '%term%' search, but served from an index and ranked by how similar each
+question is to the search term (then by id).
+
+    - On Postgres, setup_db builds a pg_trgm GIN index which the ILIKE query can use
+      instead of a sequential scan, and results are ranked with pg_trgm's similarity()
+    - Everywhere else (e.g. SQLite) a pure-Python trigram index plays the same part
+'''
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    '''Maps every 3 character chunk of the (lowercased) question text to the ids of the
+    questions containing it.  Any question containing the search term has to contain
+    all of the term's trigrams, so intersecting their id lists narrows it down to a few
+    candidates, which are then checked for the actual substring.'''
+
+    # Other worker processes can change questions without our listeners hearing about
+    # it, so the index is rebuilt once it gets this old (in seconds)
+    MAX_AGE = 300
+
+    def __init__(self, max_age=MAX_AGE):
+        self.max_age = max_age
+        self._loaded_at = None
+        self._texts = {}        # question id -> lowercased question text
+        self._sizes = {}        # question id -> how many distinct trigrams its text has
+        self._postings = {}     # trigram -> array of question ids
+
+    def _add(self, q_id, text):
+        text = (text or '').lower()
+        grams = trigrams(text)
+        self._texts[q_id] = text
+        self._sizes[q_id] = len(grams)
+        for gram in grams:
+            self._postings.setdefault(gram, array('q')).append(q_id)
+
+    def stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age
+
+    def load(self, rows):
+        '''(Re)builds the index from (id, question text) rows'''
+        self._texts = {}
+        self._sizes = {}
+        self._postings = {}
+        for q_id, text in rows:
+            self._add(q_id, text)
+        self._loaded_at = time.monotonic()
+
+    def search(self, term):
+        '''Returns the ids of every question containing term, best match first'''
+        if self.stale():
+            self.load(db.session.query(Question.id, Question.question).yield_per(10000))
+        term = term.lower()
+        term_grams = trigrams(term)
+
+        if term_grams:
+            # Start from the rarest trigram so the candidate set is small from the beginning
+            postings = sorted((self._postings.get(gram, ()) for gram in term_grams), key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(posting)
+        else:
+            # Terms under 3 characters have no trigrams to narrow things down
+            candidates = self._texts.keys()
+
+        # Deleted questions are dropped from _texts but left in the postings, so the
+        # lookup here also filters those out
+        hits = [q_id for q_id in candidates if term in self._texts.get(q_id, '')]
+
+        # pg_trgm's similarity() is shared trigrams over all trigrams of the two strings.
+        # Every hit contains all of the term's trigrams, so that works out to
+        # len(term_grams) / (trigrams in the question), and the best matches are just
+        # the questions with the fewest trigrams.
+        hits.sort(key=lambda q_id: (self._sizes[q_id], q_id) if term_grams else q_id)
+        return hits
+
+    def question_changed(self, action, question):
+        if self._loaded_at is None:
+            return
+        if action == 'insert':
+            self._add(question.id, question.question)
+        elif action == 'delete':
+            self._texts.pop(question.id, None)
+            self._sizes.pop(question.id, None)
+        else:
+            self._loaded_at = None  # Rebuild on the next search
+
+
+trigram_index = TrigramIndex()
+on_questions_changed(trigram_index.question_changed)
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_condition(term):
+    # Matches the substring exactly like before (with the LIKE wildcards escaped, so
+    # searching for "%" means a literal percent sign), but the GIN index can serve it
+    return Question.question.ilike(f'%{escape_like(term)}%', escape='\\')
+
+
+def search_ranking(term):
+    return (func.similarity(Question.question, term).desc(), Question.id)
+
+
+def _search_postgres(term, page, per_page, max_results):
+    query = Question.query.filter(search_condition(term))
+    total = query.with_entities(func.count(Question.id)).scalar()
+
+    query = query.with_entities(*QUESTION_COLUMNS).order_by(*search_ranking(term))
+    if page is not None:
+        query = query.offset((page - 1) * per_page).limit(per_page)
+    elif max_results:
+        query = query.limit(max_results)
+    return [format_question(row) for row in query.all()], total
+
+
+def _search_python(term, page, per_page, max_results):
+    hits = trigram_index.search(term)
+    total = len(hits)
+    if page is not None:
+        hits = hits[(page - 1) * per_page:page * per_page]
+    elif max_results:
+        hits = hits[:max_results]
+
+    # Load just the questions being returned, in chunks to stay under SQLite's limit on
+    # the number of parameters in a query.  An "expanding" parameter is a lot cheaper to
+    # build than a literal IN list of hundreds of ids.
+    query = db.session.query(*QUESTION_COLUMNS).filter(Question.id.in_(bindparam('ids', expanding=True)))
+    questions = {}
+    for start in range(0, len(hits), 900):
+        for row in query.params(ids=hits[start:start + 900]):
+            questions[row.id] = row
+    return [format_question(questions[q_id]) for q_id in hits if q_id in questions], total
+
+
+'''
+search_questions(term, page)
+    returns (formatted questions, total number of hits) for a search term.  page is
+    1-based, or None for every hit at once, up to SEARCH_MAX_RESULTS of them.
+'''
+
+
+def search_questions(term, page=None, per_page=QUESTIONS_PER_PAGE):
+    if page is not None and (page < 1 or (page - 1) * per_page > MAX_ID):
+        return [], 0    # A 404, like a page past the end
+    max_results = current_app.config.get('SEARCH_MAX_RESULTS', MAX_RESULTS)
+    if current_app.config.get('SEARCH_BACKEND') == 'pg_trgm':
+        return _search_postgres(term, page, per_page, max_results)
+    return _search_python(term, page, per_page, max_results)
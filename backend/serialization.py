@@ -0,0 +1,101 @@
+import json
+
+import flask
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+'''
+JSON encoding
+
+Responses are encoded by Flask's json (the standard library json module), without the
+whitespace, unless the JSON_BACKEND setting is 'orjson', which is several times faster on
+big lists of questions.
+orjson is optional (pip install orjson); without it the setting falls back to 'stdlib'.
+Either way keys are sorted like Flask does by default (although orjson sorts integer keys
+as strings, so category 10 would come before 2).
+'''
+JSON_BACKENDS = ('stdlib', 'orjson')
+
+# What ?fields= can pick out of each question in a listing
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+
+def setup_json(app):
+    backend = app.config.get('JSON_BACKEND', 'stdlib')
+    if backend not in JSON_BACKENDS:
+        raise ValueError(f'Unknown JSON_BACKEND: {backend}')
+    if backend == 'orjson' and orjson is None:
+        app.logger.warning('JSON_BACKEND is orjson, but orjson is not installed, so using stdlib')
+        app.config['JSON_BACKEND'] = 'stdlib'
+
+
+'''
+dumps(body, backend, sort_keys)
+    encodes body as JSON bytes
+'''
+
+
+def dumps(body, backend='stdlib', sort_keys=True):
+    if backend == 'orjson':
+        # Category maps have integer keys, which orjson only takes with OPT_NON_STR_KEYS
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(body, option=option)
+    return json.dumps(body, sort_keys=sort_keys, separators=(',', ':')).encode('utf-8')
+
+
+'''
+jsonify(body)
+    drop-in for flask.jsonify(body) that uses the app's JSON_BACKEND
+'''
+
+
+def jsonify(body):
+    config = current_app.config
+    if config.get('JSON_BACKEND') == 'orjson':
+        data = dumps(body, 'orjson', config['JSON_SORT_KEYS'])
+    elif config['JSONIFY_PRETTYPRINT_REGULAR']:
+        return flask.jsonify(body)
+    else:
+        # flask.jsonify pretty prints whenever the app's in debug mode (like the README runs
+        # it), which makes lists of questions about 40% bigger, so always go compact
+        # unless pretty printing was asked for
+        data = flask.json.dumps(body, separators=(',', ':')).encode('utf-8')
+    return current_app.response_class(data + b'\n', mimetype=config['JSONIFY_MIMETYPE'])
+
+
+'''
+listing_options(args)
+    reads the ?fields= and ?with_categories= options of a question listing from its query
+    args, as (fields, with_categories).  fields is None for every field, and anything that
+    isn't in QUESTION_FIELDS raises a ValueError.
+'''
+
+
+def listing_options(args):
+    fields = args.get('fields')
+    if fields is not None:
+        fields = tuple(dict.fromkeys(name.strip() for name in fields.split(',') if name.strip()))
+        if not fields or any(name not in QUESTION_FIELDS for name in fields):
+            raise ValueError(f"fields must be some of {', '.join(QUESTION_FIELDS)}")
+    with_categories = args.get('with_categories', '1').strip().lower() not in ('0', 'false', 'no')
+    return fields, with_categories
+
+
+'''
+compact_listing(body, fields, with_categories)
+    cuts a question listing's body down to the fields asked for, and drops the categories
+    map if the client didn't want it (they can keep the one they have until
+    categories_version changes)
+'''
+
+
+def compact_listing(body, fields=None, with_categories=True):
+    if fields is not None:
+        body['questions'] = [{name: q[name] for name in fields} for q in body['questions']]
+    if not with_categories:
+        body.pop('categories', None)
+    return body
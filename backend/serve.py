@@ -0,0 +1,169 @@
+'''
+Production launcher: serves the Flask app from several worker processes, forked from a
+parent that has already done the slow part of starting up.
+
+    python serve.py --workers 4 --bind 0.0.0.0:5000
+
+It's gunicorn underneath (in requirements.txt), with its workers forked from an app the
+parent has already created and warmed up: the modules imported, the database schema
+checked, the categories, quiz id lists and search index loaded (and the question
+catalogue, if CATALOGUE_ENABLED is on).  The workers start out sharing all of that
+memory with the parent, copy-on-write, and are ready to serve the moment they're forked.
+The parent closes its database connections before forking, so no worker ever shares a
+connection with another process, and each worker starts out with its own empty
+connection pool.
+
+kill -HUP <parent pid> reloads gracefully: the parent creates and warms a fresh app (with
+the TRIVIA_* settings as they are now), forks new workers from it, and the old workers
+finish the requests they're serving before they exit.
+
+Every startup logs how long it took: the parent's load of the app (the cold start, which
+every worker would pay for itself without preloading) and each worker's, from being forked
+to ready.  --no-preload has each worker load the app itself, to compare.
+'''
+import argparse
+import gc
+import logging
+import time
+
+from gunicorn.app.base import BaseApplication
+
+logger = logging.getLogger('gunicorn.error')
+
+DEFAULT_BIND = '127.0.0.1:5000'
+DEFAULT_WORKERS = 4
+DEFAULT_THREADS = 4     # Requests each worker serves at the same time
+
+
+'''
+warm(app)
+    loads the in-memory caches that requests would otherwise load on first use
+'''
+
+
+def warm(app):
+    from category_cache import category_cache
+    from models import db, Question, ALL_CATEGORIES
+    from quiz import question_pool
+    from search import trigram_index
+
+    with app.app_context():
+        categories = category_cache.all()
+        for category in [ALL_CATEGORIES, *categories]:
+            question_pool.ids(category)
+        if app.config['SEARCH_BACKEND'] == 'python' and trigram_index.stale():
+            trigram_index.load(db.session.query(Question.id, Question.question).yield_per(10000))
+        db.session.remove()
+
+
+def app_engines(app):
+    from models import db
+
+    replicas = app.extensions.get('db_replicas')
+    return [db.get_engine(app)] + (replicas.engines if replicas is not None else [])
+
+
+class TriviaServer(BaseApplication):
+
+    def __init__(self, options):
+        self.options = options
+        self.app = None
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set('pre_fork', self.pre_fork)
+        self.cfg.set('post_fork', self.post_fork)
+        self.cfg.set('post_worker_init', self.post_worker_init)
+
+    def load(self):
+        # Timed from here, so importing the app (Flask, SQLAlchemy, ...) counts too
+        start = time.monotonic()
+        from app import create_app
+        from db_pool import fork_safe
+        imported = time.monotonic()
+
+        self.app = create_app()
+        if self.app.config['DATABASE_PATH'] in ('sqlite://', 'sqlite:///:memory:'):
+            raise RuntimeError('An in-memory database would be a different, empty one in every worker')
+        created = time.monotonic()
+        warm(self.app)
+        warmed = time.monotonic()
+        logger.info('Loaded the app in %.2fs (imports %.2fs, create_app %.2fs, warming up %.2fs)',
+                    warmed - start, imported - start, created - imported, warmed - created)
+
+        if self.cfg.preload_app:
+            # Nothing the workers inherit can be holding a connection, or two processes
+            # would end up talking over the same socket
+            for engine in app_engines(self.app):
+                fork_safe(engine)
+                engine.dispose()
+            # Everything loaded so far stays put, so the garbage collector doesn't write to
+            # (and so copy) the pages the workers share with us
+            gc.collect()
+            gc.freeze()
+        return self.app
+
+    def reload(self):
+        # SIGHUP: drop the old app, so the arbiter has load() a fresh one before it forks
+        # the new workers
+        from category_cache import category_cache
+        from models import questions_changed
+
+        super().reload()
+        if self.app is not None:
+            for engine in app_engines(self.app):
+                engine.dispose()
+        self.app = self.callable = None
+        questions_changed('reset')
+        category_cache.invalidate()
+        gc.unfreeze()
+
+    # gunicorn server hooks
+    ###############################
+    def pre_fork(self, server, worker):
+        worker.forked_at = time.monotonic()
+
+    def post_fork(self, server, worker):
+        if self.app is not None:
+            # Empty anyway (the parent disposed of them), but a new pool of our own to be sure
+            for engine in app_engines(self.app):
+                engine.dispose()
+
+    def post_worker_init(self, worker):
+        worker.log.info('Worker %s ready in %.1fms after forking (%s)', worker.pid,
+                        (time.monotonic() - worker.forked_at) * 1000,
+                        'preloaded' if self.cfg.preload_app else 'loaded itself')
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Serves the trivia API from several worker processes')
+    parser.add_argument('--bind', default=DEFAULT_BIND, help=f'address to listen on (default {DEFAULT_BIND})')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'worker processes (default {DEFAULT_WORKERS})')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help=f'requests each worker serves at once (default {DEFAULT_THREADS})')
+    parser.add_argument('--graceful-timeout', type=int, default=30,
+                        help='seconds workers get to finish their requests on a reload or shutdown')
+    parser.add_argument('--pid', help='file to write the parent process id to')
+    parser.add_argument('--no-preload', action='store_true',
+                        help='have every worker load the app itself instead (slower to start)')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    TriviaServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'graceful_timeout': args.graceful_timeout,
+        'pidfile': args.pid,
+        'preload_app': not args.no_preload,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+SESSION_TTL = 60 * 60       # Seconds a quiz session lives after it was last used
+MAX_SESSIONS = 10000        # Most sessions the in-memory store keeps before evicting
+
+'''
+Quiz session stores
+
+A quiz session is a pre-shuffled deck of question ids.  Each store supports:
+    create(deck) -> session id
+    pop(session_id) -> next question id, None once the deck is empty
+                       (raises KeyError if the session doesn't exist or expired)
+Using a session is what keeps it alive, so a session expires ttl seconds after its last turn.
+'''
+
+
+class MemorySessionStore:
+    '''Keeps sessions in this process, evicting the least recently used ones.  Only good
+    for a single worker, since each worker would have its own sessions.'''
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session id -> [expires at, deck]
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        # Every use pushes the expiry out by the same ttl, so least recently used is also
+        # soonest to expire, and the expired sessions are always at the front
+        while self._sessions:
+            session_id, (expires, deck) = next(iter(self._sessions.items()))
+            if expires > now and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+    def create(self, deck):
+        session_id = secrets.token_urlsafe(16)
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session_id] = [now + self.ttl, list(deck)]
+            self._purge(now)
+        return session_id
+
+    def pop(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            session = self._sessions[session_id]    # KeyError if missing or purged
+            session[0] = now + self.ttl
+            self._sessions.move_to_end(session_id)
+            deck = session[1]
+            return deck.pop() if deck else None
+
+
+class SQLiteSessionStore:
+    '''Keeps sessions in a local SQLite file, so every worker process on the machine
+    shares them.  The deck is stored one row per card, so a turn is a couple of primary
+    key lookups no matter how long the deck is.'''
+
+    def __init__(self, path, ttl=SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS quiz_sessions (
+                    id TEXT PRIMARY KEY,
+                    expires REAL NOT NULL,
+                    next_position INTEGER NOT NULL,
+                    size INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS quiz_sessions_expires ON quiz_sessions (expires);
+                CREATE TABLE IF NOT EXISTS quiz_session_cards (
+                    session_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    question_id INTEGER NOT NULL,
+                    PRIMARY KEY (session_id, position)
+                ) WITHOUT ROWID;
+            ''')
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _purge(self, conn, now):
+        expired = '(SELECT id FROM quiz_sessions WHERE expires <= ?)'
+        conn.execute(f'DELETE FROM quiz_session_cards WHERE session_id IN {expired}', (now,))
+        conn.execute('DELETE FROM quiz_sessions WHERE expires <= ?', (now,))
+
+    def create(self, deck):
+        session_id = secrets.token_urlsafe(16)
+        deck = list(deck)
+        now = time.time()  # Wall clock, since the workers sharing the file are different processes
+        with self._connect() as conn:
+            self._purge(conn, now)
+            conn.execute('INSERT INTO quiz_sessions VALUES (?, ?, 0, ?)',
+                         (session_id, now + self.ttl, len(deck)))
+            conn.executemany('INSERT INTO quiz_session_cards VALUES (?, ?, ?)',
+                             ((session_id, position, q_id) for position, q_id in enumerate(deck)))
+        return session_id
+
+    def pop(self, session_id):
+        now = time.time()
+        with self._connect() as conn:
+            # The UPDATE takes the write lock first, so two workers can't pop the same card
+            updated = conn.execute('''
+                UPDATE quiz_sessions SET next_position = next_position + 1, expires = ?
+                WHERE id = ? AND expires > ? AND next_position < size
+            ''', (now + self.ttl, session_id, now)).rowcount
+
+            row = conn.execute('SELECT next_position, expires FROM quiz_sessions WHERE id = ?',
+                               (session_id,)).fetchone()
+            if row is None or row[1] <= now:
+                raise KeyError(session_id)
+            if not updated:
+                return None     # Deck is empty
+
+            card = conn.execute('''
+                SELECT question_id FROM quiz_session_cards WHERE session_id = ? AND position = ?
+            ''', (session_id, row[0] - 1)).fetchone()
+            return card[0]
+
+
+'''
+make_session_store(config)
+    builds the session store named by the QUIZ_SESSION_STORE setting: 'memory' (the
+    default) or 'sqlite:///<path to file>'
+'''
+
+
+def make_session_store(config):
+    store = config.get('QUIZ_SESSION_STORE', 'memory')
+    ttl = config.get('QUIZ_SESSION_TTL', SESSION_TTL)
+
+    if store == 'memory':
+        return MemorySessionStore(ttl=ttl, max_sessions=config.get('QUIZ_SESSION_MAX', MAX_SESSIONS))
+    if store.startswith('sqlite:///'):
+        return SQLiteSessionStore(store[len('sqlite:///'):], ttl=ttl)
+    raise ValueError(f'Unknown QUIZ_SESSION_STORE: {store}')
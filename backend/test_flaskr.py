@@ -1,29 +1,44 @@
+import gzip
 import os
+import tempfile
+import time
 import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
 
 from app import create_app
+try:
+    from starlette.testclient import TestClient
+    from asgi import create_asgi_app
+except ImportError:
+    create_asgi_app = None  # The async packages (requirements-async.txt) aren't installed
+from db_pool import fork_safe
+from fixtures import load_fixture
+from response_cache import FileBackend, CachedResponse, cache_key, live_caches
 from models import setup_db, Question, Category
 
 
+# Tests run against an in-memory SQLite database by default, so they don't need Postgres.
+# To run them against Postgres instead, set TRIVIA_TEST_DATABASE, e.g. to
+# postgres://postgres:a@localhost:5432/trivia_test
+database_path = os.environ.get('TRIVIA_TEST_DATABASE', 'sqlite://')
+in_memory = database_path in ('sqlite://', 'sqlite:///:memory:')
+
+
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    @classmethod
+    def setUpClass(cls):
+        """Create any missing tables and indexes in the test database, once for the whole run"""
+        create_app({'DATABASE_PATH': database_path})
+
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        self.app = self.create_app()
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.database_path = "postgres://{}/{}".format('postgres:a@localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
 
         # new question for testing
         self.new_question = {
@@ -33,6 +48,14 @@ class TriviaTestCase(unittest.TestCase):
             "difficulty": 1
             }
 
+    def create_app(self, **config):
+        """An app on the test database (with any other settings given), holding the data in trivia.psql"""
+        # The schema was already set up in setUpClass, so don't check it again for every test
+        # (except in memory, where every app gets a new, empty database)
+        app = create_app({'DATABASE_PATH': database_path, 'DB_CREATE_SCHEMA': in_memory, **config})
+        load_fixture(app)
+        return app
+
     def tearDown(self):
         """Executed after reach test"""
         pass
@@ -51,20 +74,157 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(len(data['categories']), 6)
 
+    def test_get_categories_not_modified(self):
+        """Asking for the categories again with the ETag we were given should get a 304"""
+        res = self.client().get('/api/categories')
+        etag = res.headers['ETag']
+        version = json.loads(res.data)['categories_version']
+
+        res = self.client().get('/api/categories', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+        # The version in the other responses that include categories is the same one
+        res = self.client().get('/api/questions')
+        data = json.loads(res.data)
+        self.assertEqual(data['categories_version'], version)
+
+    def test_get_categories_with_counts(self):
+        """?with_counts=1 adds the number of questions in each category, which follow adds and deletes"""
+        res = self.client().get('/api/categories?with_counts=1')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], 19)
+        self.assertEqual(data['question_counts']['3'], 3)     # Geography
+        self.assertEqual(sum(data['question_counts'].values()), 19)
+
+        # Add a Sports question, then delete it again
+        res = self.client().post('/api/questions', json=self.new_question)
+        nq_id = json.loads(res.data)['added']
+
+        res = self.client().get('/api/categories?with_counts=1')
+        data = json.loads(res.data)
+        self.assertEqual(data['total_questions'], 20)
+        self.assertEqual(data['question_counts']['6'], 3)
+
+        self.client().delete(f'/api/questions/{nq_id}')
+        res = self.client().get('/api/categories?with_counts=1')
+        data = json.loads(res.data)
+        self.assertEqual(data['total_questions'], 19)
+        self.assertEqual(data['question_counts']['6'], 2)
+
+    @unittest.skipIf(database_path.startswith('sqlite'), "SQLite has no connection pool")
+    def test_pool_status(self):
+        """The pool status endpoint reports on this worker's database connection pool"""
+        self.client().get('/api/questions')
+        res = self.client().get('/api/status/pool')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['settings']['DB_POOL_SIZE'], 5)
+        self.assertGreater(data['pool']['checkouts'], 0)
+
+    def test_fork_safe(self):
+        """A fork_safe pool never hands out a connection that another process opened"""
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f'sqlite:///{directory}/fork.db', poolclass=QueuePool)
+            fork_safe(engine)
+            with engine.connect() as conn:
+                opened = conn.connection.connection
+            with engine.connect() as conn:
+                self.assertIs(conn.connection.connection, opened)
+
+            # As if the connection in the pool was opened by the parent before a fork
+            engine.pool._pool.queue[0].info['pid'] = os.getpid() + 1
+            with engine.connect() as conn:
+                self.assertIsNot(conn.connection.connection, opened)
+                self.assertEqual(conn.execute('SELECT 1').scalar(), 1)
+            engine.dispose()
+
+    def test_read_replicas(self):
+        """GETs read from the replica, writes go to the primary, and a dead replica is skipped"""
+        with tempfile.TemporaryDirectory() as directory:
+            # A stand-in replica that's missing one question
+            replica_path = 'sqlite:///' + os.path.join(directory, 'replica.db')
+            replica = create_app({'DATABASE_PATH': replica_path})
+            load_fixture(replica)
+            with replica.app_context():
+                Question.delete_ids([2])
+
+            app = self.create_app(DB_REPLICAS=f'sqlite:////nonexistent/down.db,{replica_path}', RESPONSE_CACHE='off',
+                                  CATALOGUE_ENABLED=False)   # The catalogue always reads from the primary
+            client = app.test_client()
+            for _ in range(2):
+                data = json.loads(client.get('/api/questions').data)
+                self.assertEqual(data['total_questions'], 18)
+
+            res = client.post('/api/questions', json=self.new_question)
+            self.assertEqual(json.loads(res.data)['success'], True)
+            with app.app_context():
+                self.assertEqual(Question.query.count(), 20)
+
+            data = json.loads(client.get('/api/status/pool').data)
+            self.assertEqual([replica['healthy'] for replica in data['replicas']], [False, True])
+
+    def test_migrate_category_column(self):
+        """An old database with string categories is migrated, blank and unknown categories becoming NULL"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = 'sqlite:///' + os.path.join(directory, 'old.db')
+            engine = create_engine(path)
+            engine.execute('CREATE TABLE categories (id INTEGER PRIMARY KEY, type VARCHAR)')
+            engine.execute('CREATE TABLE questions (id INTEGER PRIMARY KEY, question VARCHAR, answer VARCHAR, '
+                           'category VARCHAR, difficulty INTEGER)')
+            engine.execute("INSERT INTO categories VALUES (1, 'Science'), (2, 'Art')")
+            engine.execute("INSERT INTO questions VALUES (1, 'a', 'a', '1', 1), (2, 'b', 'b', ' 2', 2), "
+                           "(3, 'c', 'c', '', 3), (4, 'd', 'd', '9', 4), (5, 'e', 'e', NULL, 5)")
+            engine.dispose()
+
+            app = create_app({'DATABASE_PATH': path, 'RESPONSE_CACHE': 'off'})
+            with app.app_context():
+                categories = {q.id: q.category for q in Question.query.all()}
+            self.assertEqual(categories, {1: 1, 2: 2, 3: None, 4: None, 5: None})
+
+            data = json.loads(app.test_client().get('/api/questions').data)
+            self.assertEqual(data['total_questions'], 5)
+            data = json.loads(app.test_client().get('/api/categories?with_counts=1').data)
+            self.assertEqual(data['total_questions'], 5)
+
+    def test_metrics(self):
+        """With metrics turned on, /metrics reports each endpoint's requests and queries"""
+        app = self.create_app(METRICS_ENABLED=True)
+        client = app.test_client()
+        client.get('/api/questions')
+        res = client.get('/metrics')
+        text = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_requests_total{endpoint="get_questions",method="GET",status="200"} 1', text)
+        self.assertIn('trivia_db_queries_total{endpoint="get_questions"}', text)
+        if not database_path.startswith('sqlite'):
+            self.assertIn('trivia_db_pool_checked_out', text)    # SQLite has no connection pool
+
+    def test_metrics_disabled(self):
+        """Metrics are off by default, so there's no /metrics endpoint"""
+        res = self.client().get('/metrics')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['error'], 404)
+
     def test_get_all_questions(self):
         """Gets all questions, including paginations (every 10 questions).  This endpoint should 
         return a list of questions, number of total questions, current category, categories."""
         res = self.client().get('/api/questions')
         data = json.loads(res.data)
 
-        # This endpoint should default to page one, which should have id 5 first
-        # and total questions of 19
+        # This endpoint should default to page one, which should have id 2 first
+        # (pages are ordered by id) and total questions of 19
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertEqual(len(data['categories']), 6)
         self.assertEqual(data['total_questions'], 19)
         self.assertEqual(len(data['questions']), 10)
-        self.assertEqual(data['questions'][0]['id'], 5)
+        self.assertEqual(data['questions'][0]['id'], 2)
 
     def test_pagination(self):
         """Tests the pagination by getting page 2 and looking for known features"""
@@ -80,6 +240,117 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(len(data['questions']), 9)     # Should be 9 left
         self.assertEqual(data['questions'][0]['id'], 15)
 
+    def test_pagination_after_id(self):
+        """Tests the keyset pagination mode, which should give the same page as ?page=2"""
+        res = self.client().get('/api/questions?after_id=14')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], 19)
+        self.assertEqual(len(data['questions']), 9)
+        self.assertEqual(data['questions'][0]['id'], 15)
+
+        # Nothing comes after the last question
+        res = self.client().get('/api/questions?after_id=23')
+        data = json.loads(res.data)
+        self.assertEqual(data['error'], 404)
+
+    def test_orjson_backend(self):
+        """The orjson backend (if it's installed) sends the same questions as the default one"""
+        app = self.create_app(JSON_BACKEND='orjson')
+        res = app.test_client().get('/api/questions?page=2')
+        data = json.loads(res.data)
+
+        expected = json.loads(self.client().get('/api/questions?page=2').data)
+        self.assertEqual(res.mimetype, 'application/json')
+        self.assertEqual(data, expected)
+
+    def test_questions_not_modified(self):
+        """Question pages come with an ETag, which stops matching once a question is added"""
+        res = self.client().get('/api/questions?page=2')
+        etag = res.headers['ETag']
+        self.assertIn('Last-Modified', res.headers)
+
+        res = self.client().get('/api/questions?page=2', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+        res = self.client().post('/api/questions', json=self.new_question)
+        nq_id = json.loads(res.data)['added']
+
+        res = self.client().get('/api/questions?page=2', headers={'If-None-Match': etag})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 20)
+
+        self.client().delete(f'/api/questions/{nq_id}')
+
+    def test_file_response_cache(self):
+        """The file cache shares pages between apps, ignores unknown query parameters, and
+        drops entries that are too old or too many"""
+        with tempfile.TemporaryDirectory() as directory:
+            app = self.create_app(RESPONSE_CACHE=f'file://{directory}')
+            # Or the other tests' changes would still bump it after the directory is gone
+            self.addCleanup(live_caches.discard, app.extensions['response_cache'])
+            client = app.test_client()
+            etag = client.get('/api/questions?page=2').headers['ETag']
+            res = client.get('/api/questions?page=2&utm_source=mail')
+            self.assertEqual(res.headers['ETag'], etag)
+            self.assertEqual(cache_key('/api/questions', [('x', '1'), ('page', '2'), ('page', '3')]),
+                             '/api/questions?page=2')
+
+            backend = FileBackend(os.path.join(directory, 'bounded'), max_entries=2, max_age=60)
+            for i in range(3):
+                backend.set(f'/page{i}', CachedResponse('v', 0, time.time() - i * 30, b'{}', 'application/json', ''))
+                os.utime(backend._path(f'/page{i}'), (time.time() - i, time.time() - i))
+            self.assertIsNone(backend.get('/page2'))    # 60 seconds old
+            self.assertEqual(backend.get('/page0').body, b'{}')
+            backend.prune()
+            self.assertEqual(len([name for name in os.listdir(backend.directory) if name != 'version']), 2)
+
+            # Entries are JSON, so a pickle someone else left there is never loaded
+            with open(backend._path('/page0'), 'wb') as f:
+                f.write(b'cos\nsystem\n(S"true"\ntR.')
+            self.assertIsNone(backend.get('/page0'))
+
+    def test_compressed_questions(self):
+        """Clients that accept gzip get it, and can still revalidate with the (now weak) ETag"""
+        plain = self.client().get('/api/questions?page=2')
+        self.assertNotIn('Content-Encoding', plain.headers)
+
+        res = self.client().get('/api/questions?page=2', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+        self.assertLess(len(res.data), len(plain.data))
+
+        res = self.client().get('/api/questions?page=2', headers={'Accept-Encoding': 'gzip',
+                                                                  'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
+        # Too small to be worth it
+        res = self.client().get('/api/categories', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', res.headers)
+
+    def test_questions_fields(self):
+        """?fields= cuts the questions down to the fields asked for, ?with_categories=0 drops the categories"""
+        res = self.client().get('/api/questions?page=2&fields=id,question&with_categories=0')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+        self.assertEqual(set(data['questions'][0]), {'id', 'question'})
+        self.assertNotIn('categories', data)
+        self.assertIn('categories_version', data)
+
+        res = self.client().post('/api/questions?fields=id', json={"searchTerm": "the"})
+        data = json.loads(res.data)
+        self.assertEqual(len(data['questions']), 11)
+        self.assertEqual(set(data['questions'][0]), {'id'})
+
+        res = self.client().get('/api/categories/1/questions?fields=id,secret')
+        data = json.loads(res.data)
+        self.assertEqual(data['error'], 400)
+
     def test_page_doesnt_exist(self):
         """Make sure we get a 404 error on a page which we know doesn't exist"""
         res = self.client().get('/api/questions?page=1000')
@@ -88,6 +359,18 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)  # Now using API-friendly custom error handlers
         self.assertEqual(data['error'], 404)
 
+    def test_page_out_of_range(self):
+        """Pages and ids too big for the database are pages past the end, not server errors"""
+        huge = 2 ** 70
+        for method, url in [('GET', f'/api/questions?page={huge}'), ('GET', f'/api/questions?after_id={huge}'),
+                            ('GET', f'/api/categories/1/questions?after_id={2 ** 31}'),
+                            ('POST', f'/api/questions?page={huge}')]:
+            res = self.client().open(url, method=method, json={"searchTerm": "the"})
+            self.assertEqual(json.loads(res.data)['error'], 404, url)
+
+        data = json.loads(self.client().get(f'/api/questions?after_id=-{huge}').data)
+        self.assertEqual(data['questions'][0]['id'], 2)
+
 
     def test_delete_question(self):
         """Create a new question, then test deleting it"""
@@ -116,6 +399,31 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(data['error'], 404)
 
+    def test_delete_questions(self):
+        """Delete a batch of questions, where one of them doesn't exist"""
+        ids = []
+        for _ in range(2):
+            new_question = Question(question=self.new_question['question'], answer=self.new_question['answer'], \
+                category=self.new_question['category'], difficulty=self.new_question['difficulty'])
+            new_question.insert()
+            ids.append(new_question.id)
+
+        res = self.client().delete('/api/questions', json={"ids": ids + [1000]})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['deleted'], ids)
+        self.assertEqual(data['results'][2], {"id": 1000, "success": False, "error": 404, "message": "Not found"})
+        self.assertEqual(len(Question.query.all()), 19)
+
+    def test_delete_questions_malformed(self):
+        """Batch deletes need a list of ids"""
+        for ids in ("all", [4.9], [True], ["4"], [[4]]):
+            res = self.client().delete('/api/questions', json={"ids": ids})
+            data = json.loads(res.data)
+            self.assertEqual(data['error'], 400)
+        self.assertEqual(len(Question.query.all()), 19)
+
     def test_post_new_question(self):
         """POST a new question and make sure it's in there on the last page"""
         # Count first and before doing any changes
@@ -161,6 +469,89 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['error'], 400)
 
+    def test_post_question_bad_difficulty(self):
+        """A difficulty that isn't a whole number from 1 to 5 is a 400, not rounded or stored as is"""
+        for difficulty in (2.7, True, 99, 0, "abc", None):
+            res = self.client().post('/api/questions', json={**self.new_question, "difficulty": difficulty})
+            data = json.loads(res.data)
+            self.assertEqual(data['error'], 400)
+        self.assertEqual(len(Question.query.all()), 19)
+
+        # Form fields come in as text
+        res = self.client().post('/api/questions', json={**self.new_question, "difficulty": "3"})
+        nq_id = json.loads(res.data)['added']
+        self.assertEqual(Question.query.get(nq_id).difficulty, 3)
+        self.client().delete(f'/api/questions/{nq_id}')
+
+        res = self.client().post('/api/quizzes', json={"previous_questions": [], "quiz_category": {"id": 0},
+                                                       "difficulty": 2.7})
+        self.assertEqual(json.loads(res.data)['error'], 400)
+
+    def test_bulk_add_questions_bad_difficulty(self):
+        """Bulk rows with a difficulty that isn't a whole number from 1 to 5 are bad rows"""
+        pack = "\n".join(json.dumps({**self.new_question, "difficulty": difficulty})
+                         for difficulty in (2.7, 99, False, 4))
+        data = json.loads(self.client().post('/api/questions/bulk', data=pack, content_type='application/x-ndjson').data)
+        self.assertEqual(data['added'], 1)
+        self.assertEqual([error['line'] for error in data['errors']], [1, 2, 3])
+
+        csv_text = "question,answer,category,difficulty\nWho?,Me,6,5\nWhat?,It,6,2.7\n"
+        data = json.loads(self.client().post('/api/questions/bulk', data=csv_text, content_type='text/csv').data)
+        self.assertEqual(data['added'], 1)
+        self.assertEqual([error['line'] for error in data['errors']], [3])
+        self.assertEqual(sorted(q.difficulty for q in Question.query.filter(Question.id > 23)), [4, 5])
+
+        for q_id in [q.id for q in Question.query.filter(Question.id > 23).all()]:
+            self.client().delete(f'/api/questions/{q_id}')
+
+    def test_bulk_add_questions(self):
+        """POST a small NDJSON trivia pack, with one bad row, then clean up"""
+        pack = "\n".join(json.dumps(q) for q in [
+            self.new_question,
+            {"question": "Who won the 2010 World Cup?", "answer": "Spain", "category": "6", "difficulty": 2},
+            {"question": "", "answer": "Nobody", "category": "6", "difficulty": 2}
+        ])
+        res = self.client().post('/api/questions/bulk', data=pack, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['added'], 2)
+        self.assertEqual(data['num_errors'], 1)
+        self.assertEqual(data['errors'][0]['line'], 3)
+
+        # Clean up the two new questions
+        # (Ids first, since each request's commit expires the Question objects)
+        for q_id in [q.id for q in Question.query.filter(Question.id > 23).all()]:
+            self.client().delete(f'/api/questions/{q_id}')
+        self.assertEqual(len(Question.query.all()), 19)
+
+    def test_bulk_add_csv_missing_columns(self):
+        """A CSV without all the question columns in its header is refused, naming the missing ones"""
+        for csv_text, missing in [("question,answer\nWho?,Me\n", ['category', 'difficulty']),
+                                  ("", ['question', 'answer', 'category', 'difficulty'])]:
+            res = self.client().post('/api/questions/bulk', data=csv_text, content_type='text/csv')
+            data = json.loads(res.data)
+            self.assertEqual(data['error'], 400)
+            self.assertEqual(data['missing_columns'], missing)
+
+        res = self.client().post('/api/questions/bulk', data="question,answer,category,difficulty\n",
+                                 content_type='text/csv')
+        self.assertEqual(json.loads(res.data)['added'], 0)
+
+    def test_export_questions(self):
+        """Export every question as NDJSON and CSV"""
+        res = self.client().get('/api/questions/export')
+        lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(lines), 19)
+        self.assertEqual(json.loads(lines[0])['id'], 2)
+
+        res = self.client().get('/api/questions/export?format=csv')
+        lines = res.data.decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'id,question,answer,category,difficulty')
+        self.assertEqual(len(lines), 20)
+
     def test_get_questions_of_category(self):
         """Test GET request of questions only by a certain category"""
         # Get all the questions for Geography (id=3), should be 3 questions
@@ -169,13 +560,16 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(data['success'], True)
         self.assertEqual(data['total_questions'], 3)
+        # The category is stored as an integer, but still sent as a string
+        self.assertEqual({q['category'] for q in data['questions']}, {'3'})
 
-        # Get questions for category 100 (doesn't exist, should 404)
-        res = self.client().get('/api/categories/100/questions')
-        data = json.loads(res.data)
+        # Get questions for category 100 (doesn't exist, should 404), and one too big for the database
+        for cat_id in (100, 2 ** 70):
+            res = self.client().get(f'/api/categories/{cat_id}/questions')
+            data = json.loads(res.data)
 
-        self.assertEqual(data['success'], False)
-        self.assertEqual(data['error'], 404)
+            self.assertEqual(data['success'], False)
+            self.assertEqual(data['error'], 404)
 
     def test_question_search(self):
         """Search for a term in a question"""
@@ -186,6 +580,41 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(len(data['questions']), 1)
         self.assertEqual(data['questions'][0]['id'], 12)
 
+    def test_question_search_pagination(self):
+        """Search results can be paginated with ?page=, and report the total number of hits"""
+        res = self.client().post('/api/questions?page=1', json={"searchTerm": "the"})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], 11)
+        self.assertEqual(len(data['questions']), 10)
+
+        res = self.client().post('/api/questions?page=2', json={"searchTerm": "the"})
+        data = json.loads(res.data)
+        self.assertEqual(len(data['questions']), 1)
+
+        res = self.client().post('/api/questions?page=3', json={"searchTerm": "the"})
+        data = json.loads(res.data)
+        self.assertEqual(data['error'], 404)
+
+    def test_question_search_wildcards(self):
+        """LIKE wildcards in a search term are searched for literally"""
+        res = self.client().post('/api/questions', json={"searchTerm": "%"})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), 0)
+
+    def test_question_search_max_results(self):
+        """A search without ?page= returns at most SEARCH_MAX_RESULTS hits, but the full total"""
+        client = self.create_app(SEARCH_MAX_RESULTS=3).test_client()
+        res = client.post('/api/questions', json={"searchTerm": ""})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], 19)
+        self.assertEqual(len(data['questions']), 3)
+
     # For testing the Quiz:
     # 
     # We'll test on the Geography category (3), which has 3 questions [13, 14, 15]
@@ -202,7 +631,7 @@ class TriviaTestCase(unittest.TestCase):
         data = json.loads(res.data)
         self.assertEqual(data['success'], True)                 # check success
         self.assertIsNotNone(data['question'])                  # check question is not blank
-        self.assertEqual(data['question']['category'], 3)       # check correct category
+        self.assertEqual(data['question']['category'], "3")     # check correct category (sent as a string)
 
     def test_play_quiz_2(self):
         """Tests out the quiz playing functionality"""
@@ -228,6 +657,332 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)                 # check success is false
         self.assertEqual(data['error'], 400)                     # error 400, malformed client request
 
+    def test_play_quiz_difficulty(self):
+        """Tests picking quiz questions by difficulty, from a range and on a ramp"""
+        res = self.client().post('/api/quizzes', json={"previous_questions": [], "quiz_category": {"type": "Geography", "id": "3"}, "difficulty": 3})
+        data = json.loads(res.data)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question']['difficulty'], 3)
+
+        # The only difficulty 3 Geography question has been asked, so the quiz is over
+        res = self.client().post('/api/quizzes', json={"previous_questions": [data['question']['id']], "quiz_category": {"type": "Geography", "id": "3"}, "difficulty": 3})
+        data = json.loads(res.data)
+        self.assertEqual(data['success'], True)
+        self.assertFalse('question' in data)
+
+        res = self.client().post('/api/quizzes', json={"previous_questions": [], "quiz_category": {"type": "click", "id": 0}, "difficulty": {"min": 2, "max": 3}})
+        data = json.loads(res.data)
+        self.assertIn(data['question']['difficulty'], (2, 3))
+
+        # A ramp from 1 to 4 over 4 questions is at difficulty 4 by the 4th question
+        res = self.client().post('/api/quizzes', json={"previous_questions": [1, 2, 3], "quiz_category": {"type": "click", "id": 0}, "difficulty": {"min": 1, "max": 4, "ramp": 4}})
+        data = json.loads(res.data)
+        self.assertEqual(data['question']['difficulty'], 4)
+
+    def test_play_quiz_bad_difficulty(self):
+        """Difficulties outside 1 to 5 are a malformed request"""
+        res = self.client().post('/api/quizzes', json={"previous_questions": [], "quiz_category": {"type": "click", "id": 0}, "difficulty": {"min": 4, "max": 9}})
+        data = json.loads(res.data)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['error'], 400)
+
+    def test_play_quiz_bad_previous_questions(self):
+        """previous_questions has to be a list of question ids"""
+        for previous in (None, {"id": 13}, [{"id": 13}], ["13"], [True]):
+            res = self.client().post('/api/quizzes', json={"previous_questions": previous, "quiz_category": {"id": 3}})
+            data = json.loads(res.data)
+            self.assertEqual(data['error'], 400, previous)
+
+    def test_play_quiz_round_bad_previous_questions(self):
+        """Rounds check previous_questions the same way as single questions"""
+        for previous in (None, "13", [13, None]):
+            res = self.client().post('/api/quizzes/round', json={"previous_questions": previous,
+                                                                 "quiz_category": {"id": 3}})
+            self.assertEqual(json.loads(res.data)['error'], 400, previous)
+
+    def test_play_quiz_round(self):
+        """Tests getting a whole round of quiz questions in one request"""
+        res = self.client().post('/api/quizzes/round', json={"previous_questions": [], "quiz_category": {"type": "click", "id": 0}, "num_questions": 10})
+        data = json.loads(res.data)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), 10)
+        self.assertEqual(len(set(q['id'] for q in data['questions'])), 10)   # no repeats
+
+        # Only 2 Geography questions left, so the round comes back short
+        res = self.client().post('/api/quizzes/round', json={"previous_questions": [13], "quiz_category": {"type": "Geography", "id": "3"}, "num_questions": 5})
+        data = json.loads(res.data)
+        self.assertEqual(sorted(q['id'] for q in data['questions']), [14, 15])
+
+    def test_play_quiz_round_too_big(self):
+        """Rounds bigger than QUIZ_ROUND_MAX are a malformed request"""
+        res = self.client().post('/api/quizzes/round', json={"quiz_category": {"type": "click", "id": 0}, "num_questions": 1000})
+        data = json.loads(res.data)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['error'], 400)
+
+    def test_play_quiz_seeded(self):
+        """Quizzes with the same seed ask every question once, in the same order"""
+        def play(seed):
+            previous_questions = []
+            while True:
+                res = self.client().post('/api/quizzes', json={"previous_questions": previous_questions, "quiz_category": {"type": "click", "id": 0}, "seed": seed})
+                data = json.loads(res.data)
+                if 'question' not in data:
+                    return previous_questions
+                previous_questions.append(data['question']['id'])
+
+        order = play("tournament")
+        self.assertEqual(len(set(order)), 19)
+        self.assertEqual(play("tournament"), order)
+
+        # A round from turn 5 is the same as turns 5 to 9 one at a time
+        res = self.client().post('/api/quizzes/round', json={"quiz_category": {"type": "click", "id": 0}, "seed": "tournament", "turn": 5, "num_questions": 5})
+        data = json.loads(res.data)
+        self.assertEqual([q['id'] for q in data['questions']], order[5:10])
+
+        # Not seeds
+        for seed in (True, False, 1.5, ["a"]):
+            res = self.client().post('/api/quizzes', json={"previous_questions": [], "quiz_category": {"id": 0}, "seed": seed})
+            self.assertEqual(json.loads(res.data)['error'], 400, seed)
+
+    def test_play_quiz_all_categories(self):
+        """Plays a whole quiz across all categories, which should ask every question exactly once"""
+        previous_questions = []
+        while True:
+            res = self.client().post('/api/quizzes', json={"previous_questions": previous_questions, "quiz_category": {"type": "click", "id": 0}})
+            data = json.loads(res.data)
+            self.assertEqual(data['success'], True)
+            if 'question' not in data:
+                break
+            self.assertNotIn(data['question']['id'], previous_questions)
+            previous_questions.append(data['question']['id'])
+
+        self.assertEqual(len(previous_questions), 19)
+
+    def test_catalogue(self):
+        """With the catalogue on, pages, counts and quizzes match the database, and follow changes"""
+        app = self.create_app(CATALOGUE_ENABLED=True, RESPONSE_CACHE='off')
+        client = app.test_client()
+
+        data = json.loads(client.get('/api/categories/3/questions').data)
+        self.assertEqual(data['total_questions'], 3)
+        self.assertEqual([q['id'] for q in data['questions']], [13, 14, 15])
+        data = json.loads(client.get('/api/questions?after_id=20').data)
+        self.assertEqual([q['id'] for q in data['questions']], [21, 22, 23])
+
+        res = client.post('/api/questions', json={**self.new_question, 'category': '3'})
+        nq_id = json.loads(res.data)['added']
+        data = json.loads(client.get('/api/categories?with_counts=1').data)
+        self.assertEqual(data['question_counts']['3'], 4)
+        self.assertEqual(data['total_questions'], 20)
+
+        # The only Geography question left is the new one
+        res = client.post('/api/quizzes', json={"previous_questions": [13, 14, 15], "quiz_category": {"id": 3}})
+        self.assertEqual(json.loads(res.data)['question']['id'], nq_id)
+
+        client.delete(f'/api/questions/{nq_id}')
+        data = json.loads(client.get('/api/categories/3/questions').data)
+        self.assertEqual(data['total_questions'], 3)
+
+    def test_catalogue_with_lagging_replica(self):
+        """The catalogue reads the change feed from the primary, so GETs on a replica that's
+        behind don't make it reload"""
+        with tempfile.TemporaryDirectory() as directory:
+            replica_path = 'sqlite:///' + os.path.join(directory, 'replica.db')
+            load_fixture(create_app({'DATABASE_PATH': replica_path}))
+            app = self.create_app(CATALOGUE_ENABLED=True, CATALOGUE_POLL_INTERVAL=0, DB_REPLICAS=replica_path,
+                                  RESPONSE_CACHE='off')
+            client = app.test_client()
+            client.post('/api/questions', json=self.new_question)
+
+            catalogue = app.extensions['catalogue']
+            loads = []
+            load = catalogue.load
+            catalogue.load = lambda: loads.append(1) or load()
+            for _ in range(3):
+                data = json.loads(client.get('/api/categories?with_counts=1').data)
+                self.assertEqual(data['total_questions'], 20)
+            self.assertEqual(loads, [])
+
+    def test_quiz_with_lagging_replica(self):
+        """A question the replica doesn't have yet is still served by a quiz, from the primary,
+        and isn't dropped from the catalogue"""
+        with tempfile.TemporaryDirectory() as directory:
+            replica_path = 'sqlite:///' + os.path.join(directory, 'replica.db')
+            load_fixture(create_app({'DATABASE_PATH': replica_path}))
+            app = self.create_app(CATALOGUE_ENABLED=True, CATALOGUE_POLL_INTERVAL=0, DB_REPLICAS=replica_path,
+                                  RESPONSE_CACHE='off')
+            client = app.test_client()
+            client.post('/api/questions', json=self.new_question)
+            catalogue = app.extensions['catalogue']
+            with app.app_context():
+                new_id = Question.query.order_by(Question.id.desc()).first().id
+            asked = [q_id for q_id in catalogue.ids(6) if q_id != new_id]
+
+            quiz = {'previous_questions': asked, 'quiz_category': {'id': 6}}
+            data = json.loads(client.post('/api/quizzes', json=quiz).data)
+            self.assertEqual(data['question']['id'], new_id)
+            data = json.loads(client.post('/api/quizzes/round', json=quiz).data)
+            self.assertEqual([q['id'] for q in data['questions']], [new_id])
+            self.assertIn(new_id, catalogue.ids(6))
+
+    def test_catalogue_change_feed(self):
+        """A catalogue picks up the changes other workers make, from the change feed"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = 'sqlite:///' + os.path.join(directory, 'trivia.db')
+            config = {'DATABASE_PATH': path, 'CATALOGUE_ENABLED': True, 'CATALOGUE_POLL_INTERVAL': 0,
+                      'RESPONSE_CACHE': 'off'}
+            load_fixture(create_app(config))
+            worker, other = create_app(config).test_client(), create_app(config).test_client()
+
+            res = other.post('/api/questions', json=self.new_question)
+            nq_id = json.loads(res.data)['added']
+            data = json.loads(worker.get('/api/categories/6/questions').data)
+            self.assertEqual(data['total_questions'], 3)
+            self.assertIn(nq_id, [q['id'] for q in data['questions']])
+
+            other.delete('/api/questions', json={'ids': [nq_id, 2]})
+            data = json.loads(worker.get('/api/questions').data)
+            self.assertEqual(data['total_questions'], 18)
+            self.assertNotIn(2, [q['id'] for q in data['questions']])
+
+    @unittest.skipIf(create_asgi_app is None, 'needs the packages in requirements-async.txt')
+    def test_asgi_routes(self):
+        """The routes asgi.py serves natively give the same answers as the Flask app"""
+        with tempfile.TemporaryDirectory() as directory:
+            config = {'DATABASE_PATH': 'sqlite:///' + os.path.join(directory, 'trivia.db')}
+            load_fixture(create_app(config))
+            with TestClient(create_asgi_app(config)) as client:
+                data = client.get('/api/categories').json()
+                self.assertEqual(len(data['categories']), 6)
+
+                data = client.post('/api/questions', json={"searchTerm": "  PeaNUT  "}).json()
+                self.assertEqual(data['total_questions'], 1)
+                self.assertEqual(data['questions'][0]['id'], 12)
+
+                data = client.post('/api/quizzes', json={"previous_questions": [13, 14],
+                                                         "quiz_category": {"id": 3}}).json()
+                self.assertEqual(data['question']['id'], 15)
+                data = client.post('/api/quizzes/round', json={"previous_questions": [13],
+                                                               "quiz_category": {"id": 3}}).json()
+                self.assertEqual(sorted(q['id'] for q in data['questions']), [14, 15])
+
+                data = client.post('/api/quizzes', json={"quiz_category": {"id": 3}}).json()
+                self.assertEqual(data['error'], 400)
+                for url in ('/api/questions', '/api/quizzes', '/api/quizzes/round'):
+                    res = client.post(url, content='{not json', headers={'Content-Type': 'application/json'})
+                    self.assertEqual(res.json()['error'], 400)
+
+    def test_quiz_session(self):
+        """Plays a Geography quiz through a server-side session, which deals each question once"""
+        res = self.client().post('/api/quizzes/sessions', json={"quiz_category": {"type": "Geography", "id": "3"}})
+        data = json.loads(res.data)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], 3)
+        session_id = data['session_id']
+
+        asked = []
+        for _ in range(3):
+            res = self.client().post(f'/api/quizzes/sessions/{session_id}/next')
+            data = json.loads(res.data)
+            self.assertEqual(data['success'], True)
+            asked.append(data['question']['id'])
+        self.assertEqual(sorted(asked), [13, 14, 15])
+
+        # Deck is empty, so no question key like play_quiz
+        res = self.client().post(f'/api/quizzes/sessions/{session_id}/next')
+        data = json.loads(res.data)
+        self.assertEqual(data['success'], True)
+        self.assertFalse('question' in data)
+
+    def test_quiz_session_sqlite(self):
+        """With QUIZ_SESSION_STORE=sqlite:///..., every worker deals from the same sessions,
+        and they still expire"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = 'sqlite:///' + os.path.join(directory, 'sessions.db')
+            worker, other = (self.create_app(QUIZ_SESSION_STORE=store).test_client() for _ in range(2))
+
+            res = worker.post('/api/quizzes/sessions', json={"quiz_category": {"type": "Geography", "id": "3"}})
+            session_id = json.loads(res.data)['session_id']
+            asked = []
+            for client in (worker, other, other):
+                data = json.loads(client.post(f'/api/quizzes/sessions/{session_id}/next').data)
+                asked.append(data['question']['id'])
+            self.assertEqual(sorted(asked), [13, 14, 15])
+
+            data = json.loads(worker.post(f'/api/quizzes/sessions/{session_id}/next').data)
+            self.assertEqual(data['success'], True)
+            self.assertFalse('question' in data)
+
+            # Sessions that have lived out their TTL (0 here) are gone
+            expiring = self.create_app(QUIZ_SESSION_STORE=store, QUIZ_SESSION_TTL=0).test_client()
+            res = expiring.post('/api/quizzes/sessions', json={"quiz_category": {"type": "Geography", "id": "3"}})
+            session_id = json.loads(res.data)['session_id']
+            data = json.loads(expiring.post(f'/api/quizzes/sessions/{session_id}/next').data)
+            self.assertEqual(data['error'], 404)
+
+    def test_quiz_session_doesnt_exist(self):
+        """Asking for the next question of an unknown session should 404"""
+        res = self.client().post('/api/quizzes/sessions/not-a-session/next')
+        data = json.loads(res.data)
+        self.assertEqual(data['error'], 404)
+
+    def test_rate_limit(self):
+        """With rate limiting on, a client over its search budget gets a 429 and Retry-After,
+        while adding questions and other clients aren't affected"""
+        app = self.create_app(RATE_LIMIT_ENABLED=True, RATE_LIMIT_SEARCH_PER_MINUTE=1, RATE_LIMIT_SEARCH_BURST=2,
+                              RATE_LIMIT_CLIENT_HEADER='X-Forwarded-For')
+        client = app.test_client()
+        for _ in range(2):
+            res = client.post('/api/questions', json={"searchTerm": "the"})
+            self.assertEqual(json.loads(res.data)['success'], True)
+
+        res = client.post('/api/questions', json={"searchTerm": "the"})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data['error'], 429)
+        self.assertGreater(int(res.headers['Retry-After']), 0)
+
+        res = client.post('/api/questions', json={"searchTerm": "the"}, headers={'X-Forwarded-For': '10.0.0.2'})
+        self.assertEqual(json.loads(res.data)['success'], True)
+        res = client.post('/api/questions', json=self.new_question)
+        self.assertEqual(json.loads(res.data)['success'], True)
+
+        data = json.loads(client.get('/api/status/rate_limit').data)
+        self.assertEqual(data['groups']['search']['served'], 3)
+        self.assertEqual(data['groups']['search']['rejected_rate'], 1)
+        self.assertEqual(data['groups']['search']['in_flight'], 0)
+
+    def test_rate_limit_spoofed_client(self):
+        """A client can't get a fresh budget by changing the addresses it puts in front of the ones
+        our proxies add"""
+        app = self.create_app(RATE_LIMIT_ENABLED=True, RATE_LIMIT_SEARCH_PER_MINUTE=1, RATE_LIMIT_SEARCH_BURST=2,
+                              RATE_LIMIT_CLIENT_HEADER='X-Forwarded-For')
+        client = app.test_client()
+        for i in range(3):
+            res = client.post('/api/questions', json={"searchTerm": "the"},
+                              headers={'X-Forwarded-For': f'192.168.0.{i}, 10.0.0.1'})
+        self.assertEqual(res.status_code, 429)
+        res = client.post('/api/questions', json={"searchTerm": "the"}, headers={'X-Forwarded-For': '10.0.0.2'})
+        self.assertEqual(json.loads(res.data)['success'], True)
+
+        limiter = app.extensions['rate_limiter']
+        limiter.trusted_proxies = 2
+        self.assertEqual(limiter.client('10.0.0.9', {'X-Forwarded-For': '1.2.3.4, 5.6.7.8, 10.0.0.1'}), '5.6.7.8')
+        self.assertEqual(limiter.client('10.0.0.9', {'X-Forwarded-For': '10.0.0.1'}), '10.0.0.9')
+
+    def test_rate_limit_concurrency(self):
+        """Requests over a route group's concurrency cap are turned away, whoever they're from"""
+        app = self.create_app(RATE_LIMIT_ENABLED=True, RATE_LIMIT_QUIZ_CONCURRENCY=1)
+        limiter = app.extensions['rate_limiter']
+        quiz = {'previous_questions': [], 'quiz_category': {'id': 3}}
+        with limiter.admitted('10.0.0.2', 'quiz'):
+            res = app.test_client().post('/api/quizzes', json=quiz)
+            self.assertEqual(res.status_code, 429)
+        res = app.test_client().post('/api/quizzes', json=quiz)
+        self.assertEqual(json.loads(res.data)['success'], True)
+        self.assertEqual(limiter.status()['quiz']['rejected_busy'], 1)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -11,6 +11,7 @@ class QuizView extends Component {
         this.state = {
             quizCategory: null,
             previousQuestions: [],
+            roundQuestions: [],
             showAnswer: false,
             categories: {},
             numCorrect: 0,
@@ -36,47 +37,58 @@ class QuizView extends Component {
     }
 
     selectCategory = ({ type, id = 0 }) => {
-        this.setState({ quizCategory: { type, id } }, this.getNextQuestion)
+        this.setState({ quizCategory: { type, id } }, this.getRound)
     }
 
     handleChange = (event) => {
         this.setState({ [event.target.name]: event.target.value })
     }
 
-    getNextQuestion = () => {
-        const previousQuestions = [...this.state.previousQuestions]
-        if (this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
-
+    getRound = () => {
+        // Fetch the whole round up front, rather than a request per question
         $.ajax({
-            url: '/api/quizzes',
+            url: '/api/quizzes/round',
             type: "POST",
             dataType: 'json',
             contentType: 'application/json',
             data: JSON.stringify({
-                previous_questions: previousQuestions,
-                quiz_category: this.state.quizCategory
+                previous_questions: this.state.previousQuestions,
+                quiz_category: this.state.quizCategory,
+                num_questions: questionsPerPlay
             }),
             xhrFields: {
                 withCredentials: true
             },
             crossDomain: true,
             success: (result) => {
-                this.setState({
-                    showAnswer: false,
-                    previousQuestions: previousQuestions,
-                    currentQuestion: result.question,
-                    guess: '',
-                    forceEnd: result.question ? false : true
-                })
+                // No questions (an error, which still comes back as a 200) ends the quiz, the
+                // same as a round with none left
+                this.setState({ roundQuestions: result.questions || [] }, this.getNextQuestion)
                 return;
             },
             error: (error) => {
-                alert('Unable to load question. Please try your request again')
+                alert('Unable to load questions. Please try your request again')
                 return;
             }
         })
     }
 
+    getNextQuestion = () => {
+        const previousQuestions = [...this.state.previousQuestions]
+        if (this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
+
+        // If the category had fewer questions than a round, the quiz ends early
+        const [nextQuestion, ...roundQuestions] = this.state.roundQuestions
+        this.setState({
+            showAnswer: false,
+            previousQuestions: previousQuestions,
+            roundQuestions: roundQuestions,
+            currentQuestion: nextQuestion,
+            guess: '',
+            forceEnd: nextQuestion ? false : true
+        })
+    }
+
     submitGuess = (event) => {
         event.preventDefault();
         const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g, "").toLowerCase()
@@ -91,6 +103,7 @@ class QuizView extends Component {
         this.setState({
             quizCategory: null,
             previousQuestions: [],
+            roundQuestions: [],
             showAnswer: false,
             numCorrect: 0,
             currentQuestion: {},